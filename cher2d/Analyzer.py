@@ -1,22 +1,80 @@
-from cher2d.Photon import Photon
 import numpy as np
-from scipy import stats
-from iminuit import Minuit
+from cher2d.EnsembleSampler import EnsembleSampler
+from cher2d.FitSummary import FitSummary
 
 
 class Analyzer:
     """
     An Analyzer object applies maximum likelihood to estimate emitter parameters
 
+    Expected resolution:
+    --------------------
+    For the ln likelihood model (Poisson n_pe with expectation mu, mean time with expectation tau and
+    variance t_sig^2 / n_pe, for each sensor), the Fisher information for the emitter parameters is
+
+    I_ab = sum_sensors [ d_a mu d_b mu / mu + mu d_a tau d_b tau / t_sig^2 ]
+
+    and its inverse is the expected covariance of the parameter estimates. The derivatives of the Asimov
+    expectations are found by central differences (steps: FISHER_STEPS), with all points evaluated at once.
+
+    Several tracks:
+    ---------------
+    For events with several overlapping tracks, the Analyzer is given a list of emitters. The expectations
+    are the sum over tracks, and the fit has 5 parameters per track (see get_parameter_names).
+
+    Many parameter points:
+    ----------------------
+    ln_likelihood_points evaluates the ln likelihood for an array of parameter points in one call, for
+    population based methods (grid seeding, ensembles of walkers for multimodal cases such as the mirror
+    Cherenkov ambiguity). sample() draws from the posterior (flat within LIMITS) with an EnsembleSampler.
+
     """
 
+    PARAMETER_NAMES = ['x', 'y', 'angle', 'length', 't0']
+    FISHER_STEPS = np.array([0.5, 0.5, 0.0002, 0.5, 0.01])
+    NU_DARK = 1.E-9
+    LIMITS = [(-5000., 0.), (0., 5000.), (None, None), (0.1, 3000.), (-100., 100.)]
+    ERRORS = [10., 10., 0.01, 10., 0.5]
+
     def __init__(self, detector, emitter):
         """Constructor
+            - emitter can be a list of emitters, to fit events with several tracks
         """
         self.detector = detector
         self.emitter = emitter
+        self.emitters = emitter if isinstance(emitter, list) else [emitter]
+
+        # expectations for each track at the last parameter values used (reused if those are unchanged)
+        self.track_expectations = [None] * len(self.emitters)
+
+    def get_parameter_names(self) -> list:
+        """Return the names of the fit parameters: PARAMETER_NAMES for one track, or with the track number
+        appended (x_0, y_0, ..., x_1, ...) for several tracks
+        """
+        if len(self.emitters) == 1:
+            return list(self.PARAMETER_NAMES)
+        return [name + '_' + str(i_track) for i_track in range(len(self.emitters)) for name in self.PARAMETER_NAMES]
 
     def get_minuit(self, event, guess):
+        """Return a Minuit object to fit the event
+            - guess: dictionary of parameter values, or for several tracks, a list of dictionaries
+        """
+        from iminuit import Minuit
+
+        if len(self.emitters) > 1:
+            n_par = len(self.PARAMETER_NAMES)
+
+            def fcn_tracks(values):
+                pars = [dict(zip(self.PARAMETER_NAMES, values[i:i + n_par])) for i in range(0, len(values), n_par)]
+                return -1. * self.ln_likelihood(event, pars)
+
+            fcn_tracks.errordef = Minuit.LIKELIHOOD
+            start = [track_guess[name] for track_guess in guess for name in self.PARAMETER_NAMES]
+            m = Minuit(fcn_tracks, start, name=self.get_parameter_names())
+            m.limits = self.LIMITS * len(self.emitters)
+            m.errors = self.ERRORS * len(self.emitters)
+            return m
+
         def fcn(x, y, angle, length, t0):
             pars = {'x': x, 'y': y, 'angle': angle, 'length': length, 't0': t0}
             neg_log = -1. * self.ln_likelihood(event, pars)
@@ -27,38 +85,234 @@ class Analyzer:
 
         #print(guess)
         m = Minuit(fcn, x=guess['x'], y=guess['y'], angle=guess['angle'], length=guess['length'], t0=guess['t0'])
-        m.limits = [(-5000., 0.), (0., 5000.), (None, None) , (0.1, 3000.), (-100., 100.)]
-        m.errors = (10., 10., 0.01, 10.,0.5)
+        m.limits = self.LIMITS
+        m.errors = self.ERRORS
 
         return m
 
-    def ln_likelihood(self, event, parameters: dict):
+    def fit(self, event, guess) -> dict:
+        """Fit the event (migrad followed by hesse) and return a dictionary of results:
+        the value and error ('<name>_err') of each parameter, and the 'valid', 'accurate' and 'nfcn' status
+        """
+        m = self.get_minuit(event, guess)
+        m.migrad()  # run optimiser
+        m.hesse()  # run covariance estimator
+
+        result = {}
+        for name, value, error in zip(m.parameters, m.values, m.errors):
+            result[name] = value
+            result[name + '_err'] = error
+        result['valid'] = m.valid
+        result['accurate'] = m.accurate
+        result['nfcn'] = m.nfcn
+        return result
+
+    def fit_events(self, events, guess, truth, summary: FitSummary = None, callback=None) -> FitSummary:
+        """Fit a sequence of events and accumulate the results in a FitSummary (the results are not kept)
+            - events: iterable of events, eg. a generator that produces them one at a time
+            - guess, truth: dictionaries of the starting and true parameter values (for several tracks, lists)
+            - summary: FitSummary to add to (eg. to continue a study), by default a new one
+            - callback: function called after each fit as callback(i_event, result, summary), eg. to show
+              summary.get_summary() while the study runs, or to keep selected results
+        """
+        names = self.get_parameter_names()
+        if summary is None:
+            summary = FitSummary(names)
+        truth_list = truth if isinstance(truth, list) else [truth]
+        true_values = dict(zip(names, [track_truth[name] for track_truth in truth_list
+                                       for name in self.PARAMETER_NAMES]))
+        for i_event, event in enumerate(events):
+            result = self.fit(event, guess)
+            summary.add(result, true_values)
+            if callback is not None:
+                callback(i_event, result, summary)
+        return summary
+
+    def get_track_expectations(self, parameters) -> tuple:
+        """Return the expected number of pe and sum of expected times for each sensor, summed over tracks
+            - parameters: dictionary of parameter values, or for several tracks, a list of dictionaries
+            - the expectations of each track are kept, and reused while its parameters do not change
+              (eg. when a fitter varies the parameters of one track at a time); after the detector changes,
+              only the invalidated sensors are recomputed (see Detector.update_expectations)
+        """
+        parameter_list = parameters if isinstance(parameters, list) else [parameters]
+
+        n_expected = 0.
+        sum_t = 0.
+        for i_track, (emitter, pars) in enumerate(zip(self.emitters, parameter_list)):
+            point = [pars[name] for name in self.PARAMETER_NAMES]
+            expectations = self.detector.update_expectations(emitter, point, False,
+                                                             self.track_expectations[i_track])
+            self.track_expectations[i_track] = expectations
+            n_expected = n_expected + expectations[3]
+            sum_t = sum_t + expectations[4]
+        return n_expected, sum_t
+
+    def ln_likelihood(self, event, parameters):
         """Calculate the ln likelihood of the event, given the parameter values
-        for the emitter in the parameters dictionary
+        for the emitter in the parameters dictionary (or for several tracks, a list of dictionaries)
         """
-        ln_l = 0
-        nu_dark = 1.E-9
+        nu_dark = self.NU_DARK
 
         # calculate expectations (assuming design_property mean values)
-        asimov = self.detector.get_asimov(self.emitter, parameters, False)
+        n_expected, sum_t = self.get_track_expectations(parameters)
+        geometry = self.detector.get_geometry(False)
 
         # calculate ln likelihood given those expectations:
+        # add nu_dark to avoid infinities...
+        n_expected = n_expected + nu_dark
+        t_expected = sum_t / n_expected
+
+        index = (geometry.sensor_table['module'], geometry.sensor_table['sensor'])
+        # accumulate in float64, also for events stored with reduced precision
+        n_pe = event.n_pe[index].astype(np.float64)
+        ln_l = np.sum(n_pe * np.log(n_expected) - n_expected)
 
-        n_module = self.detector.true_properties['n_module'].get_value()
-        for i_module in range(n_module):
-            module = self.detector.photo_sensor_modules[i_module]
-            n_sensor = module.true_properties['n_sensor'].get_value()
-            for i_sensor in range(n_sensor):
-                # add nu_dark to avoid infinities...
-                n_expected = asimov.n_pe[i_module][i_sensor] + nu_dark
-                t_expected = asimov.sum_t[i_module][i_sensor]/n_expected
-
-                n_pe = event.n_pe[i_module][i_sensor]
-                ln_l += n_pe*np.log(n_expected) - n_expected
-                if n_pe > 0:
-                    mean_t = event.sum_t[i_module][i_sensor]/n_pe
-                    sensor = module.photo_sensors[i_sensor]
-                    t_sig = sensor.design_properties['t_sig'].mean
-                    ln_l -= (mean_t - t_expected)**2/2./t_sig**2 * n_pe
+        hit = n_pe > 0
+        mean_t = event.sum_t[index][hit].astype(np.float64) / n_pe[hit]
+        t_sig = geometry.sensor_values['t_sig'][hit]
+        ln_l -= np.sum((mean_t - t_expected[hit])**2/2./t_sig**2 * n_pe[hit])
 
         return ln_l
+
+    def ln_likelihood_points(self, event, points):
+        """Calculate the ln likelihood of the event for many parameter points at once
+            - points: array of shape (M, 5) ordered as PARAMETER_NAMES (for several tracks, (M, 5 * n_track)
+              ordered as get_parameter_names)
+            - returns an array of M ln likelihoods (as ln_likelihood for each point)
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        n_par = len(self.PARAMETER_NAMES)
+        if points.shape[1] != n_par * len(self.emitters):
+            raise ValueError('Analyzer: parameter points must have ' + str(n_par * len(self.emitters)) + ' columns')
+
+        n_expected = 0.
+        sum_t = 0.
+        for i_track, emitter in enumerate(self.emitters):
+            n_track, sum_t_track = self.detector.get_expectations(emitter, points[:, i_track * n_par:
+                                                                                   (i_track + 1) * n_par], False)
+            n_expected = n_expected + n_track
+            sum_t = sum_t + sum_t_track
+        geometry = self.detector.get_geometry(False)
+
+        n_expected = n_expected + self.NU_DARK
+        t_expected = sum_t / n_expected
+
+        index = (geometry.sensor_table['module'], geometry.sensor_table['sensor'])
+        n_pe = event.n_pe[index].astype(np.float64)
+        ln_l = np.log(n_expected) @ n_pe - np.sum(n_expected, axis=1)
+
+        hit = n_pe > 0
+        mean_t = event.sum_t[index][hit].astype(np.float64) / n_pe[hit]
+        t_sig = geometry.sensor_values['t_sig'][hit]
+        ln_l -= ((mean_t - t_expected[:, hit])**2) @ (n_pe[hit] / 2. / t_sig**2)
+
+        return ln_l
+
+    def sample(self, event, start, n_step: int = 1000, n_burn: int = 200, n_walker: int = None) -> dict:
+        """Draw samples of the parameters from the posterior (flat prior within LIMITS) with an ensemble sampler
+            - start: dictionary of parameter values (or list for several tracks), around which the walkers start
+              (spread by ERRORS / 10), or an array of starting points (n_walker, n_par), eg. from a grid. Starting
+              points outside LIMITS are reflected back inside (or drawn uniformly within the limits, if still
+              outside), so that walkers do not share a coordinate value, which stretch moves would never change
+            - n_burn: number of initial steps discarded
+            - n_walker: number of walkers for a dictionary start (default: the larger of 32 and 2 * n_par,
+              made even)
+            - returns a dictionary with 'samples' (array (n_walker * (n_step - n_burn), n_par)), 'chain' and
+              'ln_prob' (all steps, see EnsembleSampler.run), 'acceptance' (per walker), 'tau' (integrated
+              autocorrelation time of each parameter, in steps) and 'n_effective' (independent samples for
+              each parameter)
+        """
+        n_track = len(self.emitters)
+        if isinstance(start, (dict, list)):
+            guesses = start if isinstance(start, list) else [start]
+            centre = np.array([guess[name] for guess in guesses for name in self.PARAMETER_NAMES])
+            if n_walker is None:
+                n_walker = max(32, 2 * len(centre))
+                n_walker += n_walker % 2
+            spread = np.array(self.ERRORS * n_track) / 10.
+            start = centre + spread * np.random.standard_normal(size=(n_walker, len(centre)))
+        start = np.array(np.atleast_2d(start), dtype=float)
+
+        lower = np.array([-np.inf if low is None else low for low, _ in self.LIMITS] * n_track)
+        upper = np.array([np.inf if high is None else high for _, high in self.LIMITS] * n_track)
+        start = np.where(start < lower, 2. * lower - start, start)
+        start = np.where(start > upper, 2. * upper - start, start)
+        outside = (start < lower) | (start > upper)
+        if np.any(outside):
+            low = np.broadcast_to(lower, start.shape)[outside]
+            high = np.broadcast_to(upper, start.shape)[outside]
+            start[outside] = low + (high - low) * np.random.uniform(size=len(low))
+
+        def ln_prob(points):
+            inside = np.all((points >= lower) & (points <= upper), axis=1)
+            ln_p = np.full(len(points), -np.inf)
+            if np.any(inside):
+                ln_p[inside] = self.ln_likelihood_points(event, points[inside])
+            return ln_p
+
+        sampler = EnsembleSampler(ln_prob, start.shape[1])
+        result = sampler.run(start, n_step)
+        kept = result['chain'][n_burn:]
+        result['samples'] = kept.reshape(-1, start.shape[1])
+        result['tau'] = sampler.get_autocorrelation_time(kept)
+        result['n_effective'] = len(result['samples']) / result['tau']
+        return result
+
+    def get_fisher_information(self, parameters, truth: bool = False):
+        """Return the Fisher information matrix for the emitter parameters
+            - parameters: dictionary of parameter values, or array of shape (K, 5) for K track hypotheses
+              (ordered as PARAMETER_NAMES)
+            - truth - False: the likelihood model (design_property mean values) or True: the true detector
+            - returns an array (5, 5) or (K, 5, 5)
+        """
+        if len(self.emitters) > 1:
+            raise ValueError('Analyzer: the Fisher information is only available for single track events')
+        points, single = self.__get_points(parameters)
+        n_point, n_par = points.shape
+
+        # central differences: for each point, evaluate the point and the point -/+ step for each parameter
+        shifts = np.concatenate([np.zeros((1, n_par)), -np.diag(self.FISHER_STEPS), np.diag(self.FISHER_STEPS)])
+        shifted = (points[:, np.newaxis, :] + shifts).reshape(-1, n_par)
+        n_expected, sum_t = self.detector.get_expectations(self.emitter, shifted, truth)
+        n_expected = (n_expected + self.NU_DARK).reshape(n_point, len(shifts), -1)
+        t_expected = sum_t.reshape(n_expected.shape) / n_expected
+
+        steps = 2. * self.FISHER_STEPS[:, np.newaxis]
+        d_n = (n_expected[:, 1 + n_par:] - n_expected[:, 1:1 + n_par]) / steps
+        d_t = (t_expected[:, 1 + n_par:] - t_expected[:, 1:1 + n_par]) / steps
+        n_0 = n_expected[:, np.newaxis, 0]
+        t_sig = self.detector.get_geometry(truth).sensor_values['t_sig']
+
+        fisher = np.einsum('kas,kbs->kab', d_n / n_0, d_n) + np.einsum('kas,kbs->kab', d_t * n_0 / t_sig**2, d_t)
+        if single:
+            return fisher[0]
+        return fisher
+
+    def get_expected_resolution(self, parameters, truth: bool = False) -> dict:
+        """Return the expected covariance, errors and correlations of the parameter estimates from the
+        Fisher information (see get_fisher_information for the arguments)
+            - returns a dictionary with 'fisher', 'covariance', 'errors' and 'correlation' arrays; these are NaN
+              for track hypotheses for which the parameters are not all constrained
+        """
+        points, single = self.__get_points(parameters)
+        fisher = self.get_fisher_information(points, truth)
+
+        covariance = np.full(fisher.shape, np.nan)
+        valid = np.linalg.cond(fisher) < 1. / np.finfo(float).eps
+        if np.any(valid):
+            covariance[valid] = np.linalg.inv(fisher[valid])
+        errors = np.sqrt(np.diagonal(covariance, axis1=1, axis2=2))
+        correlation = covariance / errors[:, :, np.newaxis] / errors[:, np.newaxis, :]
+
+        resolution = {'fisher': fisher, 'covariance': covariance, 'errors': errors, 'correlation': correlation}
+        if single:
+            resolution = {name: resolution[name][0] for name in resolution}
+        return resolution
+
+    def __get_points(self, parameters):
+        """Return an array of parameter points (K, 5) and whether a single dictionary was given
+        """
+        if isinstance(parameters, dict):
+            return np.array([[parameters[name] for name in self.PARAMETER_NAMES]], dtype=float), True
+        return np.atleast_2d(np.asarray(parameters, dtype=float)), False
@@ -0,0 +1,185 @@
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import time
+import numpy as np
+from cher2d.Configuration import Configuration
+from cher2d.Event import Event
+
+
+class Cache:
+    """
+    A Cache object keeps simulated events and fit results on disk, so that repeated studies skip the stages
+    whose inputs did not change
+
+    Entries are content addressed: the key is a hash of everything that determines the result
+     - events: the detector and emitter configuration hashes, the random seed, t0 and the code version
+     - fits: the detector and emitter configuration hashes, the event contents, the starting values and the code
+       version
+    The code version is a hash of the cher2d source files, so that results from older code are not reused.
+
+    Entries are written to a temporary file that is then renamed, so that several processes can share the
+    cache directory. When the total size exceeds max_bytes, the least recently used entries are removed, and so
+    are temporary files older than STALE_SECONDS (left by processes that stopped while writing).
+
+    The configuration hashes are kept for each device with its version stamp, and computed again only after the
+    device has changed, so that a job does not hash the whole detector for every event.
+
+    """
+
+    STALE_SECONDS = 3600.
+
+    _code_version = None
+
+    def __init__(self, directory: str, max_bytes: int = 10**9):
+        """Constructor
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        # {device: (version stamp, configuration hash)}
+        self.configuration_hashes = {}
+
+    @classmethod
+    def get_code_version(cls) -> str:
+        """Return a hash of the cher2d source files
+        """
+        if cls._code_version is None:
+            digest = hashlib.sha256()
+            package_directory = os.path.dirname(os.path.abspath(__file__))
+            for filename in sorted(glob.glob(os.path.join(package_directory, '*.py'))):
+                digest.update(os.path.basename(filename).encode())
+                with open(filename, 'rb') as file:
+                    digest.update(file.read())
+            cls._code_version = digest.hexdigest()
+        return cls._code_version
+
+    @classmethod
+    def get_key(cls, *parts) -> str:
+        """Return the cache key for the given parts (json serializable) and the code version
+        """
+        text = json.dumps([cls.get_code_version()] + list(parts), sort_keys=True, default=str)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get_configuration_hash(self, device) -> str:
+        """Return the configuration hash of a Detector or Emitter (see Configuration), computed again only if the
+        device has a new version stamp
+        """
+        version = device.get_version()
+        if device not in self.configuration_hashes or self.configuration_hashes[device][0] != version:
+            self.configuration_hashes[device] = (version, Configuration.from_device(device).get_hash())
+        return self.configuration_hashes[device][1]
+
+    def get_filename(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.npz')
+
+    def load(self, key: str):
+        """Return the dictionary of arrays stored with key, or None if not present
+        """
+        filename = self.get_filename(key)
+        try:
+            with np.load(filename) as contents:
+                arrays = {name: contents[name] for name in contents.files}
+            # mark as recently used
+            os.utime(filename)
+        except (FileNotFoundError, OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return arrays
+
+    def store(self, key: str, arrays: dict):
+        """Store a dictionary of arrays with key
+        """
+        descriptor, temporary = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                np.savez(file, **arrays)
+            os.replace(temporary, self.get_filename(key))
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        self.stores += 1
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries while the cache is larger than max_bytes, and the stale
+        temporary files
+        """
+        stale = time.time() - self.STALE_SECONDS
+        for filename in glob.glob(os.path.join(self.directory, '*.tmp')):
+            try:
+                if os.stat(filename).st_mtime < stale:
+                    os.remove(filename)
+            except FileNotFoundError:
+                pass
+
+        entries = []
+        for filename in glob.glob(os.path.join(self.directory, '*.npz')):
+            try:
+                status = os.stat(filename)
+            except FileNotFoundError:
+                continue
+            entries.append((status.st_mtime, status.st_size, filename))
+
+        total = sum(entry[1] for entry in entries)
+        for mtime, size, filename in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(filename)
+                self.evictions += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def get_statistics(self) -> dict:
+        """Return the hit/miss statistics of this Cache object
+        """
+        n_lookup = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'stores': self.stores, 'evictions': self.evictions,
+                'hit_rate': self.hits / n_lookup if n_lookup > 0 else 0.}
+
+    def get_event(self, detector, emitter, seed, t0: float, dtype=np.float64) -> Event:
+        """Return the event produced by the emitter with the random seed (np.random.seed argument), from the cache
+        if present, otherwise by simulating it (and storing it)
+            - dtype: storage type of the photons and event (see Event)
+        """
+        key = self.get_key('event', self.get_configuration_hash(detector), self.get_configuration_hash(emitter), seed,
+                           t0, np.dtype(dtype).name)
+        event = Event(detector, dtype)
+        arrays = self.load(key)
+        if arrays is not None:
+            event.n_pe[...] = arrays['n_pe']
+            event.sum_t[...] = arrays['sum_t']
+            return event
+
+        np.random.seed(seed)
+        event = detector.stream_event(emitter.emit_chunks(t0, dtype), dtype)
+        self.store(key, {'n_pe': event.n_pe, 'sum_t': event.sum_t})
+        return event
+
+    def get_fit(self, analyzer, event, guess) -> dict:
+        """Return the result of Analyzer.fit for the event, from the cache if present, otherwise by fitting
+        (and storing it)
+        """
+        event_hash = hashlib.sha256(np.ascontiguousarray(event.n_pe).tobytes() +
+                                    np.ascontiguousarray(event.sum_t).tobytes()).hexdigest()
+        key = self.get_key('fit', self.get_configuration_hash(analyzer.detector),
+                           [self.get_configuration_hash(emitter) for emitter in analyzer.emitters], event_hash, guess)
+        arrays = self.load(key)
+        if arrays is not None:
+            return {name: arrays[name].item() for name in arrays}
+
+        result = analyzer.fit(event, guess)
+        self.store(key, {name: np.asarray(result[name]) for name in result})
+        return result
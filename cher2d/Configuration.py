@@ -0,0 +1,159 @@
+import hashlib
+import json
+import numpy as np
+from cher2d.DesignProperty import DesignProperty
+from cher2d.Detector import Detector
+from cher2d.Emitter import Emitter
+from cher2d.Geometry import Geometry
+
+
+class Configuration:
+    """
+    A Configuration object is a compact, versioned record of a Detector or Emitter: its design properties
+    (including offsets) and the true values of all of its devices, held as arrays
+
+    It can be saved to and loaded from a numpy .npz file (no pickle), and has a stable content hash that
+    identifies the configuration (eg. as a cache key for results). A detector configuration also holds the
+    flat geometry tables, so these are available without rebuilding the detector.
+
+     - meta: dictionary with the format version, kind of device, device ids and the design property definitions
+     - arrays: dictionary of arrays of true values, 'true:<set>:<name>' with one entry per device in the set
+
+    """
+
+    FORMAT_VERSION = 1
+    KINDS = ['Detector', 'Emitter']
+
+    def __init__(self, meta: dict, arrays: dict):
+        """Constructor
+        """
+        if meta['format_version'] != self.FORMAT_VERSION:
+            raise ValueError('Error in constructing Configuration: format version ' + str(meta['format_version']) +
+                             ' is not supported (expected ' + str(self.FORMAT_VERSION) + ')')
+        if meta['kind'] not in self.KINDS:
+            raise ValueError('Error in constructing Configuration: kind must be one of:', '/'.join(self.KINDS))
+        self.meta = meta
+        self.arrays = arrays
+
+    @classmethod
+    def from_device(cls, device):
+        """Record the configuration of a Detector or Emitter
+        """
+        kind = type(device).__name__
+        if kind == 'Detector':
+            modules = device.photo_sensor_modules
+            sensors = [sensor for module in modules for sensor in module.photo_sensors]
+            device_sets = [[device], modules, sensors]
+        elif kind == 'Emitter':
+            device_sets = [[device]]
+        else:
+            raise ValueError('Error in constructing Configuration: kind must be one of:', '/'.join(cls.KINDS))
+
+        meta = {'format_version': cls.FORMAT_VERSION, 'kind': kind, 'exact': bool(device.exact),
+                'device_ids': [[int(item.device_id) for item in devices] for devices in device_sets],
+                'design_properties': []}
+        arrays = {}
+        for i_set, devices in enumerate(device_sets):
+            definitions = []
+            for name in devices[0].design_properties:
+                design_property = devices[0].design_properties[name]
+                definition = [design_property.name, design_property.description, design_property.property_type,
+                              design_property.distribution, design_property.mean, design_property.sigma,
+                              design_property.get_offset()]
+                definitions.append([cls.__native(item) for item in definition])
+                dtype = DesignProperty.VALUE_DTYPES[design_property.property_type]
+                arrays['true:' + str(i_set) + ':' + name] = np.array(
+                    [item.true_properties[name].get_value() for item in devices], dtype=dtype)
+            meta['design_properties'].append(definitions)
+
+        if kind == 'Detector':
+            for truth in [True, False]:
+                geometry = device.get_geometry(truth)
+                for prefix, table in [('module', geometry.module_table), ('sensor', geometry.sensor_table),
+                                      ('value', geometry.sensor_values)]:
+                    for name in table:
+                        arrays['geometry:' + str(truth) + ':' + prefix + ':' + name] = table[name]
+
+        return cls(meta, arrays)
+
+    @staticmethod
+    def __native(value):
+        # numpy scalars are stored as python values
+        if isinstance(value, np.generic):
+            return value.item()
+        return value
+
+    def save(self, filename):
+        """Save the configuration to a numpy .npz file
+        """
+        np.savez(filename, meta=np.array(json.dumps(self.meta)), **self.arrays)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a configuration saved with save()
+        """
+        with np.load(filename) as contents:
+            meta = json.loads(str(contents['meta']))
+            arrays = {key: contents[key] for key in contents.files if key != 'meta'}
+        return cls(meta, arrays)
+
+    def get_hash(self) -> str:
+        """Return a stable hash (hex string) of the configuration: design properties, offsets and true values
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps(self.meta, sort_keys=True).encode())
+        for key in sorted(self.arrays):
+            if key.startswith('true:'):
+                array = self.arrays[key]
+                array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+                digest.update(key.encode())
+                digest.update(array.dtype.str.encode())
+                digest.update(array.tobytes())
+        return digest.hexdigest()
+
+    def get_design_properties(self) -> list:
+        """Return new design property dictionaries (one per set), with the recorded offsets
+        """
+        design_property_sets = []
+        for definitions in self.meta['design_properties']:
+            design_properties = {}
+            for definition in definitions:
+                name, description, property_type, distribution, mean, sigma, offset = definition
+                design_property = DesignProperty(name, description, property_type, distribution, mean, sigma)
+                design_property.set_offset(DesignProperty.PROPERTY_TYPES[property_type](offset))
+                design_properties[name] = design_property
+            design_property_sets.append(design_properties)
+        return design_property_sets
+
+    def build(self):
+        """Reconstruct the Detector or Emitter, with the recorded true values (no random sampling)
+        """
+        design_property_sets = self.get_design_properties()
+        device_ids = self.meta['device_ids']
+        if self.meta['kind'] == 'Detector':
+            device = Detector(device_ids[0][0], *design_property_sets, exact=True)
+        else:
+            device = Emitter(device_ids[0][0], design_property_sets[0], exact=True)
+        device.exact = self.meta['exact']
+
+        for i_set, design_properties in enumerate(design_property_sets):
+            for name in design_properties:
+                design_properties[name].set_values(self.arrays['true:' + str(i_set) + ':' + name])
+
+        if self.meta['kind'] == 'Detector':
+            for truth in [True, False]:
+                device.set_geometry(self.get_geometry(truth))
+        return device
+
+    def get_geometry(self, truth: bool) -> Geometry:
+        """Return the flat geometry tables of a detector configuration, without building the detector
+        """
+        if self.meta['kind'] != 'Detector':
+            raise ValueError('Configuration: geometry tables are only available for a Detector')
+        tables = {'module': {}, 'sensor': {}, 'value': {}}
+        prefix = 'geometry:' + str(truth) + ':'
+        for key in self.arrays:
+            if key.startswith(prefix):
+                table, name = key[len(prefix):].split(':')
+                tables[table][name] = self.arrays[key]
+        return Geometry(tables['module'], tables['sensor'], tables['value'], truth)
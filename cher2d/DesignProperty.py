@@ -1,7 +1,7 @@
 from cher2d.Property import Property
 from cher2d.TrueProperty import TrueProperty
+import itertools
 import numpy as np
-from scipy import stats
 
 
 class DesignProperty(Property):
@@ -11,6 +11,10 @@ class DesignProperty(Property):
     """
 
     DISTRIBUTIONS = ['exact', 'norm', 'gamma', 'beta', 'uniform']
+    VALUE_DTYPES = {'int': np.int64, 'float': np.float64, 'bool': np.bool_}
+
+    # version stamps: increase whenever the mean or the true values of the devices built with a property change
+    _version_counter = itertools.count(1)
 
     def __init__(self, name: str, description: str, property_type: str,
                  distribution: str, mean, sigma):
@@ -29,7 +33,13 @@ class DesignProperty(Property):
                              '): beta distribution mean outside range (0,1)')
         self.mean = mean
         self.sigma = sigma
+
+        # registry of devices built with this property: the true values are held in one array (in order of
+        # registration) so that offsets can be applied to all devices at once
         self.devices = []
+        self.__device_index = {}
+        self.__values = np.zeros(16, dtype=self.VALUE_DTYPES[property_type])
+        self.version = next(self._version_counter)
 
         self.__offset = None
         if property_type == 'int':
@@ -39,9 +49,63 @@ class DesignProperty(Property):
         elif property_type == 'bool':
             self.set_offset(False)
 
-    def add_device(self, device):
-        if device not in self.devices:
+    @property
+    def mean(self):
+        return self.__mean
+
+    @mean.setter
+    def mean(self, mean):
+        # the design mean is used for the likelihood model: a change is a new version
+        self.__mean = mean
+        self.version = next(self._version_counter)
+
+    def add_device(self, device) -> int:
+        """
+        Register a device built with this property and return its index in the true value array
+
+        """
+        index = self.__device_index.get(device)
+        if index is None:
+            index = len(self.devices)
+            if index == len(self.__values):
+                self.__values = np.concatenate([self.__values, np.zeros_like(self.__values)])
             self.devices.append(device)
+            self.__device_index[device] = index
+        return index
+
+    def get_device_index(self, device) -> int:
+        """
+        Return the index of a registered device in the true value array
+        """
+        return self.__device_index[device]
+
+    def get_values(self):
+        """
+        Return a read only array of the true values for all registered devices (in order of registration)
+
+        """
+        values = self.__values[:len(self.devices)]
+        values.flags.writeable = False
+        return values
+
+    def set_values(self, values):
+        """
+        Set the true values for all registered devices (in order of registration)
+
+        """
+        values = np.asarray(values)
+        if values.shape != (len(self.devices),):
+            raise ValueError('Error in setting values of DesignProperty (' + self.name +
+                             '): expected ' + str(len(self.devices)) + ' values')
+        self.__values[:len(self.devices)] = values
+        self.version = next(self._version_counter)
+
+    def get_true_value(self, index: int):
+        return self.__values[index].item()
+
+    def set_true_value(self, index: int, value):
+        self.__values[index] = value
+        self.version = next(self._version_counter)
 
     def get_offset(self):
         """
@@ -57,6 +121,28 @@ class DesignProperty(Property):
         - after changing the offset, these are applied to any devices built with this design property
 
         """
+        self.__check_offset(offset)
+        self.__apply_offset(offset)
+        self.version = next(self._version_counter)
+
+    @classmethod
+    def set_offsets(cls, offsets: dict):
+        """
+        Set the offsets of several properties at once, eg. for a systematic scan
+        - offsets: dictionary of {DesignProperty: offset}
+        - all offsets are checked before any is applied, and the changed properties share one version stamp,
+          so that derived quantities are invalidated only once
+
+        """
+        for design_property in offsets:
+            design_property.__check_offset(offsets[design_property])
+
+        version = next(cls._version_counter)
+        for design_property in offsets:
+            design_property.__apply_offset(offsets[design_property])
+            design_property.version = version
+
+    def __check_offset(self, offset):
         offset_type = type(offset).__name__
         # avoid issues with float64 vs float
         if offset_type[:len(self.property_type)] != self.property_type:
@@ -65,22 +151,21 @@ class DesignProperty(Property):
                             ') does not match property_type (' +
                             self.property_type + ')')
 
-        if len(self.devices) > 0:
+    def __apply_offset(self, offset):
+        n_device = len(self.devices)
+        if n_device > 0:
+            values = self.__values[:n_device]
             if self.property_type in ['int', 'float']:
-                diff_offset = offset - self.__offset
-                for device in self.devices:
-                    value = device.true_properties[self.name].get_value()
-                    device.true_properties[self.name].set_value(value + diff_offset)
+                values += offset - self.__offset
             elif self.property_type == 'bool':
                 if offset != self.__offset:
-                    for device in self.devices:
-                        value = device.true_properties[self.name].get_value()
-                        device.true_properties[self.name].set_value(not value)
+                    np.logical_not(values, out=values)
 
         self.__offset = offset
 
-    def get_TrueProperty(self, exact):
+    def get_TrueProperty(self, exact, device=None):
         """Return a TrueProperty object according to the distribution and offset
+         - if a device is given, it is registered and the true value is held in the array of true values
         """
 
         true_value = None
@@ -89,27 +174,30 @@ class DesignProperty(Property):
             true_value = self.mean
 
         elif self.distribution == 'norm':
-            true_value = stats.norm.rvs(self.mean, self.sigma)
+            true_value = np.random.normal(self.mean, self.sigma)
 
         elif self.distribution == 'gamma':
-            loc = 0.
             a = (self.mean / self.sigma) ** 2
             scale = self.sigma ** 2 / self.mean
-            true_value = stats.gamma.rvs(a, loc, scale)
+            true_value = np.random.gamma(a, scale)
 
         elif self.distribution == 'beta':
             term = (self.mean * (1. - self.mean)) / self.sigma ** 2 - 1.
             a = term * self.mean
             b = term * (1. - self.mean)
-            true_value = stats.beta.rvs(a, b)
+            true_value = np.random.beta(a, b)
 
         elif self.distribution == 'uniform':
             scale = self.sigma * np.sqrt(12.)
             loc = self.mean - scale / 2.
-            true_value = stats.uniform.rvs(loc, scale)
+            true_value = np.random.uniform(loc, loc + scale)
 
         # apply the offset (not for bool!)
         if self.property_type != 'bool':
             true_value += self.__offset
 
-        return TrueProperty(self.name, self.description, self.property_type, true_value)
+        true_property = TrueProperty(self.name, self.description, self.property_type, true_value)
+        if device is not None:
+            true_property.bind(self, self.add_device(device))
+
+        return true_property
@@ -2,15 +2,20 @@ from cher2d.Device import Device
 from cher2d.PhotoSensorModule import PhotoSensorModule
 from cher2d.DesignProperty import DesignProperty
 from cher2d.Event import Event
+from cher2d.Geometry import Geometry
+from cher2d.PhotonBundle import PhotonBundle
+from cher2d.ResponseMap import ResponseMap
 from cher2d.Photon import Photon
 import numpy as np
-from scipy import stats
 
 
 class Detector(Device):
     """
     A Detector object is a group of PhotoSensorModules
 
+    Derived quantities (geometry tables, response maps and Asimov expectations) are cached, and after design
+    properties change, they are recomputed only for the sensors that depend on the changed properties.
+
     A position and angular PMT response is included as follows:
      - r is distance from centre of PMT
      - theta is angle of photon wrt normal of PMT surface (constant across surface)
@@ -55,6 +60,9 @@ class Detector(Device):
 
     """
 
+    INVALIDATION_LOG_LENGTH = 100
+    ASIMOV_CACHE_LENGTH = 8
+
     def __init__(self, detector_id: int, design_properties: dict, photo_sensor_model_design_properties: dict,
                  photo_sensor_design_properties: dict, exact: bool = False):
         """Constructor
@@ -67,185 +75,428 @@ class Detector(Device):
             self.photo_sensor_modules.append(PhotoSensorModule(i_module, photo_sensor_model_design_properties,
                                                                photo_sensor_design_properties, exact))
 
+        self.design_property_sets = [design_properties, photo_sensor_model_design_properties,
+                                     photo_sensor_design_properties]
+        self.geometries = {}
+        self.responses = {}
+        self.response_overrides = {}
+        self.response_version = 0
+        # expectations of get_asimov for the most recently used (emitter, truth), oldest first
+        self.asimov_expectations = {}
+
+        # sensors invalidated by each rebuild of the geometry tables: the latest report and a log of
+        # (version, sensor rows, rows with changed property values), with None for all rows
+        self.invalidated = {}
+        self.invalidation_logs = {}
+
+    def get_children(self) -> list:
+        return self.photo_sensor_modules
+
+    def get_geometry(self, truth: bool) -> Geometry:
+        """Return the flat geometry tables of the detector
+            - truth - True: true values or False: design means
+            - the tables are built once, and after a property of the detector has changed, only the rows that
+              depend on it are rebuilt (see Geometry.update); what was invalidated is kept in self.invalidated
+        """
+        version = self.get_version()
+        geometry = self.geometries.get(truth)
+        if geometry is None or geometry.version != version:
+            if geometry is None:
+                geometry = Geometry.from_detector(self, truth)
+                report = {'properties': [], 'modules': np.arange(geometry.n_module),
+                          'sensors': np.arange(geometry.n_sensor), 'values': np.arange(geometry.n_sensor),
+                          'full': True}
+            else:
+                geometry, report = geometry.update(self)
+            geometry.version = version
+            self.geometries[truth] = geometry
+            self.__log_invalidated(truth, version, report)
+        return geometry
+
+    def __log_invalidated(self, truth: bool, version: int, report: dict):
+        self.invalidated[truth] = report
+        log = self.invalidation_logs.setdefault(truth, [])
+        if report['full']:
+            log.append((version, None, None))
+        else:
+            log.append((version, report['sensors'], report['values']))
+        del log[:-self.INVALIDATION_LOG_LENGTH]
+
+    def get_invalidated_sensors(self, truth: bool, since_version: int, values_only: bool = False):
+        """Return the array of sensor rows whose geometry or property values changed since the version stamp,
+        or None if all sensors are to be recomputed
+            - values_only: only the rows whose property values changed (eg. for response maps)
+        """
+        self.get_geometry(truth)
+        log = self.invalidation_logs[truth]
+        if since_version < log[0][0]:
+            return None
+        rows = [np.zeros(0, dtype=int)]
+        for version, sensors, values in log:
+            if values_only:
+                sensors = values
+            if version > since_version:
+                if sensors is None:
+                    return None
+                rows.append(sensors)
+        return np.unique(np.concatenate(rows))
+
+    def set_geometry(self, geometry: Geometry):
+        """Use geometry tables built previously (eg. loaded from disk) for this detector
+        """
+        geometry.version = self.get_version()
+        self.geometries[geometry.truth] = geometry
+        self.__log_invalidated(geometry.truth, geometry.version,
+                               {'properties': [], 'modules': np.arange(geometry.n_module),
+                                'sensors': np.arange(geometry.n_sensor), 'values': np.arange(geometry.n_sensor),
+                                'full': True})
+
+    def get_response(self, truth: bool) -> ResponseMap:
+        """Return the photosensor response maps
+            - truth - True: true values or False: design means
+            - maps set with set_response are used if present, otherwise analytic maps are built from the
+              photosensor properties (and after a property has changed, rebuilt for the invalidated sensors only)
+        """
+        if truth in self.response_overrides:
+            return self.response_overrides[truth]
+        version = self.get_version()
+        response = self.responses.get(truth)
+        if response is None or response.version != version:
+            geometry = self.get_geometry(truth)
+            sensors = None if response is None else self.get_invalidated_sensors(truth, response.version, True)
+            if sensors is None:
+                response = ResponseMap.from_geometry(geometry)
+            elif len(sensors) > 0:
+                response = response.update(geometry, sensors)
+            response.version = version
+            self.responses[truth] = response
+        return response
+
+    def set_response(self, response: ResponseMap, truth: bool = None):
+        """Use the given response maps (eg. measured PMT response, loaded from a file) instead of the analytic maps
+            - truth - True: for true response, False: for the likelihood, None: for both
+            - the detector gets a new version stamp, and all sensors are invalidated, so that the cached
+              expectations (eg. of get_asimov and Analyzer) are recomputed
+        """
+        # the existing geometry tables are brought up to date, and kept with the new version stamp
+        for flag in list(self.geometries):
+            self.get_geometry(flag)
+        self.response_version = next(DesignProperty._version_counter)
+        flags = [flag for flag in [True, False] if truth is None or truth == flag]
+        for flag in flags:
+            self.response_overrides[flag] = response
+        no_rows = np.zeros(0, dtype=int)
+        for flag, geometry in self.geometries.items():
+            geometry.version = self.response_version
+            rows = np.arange(geometry.n_sensor) if flag in flags else no_rows
+            self.__log_invalidated(flag, self.response_version, {'properties': [], 'modules': no_rows,
+                                                                 'sensors': rows, 'values': rows,
+                                                                 'full': flag in flags})
+
+    def get_version(self) -> int:
+        """Return the latest version stamp of the design properties used to build the detector (or of the
+        response maps, if set later)
+        """
+        return max([self.response_version] + [design_property.version for design_properties in
+                                              self.design_property_sets for design_property in
+                                              design_properties.values()])
+
     def get_asimov(self, emitter, parameters: dict, truth: bool):
         """Produce an Asimov event: expectation values for n_pe and times
             - parameters: the emitter parameters that are being estimated
             - truth - True: for generating an Asimov event or False: use design_mean (for calculating likelihood)
+            - for events with several tracks, emitter and parameters are lists (one entry per track) and
+              the expectations of the tracks are summed
+            - the expectations are kept for the ASIMOV_CACHE_LENGTH most recently used (emitter, truth), so that
+              after a design change only the invalidated sensors are recomputed
         """
         asimov = Event(self)
 
-        x_e = parameters['x']
-        y_e = parameters['y']
-        angle_e = parameters['angle']
-        length_e = parameters['length']
-        t0_e = parameters['t0']
+        emitters = emitter if isinstance(emitter, list) else [emitter]
+        parameter_list = parameters if isinstance(parameters, list) else [parameters]
+
+        sensor_table = self.get_geometry(truth).sensor_table
+        index = (sensor_table['module'], sensor_table['sensor'])
+        for emitter, parameters in zip(emitters, parameter_list):
+            point = [parameters[name] for name in ['x', 'y', 'angle', 'length', 't0']]
+            expectations = self.update_expectations(emitter, point, truth,
+                                                    self.asimov_expectations.pop((emitter, truth), None))
+            self.asimov_expectations[(emitter, truth)] = expectations
+            while len(self.asimov_expectations) > self.ASIMOV_CACHE_LENGTH:
+                del self.asimov_expectations[next(iter(self.asimov_expectations))]
+            asimov.n_pe[index] += expectations[3]
+            asimov.sum_t[index] += expectations[4]
+
+        return asimov
+
+    def update_expectations(self, emitter, point, truth: bool, expectations: tuple = None) -> tuple:
+        """Return the expectations for one emitter parameter point, as a tuple
+        (point, detector version, emitter version, n_pe, sum_t)
+            - expectations: a tuple returned previously for the same emitter; if it is for the same point, only
+              the sensors invalidated since are recomputed
+        """
+        point = tuple(point)
+        version = self.get_version()
+        emitter_version = emitter.get_version()
+        if expectations is not None and expectations[0] == point and expectations[2] == emitter_version:
+            if expectations[1] == version:
+                return expectations
+            sensors = self.get_invalidated_sensors(truth, expectations[1])
+            if sensors is not None:
+                n_pe = expectations[3].copy()
+                sum_t = expectations[4].copy()
+                if len(sensors) > 0:
+                    n_sensors, sum_t_sensors = self.get_expectations(emitter, [point], truth, sensors)
+                    n_pe[sensors] = n_sensors[0]
+                    sum_t[sensors] = sum_t_sensors[0]
+                return point, version, emitter_version, n_pe, sum_t
+
+        n_pe, sum_t = self.get_expectations(emitter, [point], truth)
+        return point, version, emitter_version, n_pe[0], sum_t[0]
+
+    def get_expectations(self, emitter, points, truth: bool, sensors=None):
+        """Return the expected number of pe and the sum of their expected times for each photosensor
+            - points: emitter parameters, array of shape (M, 5) ordered as x, y, angle, length, t0
+            - truth - True: for generating an Asimov event or False: use design_mean (for calculating likelihood)
+            - sensors: optional array of sensor rows, to evaluate a subset of the sensors
+            - returns two arrays of shape (M, n_sensor), with sensors ordered as in the geometry tables
+        """
+        geometry = self.get_geometry(truth)
+        response = self.get_response(truth)
+        if sensors is None:
+            sensors = np.arange(geometry.n_sensor)
+        values = {name: geometry.sensor_values[name][sensors] for name in ['qe', 'td']}
 
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        x_e, y_e, angle_e, length_e, t0_e = [points[:, [i]] for i in range(5)]
+
+        ch_angle = emitter.get_value('ch_angle', truth)
         ch_density = emitter.get_value('ch_density', truth)
         velocity_e = emitter.get_value('velocity', truth)
 
-        n_module = self.get_value('n_module', True)
-        for i_module in range(n_module):
-            i_str = str(i_module)
-            x_m = self.get_value('x_' + i_str, truth)
-            y_m = self.get_value('y_' + i_str, truth)
-            angle_m = self.get_value('angle_' + i_str, truth)
-
-            module = self.photo_sensor_modules[i_module]
-            n_sensor = module.get_value('n_sensor', True)
-            for i_sensor in range(n_sensor):
-                i_str = str(i_sensor)
-                x_s = module.get_value('x_' + i_str, truth)
-                y_s = module.get_value('y_' + i_str, truth)
-                angle_s = module.get_value('angle_' + i_str, truth)
-
-                sensor = module.photo_sensors[i_sensor]
-                width_s = sensor.get_value('width', truth)
-
-                # The expected number of pe is calculated by finding the start and end point of the emitter path
-                # that produces photons that hit the sensor
-
-                x_s_0 = x_s - width_s / 2. * np.cos(angle_s)
-                y_s_0 = y_s - width_s / 2. * np.sin(angle_s)
-                x_d_0, y_d_0, angle_d = sensor.get_global_orientation([x_s_0, y_s_0, angle_s], [x_m, y_m, angle_m])
-
-                x_s_1 = x_s + width_s / 2. * np.cos(angle_s)
-                y_s_1 = y_s + width_s / 2. * np.sin(angle_s)
-                x_d_1, y_d_1, angle_d = sensor.get_global_orientation([x_s_1, y_s_1, angle_s], [x_m, y_m, angle_m])
-
-                for sign in [-1., 1.]:
-                    # make a virtual photon that starts at one edge of sensor, and points back towards emitter
-                    angle = angle_e + sign * emitter.get_value('ch_angle', truth) + np.pi
-                    photon_0 = Photon(0., x_d_0, y_d_0, angle)
-                    x_0, y_0 = module.find_intersection(photon_0, [x_e, y_e, angle_e])
-                    t_0 = np.sqrt((x_0 - x_d_0) ** 2 + (y_0 - y_d_0) ** 2) / photon_0.VELOCITY
-                    dist_0 = (x_0 - x_e) * np.cos(angle_e) + (y_0 - y_e) * np.sin(angle_e)
-                    dist_0 = min(length_e, max(0., dist_0))
-
-                    photon_1 = Photon(0., x_d_1, y_d_1, angle)
-                    x_1, y_1 = module.find_intersection(photon_1, [x_e, y_e, angle_e])
-                    t_1 = np.sqrt((x_1 - x_d_1) ** 2 + (y_1 - y_d_1) ** 2) / photon_1.VELOCITY
-                    dist_1 = (x_1 - x_e) * np.cos(angle_e) + (y_1 - y_e) * np.sin(angle_e)
-                    dist_1 = min(length_e, max(0., dist_1))
-
-                    # path length contributing photons
-                    path_length = np.abs(dist_1 - dist_0)
-                    if path_length > 0.:
-                        # expected number of photons: half of them on other side of emitter
-                        n_photons_expected = path_length * ch_density / 2.
-                        qe = sensor.get_value('qe', truth)
-                        theta = angle - angle_d - np.pi/2.
-                        if sensor.get_value('qe_angle', truth):
-                            c_a = sensor.get_value('qe_angle_coeff', truth)
-                            if c_a > 0.:
-                                factor = np.exp(-1. / c_a / np.cos(theta))
-                                qe *= (1. - factor)
-                        n_expected = n_photons_expected * qe
-                        c_qe = 0.
-                        if sensor.get_value('qe_radial', truth):
-                            c_qe = sensor.get_value('qe_radial_coeff', truth)
-                            n_expected *= (1. * c_qe/2.)/(1. + abs(c_qe))
-
-                        t_expected = 0.5 * (t_0 + t_1 + (dist_0 + dist_1) / velocity_e) + t0_e
-                        # transit time delay (within PMT)
-                        c_td = 0.
-                        if sensor.get_value('td_radial', truth):
-                            c_td = sensor.get_value('td_radial_coeff', truth)
-                        delay = sensor.get_value('td', truth) * (1. + c_td/2. + c_qe/2. + c_td*c_qe/3.)/(1. + c_qe/2.)
-
-                        asimov.add_pe(i_module, i_sensor, t_expected + delay, n_pe=n_expected)
+        # sensor response expectations that do not depend on the emitter
+        qe = values['qe'] * response.get_expected_radial(sensors)
+        delay = values['td'] * response.get_expected_delay(sensors)
 
-        return asimov
+        n_pe = np.zeros((len(points), len(sensors)))
+        sum_t = np.zeros((len(points), len(sensors)))
+        for sign in [-1., 1.]:
+            # The expected number of pe is calculated by finding the start and end point of the emitter path
+            # that produces photons that hit the sensor
+            travel_0, dist_0 = geometry.get_emission(x_e, y_e, angle_e, ch_angle, sign, 0, sensors)
+            travel_1, dist_1 = geometry.get_emission(x_e, y_e, angle_e, ch_angle, sign, 1, sensors)
+            dist_0 = np.minimum(length_e, np.maximum(0., dist_0))
+            dist_1 = np.minimum(length_e, np.maximum(0., dist_1))
+
+            # path length contributing photons: half of them on other side of emitter
+            path_length = np.abs(dist_1 - dist_0)
+            n_expected = path_length * ch_density / 2. * qe
 
-    def get_event(self, emitter) -> Event:
+            # angle of the photon (pointing back towards the emitter) wrt the sensor normal
+            angle = angle_e + sign * ch_angle + np.pi
+            theta = angle - geometry.sensor_table['angle'][sensors] - np.pi/2.
+            n_expected *= response.get_angular(sensors, theta)
+
+            t_expected = 0.5 * (travel_0 + travel_1) / Photon.VELOCITY + 0.5 * (dist_0 + dist_1) / velocity_e + t0_e
+
+            n_pe += n_expected
+            sum_t += (t_expected + delay) * n_expected
+
+        return n_pe, sum_t
+
+    def get_event(self, emitter, dtype=np.float64) -> Event:
         """Produce an event from the emitter photons
+            - emitter can be a list of emitters: their photons are overlaid in one event (pile-up), or an iterable
+              of PhotonBundles (eg. Emitter.emit_chunks), see stream_event
+            - dtype: storage type of the event arrays (see Event)
         """
-        event = Event(self)
-
-        n_pe = 0
-        sum_times = 0.
-
-        n_module = self.true_properties['n_module'].get_value()
-        for photon in emitter.photons:
-            x0 = photon.x
-            y0 = photon.y
-
-            # see if photon crosses a module:
-            for i_module in range(n_module):
-                i_str = str(i_module)
-                x_m = self.true_properties['x_' + i_str].get_value()
-                y_m = self.true_properties['y_' + i_str].get_value()
-                angle_m = self.true_properties['angle_' + i_str].get_value()
-                module = self.photo_sensor_modules[i_module]
-                width = module.true_properties['width'].get_value()
-
-                x, y = module.find_intersection(photon, [x_m, y_m, angle_m])
-                dist_m = np.sqrt((x - x_m) ** 2 + (y - y_m) ** 2)
-                if dist_m < width / 2.:
-                    # see if photon crosses a sensor
-                    n_sensor = module.true_properties['n_sensor'].get_value()
-                    for i_sensor in range(n_sensor):
-                        i_str = str(i_sensor)
-                        x_s = module.true_properties['x_' + i_str].get_value()
-                        y_s = module.true_properties['y_' + i_str].get_value()
-                        angle_s = module.true_properties['angle_' + i_str].get_value()
-                        sensor = module.photo_sensors[i_sensor]
-                        width_s = sensor.true_properties['width'].get_value()
-
-                        x_d, y_d, angle_d = sensor.get_global_orientation([x_s, y_s, angle_s], [x_m, y_m, angle_m])
-                        x, y = sensor.find_intersection(photon, [x_d, y_d, angle_d])
-                        dist_s = np.sqrt((x - x_d) ** 2 + (y - y_d) ** 2)
-                        if dist_s < width_s / 2.:
-                            # photon hit photocathode - was a photo-electron produced?
-                            theta = photon.angle - angle_d + np.pi / 2.
-                            qe = sensor.true_properties['qe'].get_value()
-                            if sensor.true_properties['qe_angle'].get_value():
-                                c_a = sensor.true_properties['qe_angle_coeff'].get_value()
-                                if c_a > 0.:
-                                    factor = np.exp(-1./c_a/np.cos(theta))
-                                    qe *= (1. - factor)
-                            if sensor.true_properties['qe_radial'].get_value():
-                                c_qe = sensor.true_properties['qe_radial_coeff'].get_value()
-                                qe *= (1. + c_qe * dist_s/(width_s/2.))/(1. + abs(c_qe))
-
-                            if qe > photon.random_numbers_uniform[0]:
-                                distance = np.sqrt((x0 - x) ** 2 + (y0 - y) ** 2)
-                                t = photon.t + distance / photon.VELOCITY
-                                # internal PMT delay
-                                delay = sensor.true_properties['td'].get_value()
-                                if sensor.true_properties['td_radial'].get_value():
-                                    c_td = sensor.true_properties['td_radial_coeff'].get_value()
-                                    delay *= (1. + c_td * dist_s/(width_s/2.))
-                                t += delay
-                                # incorporate timing resolution
-                                t_obs = t + sensor.true_properties['t_sig'].get_value() * photon.random_numbers_norm[0]
-                                event.add_pe(i_module, i_sensor, t_obs)
-                                n_pe += 1
-                                sum_times += t_obs
-                            break
-                    break
-
-        # add dark noise (not yet in likelihood!)
-        mean_time = sum_times / n_pe
-        window = self.true_properties['readout_window'].get_value()
-        for i_module in range(n_module):
-            module = self.photo_sensor_modules[i_module]
-            n_sensor = module.true_properties['n_sensor'].get_value()
-            for i_sensor in range(n_sensor):
-                sensor = module.photo_sensors[i_sensor]
-                rate = sensor.true_properties['dark_noise_rate'].get_value()
-                if rate > 0.:
-                    n_expected = rate * window / 1.E9
-                    n_dark = stats.poisson.rvs(n_expected)
-                    if n_dark > 0:
-                        for i_dark in range(n_dark):
-                            t_obs = mean_time + (stats.uniform.rvs() - 0.5) * window
-                            event.add_pe(i_module, i_sensor, t_obs)
-
-        return event
+        return self.get_events([self], emitter, dtype)[0]
+
+    @classmethod
+    def get_events(cls, detectors: list, emitter, dtype=np.float64) -> list:
+        """Produce the events seen by several detectors (eg. alternative designs) from the same emitter photons,
+        in one pass (see transport_detectors)
+            - emitter can be a list of emitters: their photons are overlaid in one event (pile-up), or an iterable
+              of PhotonBundles (eg. Emitter.emit_chunks), transported one chunk at a time (see stream_events)
+            - dtype: storage type of the event arrays (see Event)
+        """
+        emitters = emitter if isinstance(emitter, list) else [emitter]
+        if not all(hasattr(item, 'emit_chunks') for item in emitters):
+            return cls.stream_events(detectors, emitter, dtype)
+        photons = PhotonBundle.concatenate([PhotonBundle.from_photons(item.photons) for item in emitters])
+        return cls.stream_events(detectors, [photons], dtype)
+
+    def stream_event(self, chunks, dtype=np.float64) -> Event:
+        """Produce the event of this detector from photons given in chunks (see stream_events)
+        """
+        return self.stream_events([self], chunks, dtype)[0]
+
+    @classmethod
+    def stream_events(cls, detectors: list, chunks, dtype=np.float64) -> list:
+        """Produce the events seen by several detectors from photons given in chunks, one chunk at a time, so that
+        the memory needed does not depend on the number of photons
+            - chunks: iterable of PhotonBundles, eg. Emitter.emit_chunks (or for pile-up, itertools.chain of the
+              chunks of several emitters)
+            - dtype: storage type of the event arrays (see Event)
+        """
+        events = [Event(detector, dtype) for detector in detectors]
+        n_obs = np.zeros(len(detectors))
+        sum_obs = np.zeros(len(detectors))
+        for photons in chunks:
+            for i_detector, (i_module, i_sensor, t_obs) in enumerate(cls.transport_detectors(detectors, photons)):
+                events[i_detector].add_pes(i_module, i_sensor, t_obs)
+                n_obs[i_detector] += len(t_obs)
+                sum_obs[i_detector] += np.sum(t_obs)
+
+        for detector, event, n, total in zip(detectors, events, n_obs, sum_obs):
+            event.add_pes(*detector.get_dark_noise(total / n if n > 0 else np.nan))
+        return events
+
+    def get_dark_noise(self, mean_time: float):
+        """Return dark noise pulses (not yet in likelihood!) as arrays of module index, sensor index and time,
+        in the readout window about the mean time of the signals
+        """
+        geometry = self.get_geometry(True)
+        sensor_table = geometry.sensor_table
+        rate = geometry.sensor_values['dark_noise_rate']
+        rows = np.zeros(0, dtype=int)
+        t_dark = np.zeros(0)
+        if np.any(rate > 0.):
+            window = self.true_properties['readout_window'].get_value()
+            n_dark = np.random.poisson(np.maximum(rate, 0.) * window / 1.E9)
+            rows = np.repeat(np.arange(len(rate)), n_dark)
+            t_dark = mean_time + (np.random.uniform(size=len(rows)) - 0.5) * window
+        return sensor_table['module'][rows], sensor_table['sensor'][rows], t_dark
+
+    def transport(self, photons: PhotonBundle):
+        """Follow photons to the photosensors and return the observed photo-electrons as arrays
+        of module index, sensor index and observed time
+            - each photon stops at the first module (in order) whose surface its line crosses, and at the first
+              sensor of that module it crosses
+        """
+        return self.transport_detectors([self], photons)[0]
+
+    @staticmethod
+    def transport_detectors(detectors: list, photons: PhotonBundle) -> list:
+        """Follow the same photons through several detectors at once, and return for each detector the
+        observed photo-electrons (arrays of module index, sensor index and observed time, see transport)
+
+        The signed distance from the centre (x_c, y_c) of a surface with orientation a_c to where the line of a
+        photon (x, y, direction a) crosses it, is
+
+            [(x sin a - y cos a) - x_c sin a + y_c cos a] / (cos a_c sin a - sin a_c cos a)
+
+        so the photon terms (sin a, cos a, x sin a - y cos a) are computed once, and the crossings with the
+        modules of all detectors are found together (module surfaces shared by several detectors are tested
+        once), followed by the crossings with the sensors of the module each photon reaches. The photons use
+        the same random numbers in every detector, so that differences between designs are not diluted by
+        simulation variance.
+        """
+        cos_p = np.cos(photons.angle)
+        sin_p = np.sin(photons.angle)
+        rays = np.stack([sin_p, cos_p], axis=1)
+        offset_p = photons.x * sin_p - photons.y * cos_p
+
+        geometries = [detector.get_geometry(True) for detector in detectors]
+        responses = [detector.get_response(True) for detector in detectors]
+
+        # module surfaces of all detectors, and the sensors of each module (padded to the largest module)
+        module_starts = np.cumsum([0] + [geometry.n_module for geometry in geometries])
+        sensor_starts = np.cumsum([0] + [geometry.n_sensor for geometry in geometries])
+        modules = {name: np.concatenate([geometry.module_table[name] for geometry in geometries])
+                   for name in ['x', 'y', 'angle', 'width', 'n_sensor']}
+        sensors = {name: np.concatenate([geometry.sensor_table[name] for geometry in geometries])
+                   for name in ['x', 'y', 'angle', 'width']}
+        first_sensor = np.concatenate([start + np.cumsum([0] + list(geometry.module_table['n_sensor'][:-1]))
+                                       for start, geometry in zip(sensor_starts, geometries)]).astype(int)
+        slots = np.arange(np.max(modules['n_sensor']))
+        in_module = slots < modules['n_sensor'][:, np.newaxis]
+        module_sensors = np.where(in_module, first_sensor[:, np.newaxis] + slots, 0)
+        # sensor surfaces of each module: padding has zero width, so that it is never crossed
+        sensor_surfaces = [-sensors['x'][module_sensors], sensors['y'][module_sensors],
+                           np.cos(sensors['angle'][module_sensors]), -np.sin(sensors['angle'][module_sensors]),
+                           np.where(in_module, sensors['width'][module_sensors] / 2., 0.)]
+
+        # see if photon crosses a module: for each detector, the first module whose surface is crossed.
+        # Module surfaces common to several detectors (eg. designs that differ only within the modules) are
+        # tested once: |crossing| < width / 2 is tested as |numerator| < width / 2 * |denominator|
+        surfaces, inverse = np.unique(np.stack([modules['x'], modules['y'], modules['angle'], modules['width']],
+                                               axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        numerator = offset_p[:, np.newaxis] + rays @ np.stack([-surfaces[:, 0], surfaces[:, 1]])
+        denominator = rays @ np.stack([np.cos(surfaces[:, 2]), -np.sin(surfaces[:, 2])])
+        hit_m = np.abs(numerator) < surfaces[:, 3] / 2. * np.abs(denominator)
+
+        i_photon = []
+        i_module = []
+        layouts = {}
+        for start, end in zip(module_starts[:-1], module_starts[1:]):
+            layout = tuple(inverse[start:end])
+            if layout not in layouts:
+                hit_layout = hit_m[:, inverse[start:end]]
+                first_m = np.argmax(hit_layout, axis=1)
+                crossed = np.flatnonzero(hit_layout[np.arange(len(photons)), first_m])
+                layouts[layout] = (crossed, first_m[crossed])
+            crossed, first_m = layouts[layout]
+            i_photon.append(crossed)
+            i_module.append(start + first_m)
+        i_photon = np.concatenate(i_photon)
+        i_module = np.concatenate(i_module)
+
+        # see if photon crosses a sensor of that module: the first sensor crossed
+        minus_x, y_s, cos_s, minus_sin_s, half_width = [table[i_module] for table in sensor_surfaces]
+        sin_i = sin_p[i_photon, np.newaxis]
+        cos_i = cos_p[i_photon, np.newaxis]
+        numerator = offset_p[i_photon, np.newaxis] + minus_x * sin_i + y_s * cos_i
+        denominator = cos_s * sin_i + minus_sin_s * cos_i
+        hit_s = np.abs(numerator) < half_width * np.abs(denominator)
+        first_s = np.argmax(hit_s, axis=1)
+        rows = np.arange(len(i_photon))
+        hit = hit_s[rows, first_s]
+        i_photon = i_photon[hit]
+        index = module_sensors[i_module[hit], first_s[hit]]
+        crossing = numerator[rows[hit], first_s[hit]] / denominator[rows[hit], first_s[hit]]
+
+        results = []
+        for geometry, response, start, end in zip(geometries, responses, sensor_starts[:-1], sensor_starts[1:]):
+            mine = (index >= start) & (index < end)
+            results.append(Detector.__detect(geometry, response, photons, i_photon[mine], index[mine] - start,
+                                             crossing[mine]))
+        return results
+
+    @staticmethod
+    def __detect(geometry, response, photons, i_photon, index, crossing):
+        """Return the module index, sensor index and observed time of the photo-electrons produced by photons
+        i_photon that reach sensors index (rows of the geometry tables) at distance crossing from their centres
+        """
+        sensors = geometry.sensor_table
+        values = geometry.sensor_values
+
+        # photon hit photocathode - was a photo-electron produced?
+        r = np.abs(crossing) / (sensors['width'][index] / 2.)
+        theta = photons.angle[i_photon] - sensors['angle'][index] + np.pi / 2.
+        qe = values['qe'][index] * response.get_angular(index, theta) * response.get_radial(index, r)
+        detected = qe > photons.random_uniform[i_photon]
+        i_photon = i_photon[detected]
+        index = index[detected]
+        crossing = crossing[detected]
+        r = r[detected]
+
+        x = sensors['x'][index] + crossing * np.cos(sensors['angle'][index])
+        y = sensors['y'][index] + crossing * np.sin(sensors['angle'][index])
+        distance = np.sqrt((photons.x[i_photon] - x) ** 2 + (photons.y[i_photon] - y) ** 2)
+        t = photons.t[i_photon] + distance / Photon.VELOCITY
+        # internal PMT delay
+        t += values['td'][index] * response.get_delay(index, r)
+        # incorporate timing resolution
+        t_obs = t + values['t_sig'][index] * photons.random_norm[i_photon]
+        return sensors['module'][index], sensors['sensor'][index], t_obs
 
     @classmethod
-    def default_properties(cls):
+    def default_properties(cls, n_module: int = 7, pitch: float = 700.):
         """ Return a dictionary with the default PhotoSensor design properties
+            - n_module: number of modules in each of the floor and the wall
+            - pitch: separation between centres of photosensor modules (mm)
         """
 
         def add_prop(name: str, description: str, property_type: str, distribution: str, mean, sigma):
@@ -261,9 +512,7 @@ class Detector(Device):
 
         # photosensor_modules: wall and floor
         n_set = 2
-        n_module = 7
         add_prop('n_module', 'number of photosensor modules in detector', 'int', 'exact', n_module * n_set, 0)
-        pitch = 700.
         add_prop('pitch', 'separation between centres of photosensor modules (mm)', 'float', 'exact', pitch, 0.)
 
         # first set makes up the floor
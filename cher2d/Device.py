@@ -1,5 +1,4 @@
 import numpy as np
-from texttable import Texttable
 
 
 class Device:
@@ -20,8 +19,7 @@ class Device:
         # build a device by setting true values for its properties
         for design_property_name in self.design_properties:
             design_property = self.design_properties[design_property_name]
-            design_property.add_device(self)
-            true_property = design_property.get_TrueProperty(exact)
+            true_property = design_property.get_TrueProperty(exact, self)
             self.true_properties[design_property.name] = true_property
 
     def get_value(self, property_name: str, truth: bool):
@@ -30,7 +28,99 @@ class Device:
             value = self.true_properties[property_name].get_value()
         return value
 
+    def get_version(self) -> int:
+        """Return the latest version stamp of the design properties of the device
+        """
+        return max(design_property.version for design_property in self.design_properties.values())
+
+    def get_children(self) -> list:
+        """Return the devices that make up this device (eg. the modules of a detector)
+        """
+        return []
+
+    def get_devices(self, path: str = None) -> list:
+        """Return a list of (path, device) for this device and all devices it contains, depth first
+            - path: of this device, default <class name>_<device_id> (eg. 'Detector_0/PhotoSensorModule_3')
+        """
+        if path is None:
+            path = type(self).__name__ + '_' + str(self.device_id)
+        devices = [(path, self)]
+        for child in self.get_children():
+            devices += child.get_devices(path + '/' + type(child).__name__ + '_' + str(child.device_id))
+        return devices
+
+    def export_properties(self):
+        """Return the properties of this device and all devices it contains as a numpy structured array, with
+        one row per device and property (in the order of get_devices) and fields:
+        path, name, type, mean, sigma, offset, value (numbers are stored as float64)
+            - the array can be saved with np.save (no pickle) or viewed with pandas.DataFrame(records)
+        """
+        devices = self.get_devices()
+
+        # the true values of all devices built with a design property are read at once
+        columns = {name: [] for name in ['position', 'i_property', 'path', 'name', 'type', 'mean', 'sigma', 'offset',
+                                         'value']}
+        groups = {}
+        for position, (path, device) in enumerate(devices):
+            groups.setdefault(id(device.design_properties), []).append((position, path, device))
+        for group in groups.values():
+            positions = np.array([position for position, _, _ in group])
+            paths = np.array([path for _, path, _ in group])
+            design_properties = group[0][2].design_properties
+            for i_property, design_property in enumerate(design_properties.values()):
+                index = [design_property.get_device_index(device) for _, _, device in group]
+                n = len(group)
+                columns['position'].append(positions)
+                columns['i_property'].append(np.full(n, i_property))
+                columns['path'].append(paths)
+                columns['name'].append(np.full(n, design_property.name))
+                columns['type'].append(np.full(n, design_property.property_type))
+                columns['mean'].append(np.full(n, design_property.mean, dtype=float))
+                columns['sigma'].append(np.full(n, design_property.sigma, dtype=float))
+                columns['offset'].append(np.full(n, design_property.get_offset(), dtype=float))
+                columns['value'].append(design_property.get_values()[index].astype(float))
+
+        columns = {name: np.concatenate(columns[name]) for name in columns}
+        order = np.lexsort((columns.pop('i_property'), columns.pop('position')))
+        records = np.empty(len(order), dtype=[(name, columns[name].dtype) for name in columns])
+        for name in columns:
+            records[name] = columns[name][order]
+        return records
+
+    def import_properties(self, records):
+        """Set design means, sigmas, offsets and true values from an array returned by export_properties
+        (for this device or one with the same structure)
+            - rows can be a subset of the devices and properties; the design values (mean, sigma, offset) must
+              agree for all rows of a design property
+        """
+        devices = dict(self.get_devices())
+        updates = {}
+        for path, name, mean, sigma, offset, value in zip(records['path'], records['name'], records['mean'],
+                                                          records['sigma'], records['offset'], records['value']):
+            if path not in devices or name not in devices[path].design_properties:
+                raise ValueError('Error in importing properties: unknown device property (' + str(path) + ': ' +
+                                 str(name) + ')')
+            design_property = devices[path].design_properties[name]
+            design = (mean, sigma, offset)
+            update = updates.setdefault(design_property, (design, [], []))
+            if update[0] != design:
+                raise ValueError('Error in importing properties: design values of (' + str(name) +
+                                 ') differ between devices')
+            update[1].append(design_property.get_device_index(devices[path]))
+            update[2].append(value)
+
+        for design_property, ((mean, sigma, offset), index, values) in updates.items():
+            to_type = design_property.PROPERTY_TYPES[design_property.property_type]
+            design_property.mean = to_type(mean)
+            design_property.sigma = type(design_property.sigma)(sigma)
+            design_property.set_offset(to_type(offset))
+            true_values = np.array(design_property.get_values())
+            true_values[index] = values
+            design_property.set_values(true_values)
+
     def get_table(self, width: int = 120):
+        from texttable import Texttable
+
         table = Texttable()
         table.set_deco(Texttable.HEADER | Texttable.HLINES)
         table.set_max_width(width)
@@ -1,8 +1,8 @@
 from cher2d.DesignProperty import DesignProperty
 from cher2d.Device import Device
-from cher2d.Photon import Photon
+from cher2d.Geometry import Geometry
+from cher2d.PhotonBundle import PhotonBundle
 import numpy as np
-from scipy import stats
 
 
 class Emitter(Device):
@@ -11,43 +11,107 @@ class Emitter(Device):
 
     """
 
+    CHUNK_SIZE = 50000
+
     def __init__(self, emitter_id: int, design_properties: dict, exact: bool = False):
         """Constructor
         """
         super().__init__(emitter_id, design_properties, exact)
 
         self.photons = None
-
-    def emit(self, t0: float):
-        """Produce Cherenkov photons starting at time t0 (ns)
+        self.emission_fraction = 1.
+
+    def emit(self, t0: float, dtype=np.float64, detector=None):
+        """Produce Cherenkov photons starting at time t0 (ns), stored as a PhotonBundle in self.photons
+            - dtype: storage type of the photon arrays (eg. np.float32 for large samples)
+            - detector: if given (or a list of detectors), photons are only produced where they can reach a
+              sensor (see below)
+            - all photons of the track are held in memory (about 50 bytes each in float64): for long or bright
+              tracks, use emit_chunks instead
+
+        Acceptance-biased emission: photons emitted on each side of the track form a Poisson process with half the
+        emission density. Restricted to the parts of the track from which the photon lines cross a module (found
+        from the detector geometry), the process still produces every photon that could be detected, with the
+        same distribution, while the others are never made. Each photon therefore keeps unit weight, and events
+        and their expectations are unbiased. The expected fraction of the full emission that is produced is kept
+        in self.emission_fraction (1 for full emission).
         """
-        self.photons = []
-
-        # travel along the emitter direction, producing photons on either side of emitter
-        dist = 0.
+        bundles = list(self.emit_chunks(t0, dtype, detector))
+        if len(bundles) == 0:
+            bundles.append(self.__get_bundle(t0, np.zeros(0), np.zeros(0), dtype))
+        self.photons = PhotonBundle.concatenate(bundles)
+
+    def emit_chunks(self, t0: float, dtype=np.float64, detector=None, chunk_size: int = None):
+        """Produce the Cherenkov photons of emit() as a sequence (generator) of PhotonBundles of at most chunk_size
+        photons (default: CHUNK_SIZE), without keeping them, so that the memory needed does not depend on the
+        length or brightness of the track (see Detector.stream_events)
+            - the chunk size sets the size of the arrays in transport (about 700 bytes per photon): smaller chunks
+              use less memory, larger chunks have less overhead per chunk
+            - for the same random state and the default chunk size, the photons are those of emit()
+        """
+        if chunk_size is None:
+            chunk_size = self.CHUNK_SIZE
         density = self.true_properties['ch_density'].get_value()
-
-        emission_time = t0
+        length = self.true_properties['length'].get_value()
+
+        if detector is None:
+            # travel along the emitter direction, producing photons on either side of emitter:
+            # the distances between emission points are exponential, drawn in blocks until the end of the path
+            self.emission_fraction = 1.
+            n_block = min(int(length * density + 5. * np.sqrt(length * density)) + 10, chunk_size)
+            end = 0.
+            while end < length:
+                dist = end + np.cumsum(np.random.exponential(1. / density, size=n_block))
+                end = dist[-1]
+                dist = dist[dist < length]
+                sign = np.where(np.random.uniform(size=len(dist)) < 0.5, -1., 1.)
+                yield self.__get_bundle(t0, dist, sign, dtype)
+            return
+
+        # for each side, the number of photons in the accepted intervals is Poisson, and their
+        # distances are uniform over the intervals
+        emitter_x = self.true_properties['x'].get_value()
+        emitter_y = self.true_properties['y'].get_value()
+        emitter_angle = self.true_properties['angle'].get_value()
+        ch_angle = self.true_properties['ch_angle'].get_value()
+        detectors = detector if isinstance(detector, list) else [detector]
+        sides = []
+        accepted_length = 0.
+        for side in [-1., 1.]:
+            intervals = np.concatenate([item.get_geometry(True).get_emission_intervals(
+                emitter_x, emitter_y, emitter_angle, ch_angle, side, length) for item in detectors])
+            if len(detectors) > 1:
+                intervals = Geometry.merge_intervals(intervals[:, 0], intervals[:, 1])
+            cumulative = np.concatenate([[0.], np.cumsum(intervals[:, 1] - intervals[:, 0])])
+            sides.append((side, intervals, cumulative, np.random.poisson(density / 2. * cumulative[-1])))
+            accepted_length += cumulative[-1]
+        self.emission_fraction = accepted_length / (2. * length) if length > 0. else 0.
+
+        for side, intervals, cumulative, n_side in sides:
+            for start in range(0, n_side, chunk_size):
+                u = np.random.uniform(0., cumulative[-1], size=min(chunk_size, n_side - start))
+                i_interval = np.minimum(np.searchsorted(cumulative, u, side='right') - 1, len(intervals) - 1)
+                dist = np.sort(intervals[i_interval, 0] + u - cumulative[i_interval])
+                yield self.__get_bundle(t0, dist, np.full(len(dist), side), dtype)
+
+    def __get_bundle(self, t0: float, dist, sign, dtype):
+        """Return the photons emitted at distances dist along the track, on the sign (+1/-1) sides
+        """
         emitter_velocity = self.true_properties['velocity'].get_value()
         emitter_x = self.true_properties['x'].get_value()
         emitter_y = self.true_properties['y'].get_value()
         emitter_angle = self.true_properties['angle'].get_value()
         ch_angle = self.true_properties['ch_angle'].get_value()
 
-        while len(self.photons) < 100000:
-            travel = stats.expon.rvs(scale=1. / density)
-            dist += travel
-            if dist < self.true_properties['length'].get_value():
-                sign = 1.
-                if np.random.rand() < 0.5:
-                    sign = -1.
-                emission_angle = emitter_angle + sign * ch_angle
-                emission_time += travel / emitter_velocity
-                emitter_x += travel * np.cos(emitter_angle)
-                emitter_y += travel * np.sin(emitter_angle)
-                self.photons.append(Photon(emission_time, emitter_x, emitter_y, emission_angle))
-            else:
-                break
+        emission_angle = emitter_angle + sign * ch_angle
+        emission_time = t0 + dist / emitter_velocity
+        x = emitter_x + dist * np.cos(emitter_angle)
+        y = emitter_y + dist * np.sin(emitter_angle)
+
+        # random numbers used to produce event information for each photon (see Photon)
+        random_uniform = np.random.uniform(size=len(dist))
+        random_norm = np.random.standard_normal(size=len(dist))
+        return PhotonBundle(emission_time, x, y, emission_angle, random_uniform, random_norm, dtype=dtype)
 
     @classmethod
     def default_properties(cls) -> dict:
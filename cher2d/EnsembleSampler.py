@@ -0,0 +1,93 @@
+import numpy as np
+
+
+class EnsembleSampler:
+    """
+    An EnsembleSampler object draws samples from a distribution with the affine-invariant ensemble sampler
+    (stretch move) of Goodman and Weare
+
+    The walkers are split into two halves, and each walker of one half is moved along the line joining it to a
+    randomly chosen walker of the other half:
+
+        Y = X_j + z (X_k - X_j), with z drawn from g(z) ~ 1/sqrt(z) on [1/a, a]
+
+    and accepted with probability min(1, z^(n_dim - 1) p(Y) / p(X_k)). All walkers of a half move at once, so
+    that the log probability is evaluated for an array of points in one call. The moves are unchanged by
+    linear transformations of the parameters, so that strongly correlated parameters (eg. x, y and angle of
+    a track) need no tuning.
+
+    Autocorrelation diagnostics:
+    ----------------------------
+    The integrated autocorrelation time tau of each parameter is estimated from the autocorrelation function
+    averaged over walkers, summed over lags up to the smallest window M >= c tau (automatic windowing, c = 5).
+    The chain gives about n_step * n_walker / tau independent samples; the estimate is reliable for chains
+    longer than about 50 tau.
+
+    """
+
+    def __init__(self, ln_prob, n_dim: int, a: float = 2.):
+        """Constructor
+            - ln_prob: function returning the log probability (array of M) for an array of points (M, n_dim);
+              -inf outside the support
+            - a: scale of the stretch move
+        """
+        self.ln_prob = ln_prob
+        self.n_dim = n_dim
+        self.a = a
+
+    def run(self, start, n_step: int) -> dict:
+        """Run the walkers from the starting points start (array (n_walker, n_dim), n_walker even and at least
+        2 * n_dim) for n_step steps, and return a dictionary with:
+            - 'chain': positions, array (n_step, n_walker, n_dim)
+            - 'ln_prob': log probabilities, array (n_step, n_walker)
+            - 'acceptance': fraction of accepted moves for each walker
+        """
+        walkers = np.array(start, dtype=float)
+        n_walker = len(walkers)
+        if walkers.shape != (n_walker, self.n_dim) or n_walker % 2 != 0 or n_walker < 2 * self.n_dim:
+            raise ValueError('Error in EnsembleSampler: start must have shape (n_walker, ' + str(self.n_dim) +
+                             ') with n_walker even and at least ' + str(2 * self.n_dim))
+        ln_p = np.asarray(self.ln_prob(walkers), dtype=float)
+        if not np.all(np.isfinite(ln_p)):
+            raise ValueError('Error in EnsembleSampler: log probability is not finite at the starting points')
+
+        chain = np.zeros((n_step, n_walker, self.n_dim))
+        ln_probs = np.zeros((n_step, n_walker))
+        n_accepted = np.zeros(n_walker)
+        halves = [np.arange(0, n_walker // 2), np.arange(n_walker // 2, n_walker)]
+        for i_step in range(n_step):
+            for moving, other in [halves, halves[::-1]]:
+                n = len(moving)
+                z = ((self.a - 1.) * np.random.uniform(size=n) + 1.) ** 2 / self.a
+                partners = walkers[other[np.random.randint(len(other), size=n)]]
+                proposals = partners + z[:, np.newaxis] * (walkers[moving] - partners)
+                ln_p_proposals = np.asarray(self.ln_prob(proposals), dtype=float)
+                with np.errstate(invalid='ignore'):
+                    ln_ratio = (self.n_dim - 1.) * np.log(z) + ln_p_proposals - ln_p[moving]
+                accepted = np.log(np.random.uniform(size=n)) < ln_ratio
+                walkers[moving[accepted]] = proposals[accepted]
+                ln_p[moving[accepted]] = ln_p_proposals[accepted]
+                n_accepted[moving[accepted]] += 1
+            chain[i_step] = walkers
+            ln_probs[i_step] = ln_p
+
+        return {'chain': chain, 'ln_prob': ln_probs, 'acceptance': n_accepted / max(n_step, 1)}
+
+    @staticmethod
+    def get_autocorrelation_time(chain, c: float = 5.):
+        """Return the integrated autocorrelation time of each parameter of a chain (n_step, n_walker, n_dim)
+        """
+        n_step = chain.shape[0]
+        deviations = chain - np.mean(chain, axis=0)
+        # autocorrelation function by FFT (zero padded to avoid wrap around), averaged over walkers
+        n_fft = 2 ** int(np.ceil(np.log2(2 * n_step)))
+        transform = np.fft.rfft(deviations, n=n_fft, axis=0)
+        acf = np.fft.irfft(transform * np.conj(transform), n=n_fft, axis=0)[:n_step]
+        acf = np.mean(acf, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            acf = acf / acf[0]
+
+        taus = 2. * np.cumsum(acf, axis=0) - 1.
+        windows = np.arange(n_step)[:, np.newaxis] >= c * taus
+        window = np.where(np.any(windows, axis=0), np.argmax(windows, axis=0), n_step - 1)
+        return taus[window, np.arange(chain.shape[2])]
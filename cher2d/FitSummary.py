@@ -0,0 +1,159 @@
+import os
+import numpy as np
+from cher2d.QuantileSketch import QuantileSketch
+
+
+class FitSummary:
+    """
+    A FitSummary object accumulates the results of many fits (eg. of a repetition study) without keeping them,
+    so that the bias and spread of the estimates can be read at any time and the memory does not grow with the
+    number of events
+
+    For each parameter, the following are accumulated for the successful fits:
+     - value: the estimate, residual: estimate - truth, pull: (estimate - truth) / error, error: the fit error
+    with means and variances updated online (Welford), the covariance of the residuals, and quantile sketches
+    of the residuals and pulls. Fits that are not valid (or have non finite values, or errors that are not
+    positive) are counted as failures.
+
+    Summaries from several processes (eg. the jobs of a Sweep) are combined with merge(), using the pairwise
+    update of Chan et al. for the means, variances and covariance, so that the result does not depend on how
+    the fits were split. A summary can be saved to and loaded from a numpy .npz file (no pickle), eg. by a
+    running job, so that its fits so far can be followed.
+
+    """
+
+    QUANTITIES = ['value', 'residual', 'pull', 'error']
+    QUANTILES = [0.025, 0.16, 0.5, 0.84, 0.975]
+
+    def __init__(self, parameter_names: list, k: int = 200):
+        """Constructor
+            - parameter_names: names of the fit parameters (eg. Analyzer.get_parameter_names())
+            - k: size of the quantile sketches (see QuantileSketch)
+        """
+        self.parameter_names = list(parameter_names)
+        n_par = len(self.parameter_names)
+        self.n_fit = 0
+        self.n_failed = 0
+        self.n = 0
+        self.means = {quantity: np.zeros(n_par) for quantity in self.QUANTITIES}
+        self.m2 = {quantity: np.zeros(n_par) for quantity in self.QUANTITIES}
+        self.comoment = np.zeros((n_par, n_par))
+        self.sketches = {quantity: [QuantileSketch(k) for _ in range(n_par)] for quantity in ['residual', 'pull']}
+
+    def add(self, result: dict, truth: dict):
+        """Add a fit result (dictionary as returned by Analyzer.fit) with the true parameter values (dictionary)
+        """
+        self.n_fit += 1
+        value = np.array([result[name] for name in self.parameter_names], dtype=float)
+        error = np.array([result[name + '_err'] for name in self.parameter_names], dtype=float)
+        true_value = np.array([truth[name] for name in self.parameter_names], dtype=float)
+        if (not result.get('valid', True) or not np.all(np.isfinite(value)) or not np.all(np.isfinite(error)) or
+                np.any(error <= 0.)):
+            self.n_failed += 1
+            return
+
+        residual = value - true_value
+        x = {'value': value, 'residual': residual, 'pull': residual / error, 'error': error}
+        self.n += 1
+        for quantity in self.QUANTITIES:
+            delta = x[quantity] - self.means[quantity]
+            self.means[quantity] += delta / self.n
+            self.m2[quantity] += delta * (x[quantity] - self.means[quantity])
+            if quantity == 'residual':
+                self.comoment += np.outer(delta, x[quantity] - self.means[quantity])
+        for quantity in self.sketches:
+            for sketch, item in zip(self.sketches[quantity], x[quantity]):
+                sketch.add(item)
+
+    def merge(self, other):
+        """Add the fits accumulated by another FitSummary (for the same parameters)
+        """
+        if other.parameter_names != self.parameter_names:
+            raise ValueError('Error in merging FitSummary: parameters differ (' + ', '.join(self.parameter_names) +
+                             ' / ' + ', '.join(other.parameter_names) + ')')
+        self.n_fit += other.n_fit
+        self.n_failed += other.n_failed
+        n = self.n + other.n
+        if other.n > 0:
+            for quantity in self.QUANTITIES:
+                delta = other.means[quantity] - self.means[quantity]
+                self.means[quantity] += delta * other.n / n
+                self.m2[quantity] += other.m2[quantity] + delta ** 2 * self.n * other.n / n
+                if quantity == 'residual':
+                    self.comoment += other.comoment + np.outer(delta, delta) * self.n * other.n / n
+            for quantity in self.sketches:
+                for sketch, other_sketch in zip(self.sketches[quantity], other.sketches[quantity]):
+                    sketch.merge(other_sketch)
+        self.n = n
+
+    def save(self, filename):
+        """Save the summary to a numpy .npz file: written to a temporary file that is then renamed, so that a
+        reader sees either the previous or the new summary
+        """
+        arrays = {'parameter_names': np.array(self.parameter_names),
+                  'counts': np.array([self.n_fit, self.n_failed, self.n]), 'comoment': self.comoment}
+        for quantity in self.QUANTITIES:
+            arrays['means:' + quantity] = self.means[quantity]
+            arrays['m2:' + quantity] = self.m2[quantity]
+        for quantity in self.sketches:
+            for i, sketch in enumerate(self.sketches[quantity]):
+                prefix = 'sketch:' + quantity + ':' + str(i) + ':'
+                arrays[prefix + 'counts'] = np.array([sketch.k, sketch.n])
+                arrays[prefix + 'offsets'] = np.array(sketch.offsets)
+                arrays[prefix + 'lengths'] = np.array([len(items) for items in sketch.levels])
+                arrays[prefix + 'items'] = np.concatenate(sketch.levels)
+        temporary = filename + '.tmp.npz'
+        np.savez(temporary, **arrays)
+        os.replace(temporary, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a summary saved with save()
+        """
+        with np.load(filename) as arrays:
+            parameter_names = [str(name) for name in arrays['parameter_names']]
+            summary = cls(parameter_names)
+            summary.n_fit, summary.n_failed, summary.n = [int(count) for count in arrays['counts']]
+            summary.comoment = arrays['comoment']
+            for quantity in cls.QUANTITIES:
+                summary.means[quantity] = arrays['means:' + quantity]
+                summary.m2[quantity] = arrays['m2:' + quantity]
+            for quantity in summary.sketches:
+                for i, sketch in enumerate(summary.sketches[quantity]):
+                    prefix = 'sketch:' + quantity + ':' + str(i) + ':'
+                    sketch.k, sketch.n = [int(count) for count in arrays[prefix + 'counts']]
+                    sketch.offsets = [int(offset) for offset in arrays[prefix + 'offsets']]
+                    ends = np.cumsum(arrays[prefix + 'lengths'])
+                    sketch.levels = np.split(arrays[prefix + 'items'], ends[:-1])
+        return summary
+
+    def get_summary(self) -> dict:
+        """Return the summary of the fits so far, a dictionary with:
+            - 'n_fit', 'n_failed', 'failure_rate'
+            - for each parameter name, a dictionary with 'mean' and 'std' (of the estimates), 'bias' and 'rms'
+              (mean and standard deviation of the residuals), 'bias_err' (its standard error), 'pull_mean',
+              'pull_std', 'mean_error', and 'residual_quantiles' and 'pull_quantiles' (at QUANTILES)
+            - 'covariance' and 'correlation': of the residuals, arrays ordered as parameter_names
+        Statistics that need more fits than accumulated are NaN.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            std = {quantity: np.sqrt(self.m2[quantity] / (self.n - 1)) if self.n > 1 else
+                   np.full(len(self.parameter_names), np.nan) for quantity in self.QUANTITIES}
+            covariance = self.comoment / (self.n - 1) if self.n > 1 else np.full(self.comoment.shape, np.nan)
+            correlation = covariance / np.sqrt(np.outer(np.diag(covariance), np.diag(covariance)))
+        means = {quantity: self.means[quantity] if self.n > 0 else np.full(len(self.parameter_names), np.nan)
+                 for quantity in self.QUANTITIES}
+
+        summary = {'n_fit': self.n_fit, 'n_failed': self.n_failed,
+                   'failure_rate': self.n_failed / self.n_fit if self.n_fit > 0 else np.nan}
+        for i, name in enumerate(self.parameter_names):
+            summary[name] = {'mean': means['value'][i], 'std': std['value'][i],
+                             'bias': means['residual'][i], 'rms': std['residual'][i],
+                             'bias_err': std['residual'][i] / np.sqrt(self.n) if self.n > 0 else np.nan,
+                             'pull_mean': means['pull'][i], 'pull_std': std['pull'][i],
+                             'mean_error': means['error'][i],
+                             'residual_quantiles': self.sketches['residual'][i].get_quantiles(self.QUANTILES),
+                             'pull_quantiles': self.sketches['pull'][i].get_quantiles(self.QUANTILES)}
+        summary['covariance'] = covariance
+        summary['correlation'] = correlation
+        return summary
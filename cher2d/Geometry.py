@@ -0,0 +1,309 @@
+import numpy as np
+
+
+class Geometry:
+    """
+    A Geometry object holds flat tables of a detector: the global position and orientation of every module and
+    photosensor, and the photosensor property values, as arrays
+
+    Sensors are ordered module by module (module 0: sensors 0, 1, ..., module 1: ...). The tables are built once
+    for a detector (true values or design means) and can be saved to and loaded from disk.
+
+    Time of flight and emission point (for expectation calculations):
+    -------------------------------------------------------------------
+    A photon reaching sensor edge P was emitted at angle a_e + sign * ch from the emitter track (start E,
+    direction a_e). With D = P - E, p = D.(cos a_e, sin a_e) the distance of P along the track and
+    d = D.(-sin a_e, cos a_e) its distance from the track line, the photon travelled
+
+        s = sign * d / sin(ch)
+
+    and was emitted at distance p - s * cos(ch) along the track. No trigonometry of the sensors is needed
+    per evaluation, only these products with the precomputed edge coordinates.
+
+    Incremental updates:
+    --------------------
+    While the tables are built, the module and sensor rows read from each design property are recorded. When
+    some properties change (eg. the offset of one module position), update() reads only the rows that depend
+    on them, and reports the rows whose values changed, so that derived quantities (response maps, Asimov
+    expectations) are recomputed for those sensors only.
+    """
+
+    SENSOR_COLUMNS = ['module', 'sensor', 'x', 'y', 'angle', 'width', 'x_0', 'y_0', 'x_1', 'y_1']
+    MODULE_COLUMNS = ['x', 'y', 'angle', 'width', 'n_sensor']
+
+    def __init__(self, module_table: dict, sensor_table: dict, sensor_values: dict, truth: bool,
+                 dependencies: dict = None):
+        """Constructor
+            - dependencies: {DesignProperty: (module rows, sensor rows)} that were built from each design property,
+              or None for properties that define the structure of the tables (see update)
+        """
+        self.module_table = module_table
+        self.sensor_table = sensor_table
+        self.sensor_values = sensor_values
+        self.truth = truth
+
+        self.n_module = len(self.module_table['x'])
+        self.n_sensor = len(self.sensor_table['x'])
+        self.version = 0
+
+        # the version stamp of each design property when the tables were built
+        self.dependencies = {} if dependencies is None else dependencies
+        self.property_versions = {design_property: design_property.version for design_property in self.dependencies}
+
+    @classmethod
+    def from_detector(cls, detector, truth: bool):
+        """Build the tables for a detector
+            - truth - True: use true values or False: use design means
+        """
+        dependencies = {}
+        n_module = cls.__read(detector, 'n_module', True, dependencies)
+        sensor_index = []
+        for i_module in range(n_module):
+            module = detector.photo_sensor_modules[i_module]
+            n_sensor = cls.__read(module, 'n_sensor', True, dependencies)
+            sensor_index += [(i_module, i_sensor) for i_sensor in range(n_sensor)]
+
+        module_rows = np.arange(n_module)
+        sensor_rows = np.arange(len(sensor_index))
+        module_table, sensor_table, sensor_values = cls.__read_rows(detector, truth, module_rows, sensor_index,
+                                                                    sensor_rows, dependencies)
+        dependencies = {design_property: None if rows is None else tuple(np.array(sorted(item), dtype=int)
+                                                                          for item in rows)
+                        for design_property, rows in dependencies.items()}
+        return cls(module_table, sensor_table, sensor_values, truth, dependencies)
+
+    def update(self, detector):
+        """Return the tables rebuilt after design properties of the detector have changed, and a report of what
+        was invalidated
+            - only the module and sensor rows built from the changed properties are read again from the detector;
+              the tables are rebuilt completely if a property that defines their structure (eg. n_sensor) changed
+              or if the dependencies are not known (eg. tables loaded from a file)
+            - report: dictionary with 'properties' (names of changed properties), 'modules' and 'sensors' (arrays
+              of rows whose values changed), 'values' (sensor rows whose property values changed) and 'full'
+              (True if rebuilt completely)
+        """
+        changed = [design_property for design_property in self.property_versions
+                   if design_property.version != self.property_versions[design_property]]
+        names = sorted(set(design_property.name for design_property in changed))
+        if len(self.dependencies) == 0 or any(self.dependencies[item] is None for item in changed):
+            geometry = Geometry.from_detector(detector, self.truth)
+            report = {'properties': names, 'modules': np.arange(geometry.n_module),
+                      'sensors': np.arange(geometry.n_sensor), 'values': np.arange(geometry.n_sensor), 'full': True}
+            return geometry, report
+
+        module_rows = np.unique(np.concatenate([np.zeros(0, dtype=int)] +
+                                               [self.dependencies[item][0] for item in changed]))
+        sensor_rows = np.unique(np.concatenate([np.zeros(0, dtype=int)] +
+                                               [self.dependencies[item][1] for item in changed]))
+        sensor_index = list(zip(self.sensor_table['module'][sensor_rows], self.sensor_table['sensor'][sensor_rows]))
+        module_part, sensor_part, values_part = self.__read_rows(detector, self.truth, module_rows, sensor_index,
+                                                                 sensor_rows, {})
+
+        tables = []
+        changed_rows = []
+        for table, part, rows in [(self.module_table, module_part, module_rows),
+                                  (self.sensor_table, sensor_part, sensor_rows),
+                                  (self.sensor_values, values_part, sensor_rows)]:
+            table = {name: table[name].copy() for name in table}
+            different = np.zeros(len(rows), dtype=bool)
+            for name in part:
+                different |= table[name][rows] != part[name]
+                table[name][rows] = part[name]
+            tables.append(table)
+            changed_rows.append(rows[different])
+
+        geometry = Geometry(*tables, self.truth, self.dependencies)
+        report = {'properties': names, 'modules': changed_rows[0],
+                  'sensors': np.union1d(changed_rows[1], changed_rows[2]), 'values': changed_rows[2], 'full': False}
+        return geometry, report
+
+    @staticmethod
+    def __read(device, name: str, truth: bool, dependencies: dict, module_rows=(), sensor_rows=()):
+        """Return a property value of a device, and record the rows built from it (none: structural property)
+        """
+        design_property = device.design_properties[name]
+        if len(module_rows) == 0 and len(sensor_rows) == 0:
+            dependencies[design_property] = None
+        elif dependencies.get(design_property, ()) is not None:
+            rows = dependencies.setdefault(design_property, (set(), set()))
+            rows[0].update(module_rows)
+            rows[1].update(sensor_rows)
+        return device.get_value(name, truth)
+
+    @classmethod
+    def __read_rows(cls, detector, truth: bool, module_rows, sensor_index: list, sensor_rows, dependencies: dict):
+        """Read the table rows for modules module_rows and sensors sensor_index [(i_module, i_sensor), ...]
+        (rows sensor_rows of the tables) from the detector
+        """
+        read = cls.__read
+        module_table = {name: [] for name in cls.MODULE_COLUMNS}
+        for i_module in module_rows:
+            i_str = str(i_module)
+            module = detector.photo_sensor_modules[i_module]
+            rows = [i_module]
+            for name, value in zip(cls.MODULE_COLUMNS,
+                                   [read(detector, 'x_' + i_str, truth, dependencies, module_rows=rows),
+                                    read(detector, 'y_' + i_str, truth, dependencies, module_rows=rows),
+                                    read(detector, 'angle_' + i_str, truth, dependencies, module_rows=rows),
+                                    read(module, 'width', truth, dependencies, module_rows=rows),
+                                    module.get_value('n_sensor', True)]):
+                module_table[name].append(value)
+
+        # module positions, read once for the sensors of each module
+        module_frames = {}
+        for i_module in sorted(set(i_module for i_module, _ in sensor_index)):
+            m_str = str(i_module)
+            rows = [row for (i_m, _), row in zip(sensor_index, sensor_rows) if i_m == i_module]
+            module_frames[i_module] = [read(detector, name + m_str, truth, dependencies, sensor_rows=rows)
+                                       for name in ['x_', 'y_', 'angle_']]
+
+        sensor_table = {name: [] for name in ['module', 'sensor', 'x', 'y', 'angle']}
+        sensors = []
+        for (i_module, i_sensor), row in zip(sensor_index, sensor_rows):
+            rows = [row]
+            module = detector.photo_sensor_modules[i_module]
+            i_str = str(i_sensor)
+            x_s = read(module, 'x_' + i_str, truth, dependencies, sensor_rows=rows)
+            y_s = read(module, 'y_' + i_str, truth, dependencies, sensor_rows=rows)
+            angle_s = read(module, 'angle_' + i_str, truth, dependencies, sensor_rows=rows)
+            sensor = module.photo_sensors[i_sensor]
+            x_d, y_d, angle_d = sensor.get_global_orientation([x_s, y_s, angle_s], module_frames[i_module])
+            for name, value in zip(sensor_table, [i_module, i_sensor, x_d, y_d, angle_d]):
+                sensor_table[name].append(value)
+            sensors.append(sensor)
+
+        # sensor property values: taken from the arrays of true values (or the means) of the design properties
+        sensor_values = {}
+        for name in sensors[0].design_properties:
+            design_property = sensors[0].design_properties[name]
+            if any(sensor.design_properties[name] is not design_property for sensor in sensors):
+                raise ValueError('Geometry: the photosensors must share their design properties')
+            rows = dependencies.setdefault(design_property, (set(), set()))
+            if rows is not None:
+                rows[1].update(sensor_rows)
+            dtype = design_property.VALUE_DTYPES[design_property.property_type]
+            if truth:
+                index = [design_property.get_device_index(sensor) for sensor in sensors]
+                sensor_values[name] = design_property.get_values()[index]
+            else:
+                sensor_values[name] = np.full(len(sensors), design_property.mean, dtype=dtype)
+
+        module_table = {name: np.array(module_table[name]) for name in module_table}
+        sensor_table = {name: np.array(sensor_table[name]) for name in sensor_table}
+        sensor_table['width'] = sensor_values['width'].astype(float)
+
+        # sensor edges in global coordinates
+        half_width = sensor_table['width'] / 2.
+        cos_d = np.cos(sensor_table['angle'])
+        sin_d = np.sin(sensor_table['angle'])
+        sensor_table['x_0'] = sensor_table['x'] - half_width * cos_d
+        sensor_table['y_0'] = sensor_table['y'] - half_width * sin_d
+        sensor_table['x_1'] = sensor_table['x'] + half_width * cos_d
+        sensor_table['y_1'] = sensor_table['y'] + half_width * sin_d
+
+        return module_table, sensor_table, sensor_values
+
+    def save(self, filename):
+        """Save the tables to a numpy .npz file
+        """
+        arrays = {'truth': np.array(self.truth)}
+        for prefix, table in [('module:', self.module_table), ('sensor:', self.sensor_table),
+                              ('value:', self.sensor_values)]:
+            for name in table:
+                arrays[prefix + name] = table[name]
+        np.savez(filename, **arrays)
+
+    @classmethod
+    def load(cls, filename):
+        """Load tables saved with save()
+        """
+        tables = {'module:': {}, 'sensor:': {}, 'value:': {}}
+        with np.load(filename) as arrays:
+            truth = bool(arrays['truth'])
+            for key in arrays.files:
+                prefix, _, name = key.partition(':')
+                if name:
+                    tables[prefix + ':'][name] = arrays[key]
+        return cls(tables['module:'], tables['sensor:'], tables['value:'], truth)
+
+    def get_emission(self, x_e, y_e, angle_e, ch_angle, sign: float, edge: int, rows=None):
+        """Return the distance the photon travelled from the emitter track to sensor edge (0 or 1), and the
+        distance along the track of its emission point, for photons emitted on the sign (+1/-1) side of the track
+            - the emitter parameters can be arrays of shape (M, 1) to evaluate M tracks at once: the
+              returned arrays have shape (M, n_sensor)
+            - rows: optional array of sensor rows, to evaluate a subset of the sensors
+        """
+        x_p = self.sensor_table['x_' + str(edge)]
+        y_p = self.sensor_table['y_' + str(edge)]
+        if rows is not None:
+            x_p = x_p[rows]
+            y_p = y_p[rows]
+        cos_e = np.cos(angle_e)
+        sin_e = np.sin(angle_e)
+        dx = x_p - x_e
+        dy = y_p - y_e
+        along = dx * cos_e + dy * sin_e
+        across = dy * cos_e - dx * sin_e
+        travel = sign * across / np.sin(ch_angle)
+        return np.abs(travel), along - travel * np.cos(ch_angle)
+
+    def get_emission_intervals(self, x_e, y_e, angle_e, ch_angle, sign: float, length: float):
+        """Return the intervals (array of [start, end] rows, sorted and not overlapping) of distance along the
+        track, within [0, length], from which the lines of photons emitted on the sign (+1/-1) side of the track
+        cross a module surface. Photons emitted elsewhere cannot reach a sensor.
+        """
+        modules = self.module_table
+        half_width = modules['width'] / 2.
+        along = []
+        for edge in [-1., 1.]:
+            x_p = modules['x'] + edge * half_width * np.cos(modules['angle'])
+            y_p = modules['y'] + edge * half_width * np.sin(modules['angle'])
+            dx = x_p - x_e
+            dy = y_p - y_e
+            travel = sign * (dy * np.cos(angle_e) - dx * np.sin(angle_e)) / np.sin(ch_angle)
+            along.append(dx * np.cos(angle_e) + dy * np.sin(angle_e) - travel * np.cos(ch_angle))
+        starts = np.maximum(np.minimum(along[0], along[1]), 0.)
+        ends = np.minimum(np.maximum(along[0], along[1]), length)
+        return self.merge_intervals(starts, ends)
+
+    @staticmethod
+    def merge_intervals(starts, ends):
+        """Return the union of the intervals [starts, ends] (arrays) as an array of [start, end] rows, sorted and
+        not overlapping (empty intervals are dropped)
+        """
+        keep = starts < ends
+        starts = starts[keep]
+        ends = ends[keep]
+        if len(starts) == 0:
+            return np.zeros((0, 2))
+
+        # a new interval starts where the start is beyond all previous ends
+        order = np.argsort(starts)
+        starts = starts[order]
+        ends = np.maximum.accumulate(ends[order])
+        first = np.concatenate([[True], starts[1:] > ends[:-1]])
+        last = np.concatenate([first[1:], [True]])
+        return np.stack([starts[first], ends[last]], axis=1)
+
+    def get_module_crossings(self, x, y, cos_p, sin_p):
+        """Return the first module (in order) whose surface the lines of photons cross, a boolean array
+        for photons that cross a module, and the signed distance from the module centre of the crossing point
+            - x, y, cos_p, sin_p: arrays for the photon starting points and directions
+        """
+        modules = self.module_table
+        crossing = self.get_crossing(x[:, np.newaxis], y[:, np.newaxis], cos_p[:, np.newaxis], sin_p[:, np.newaxis],
+                                     modules['x'], modules['y'], modules['angle'])
+        hit = np.abs(crossing) < modules['width'] / 2.
+        first = np.argmax(hit, axis=1)
+        rows = np.arange(len(x))
+        return first, hit[rows, first], crossing[rows, first]
+
+    @staticmethod
+    def get_crossing(x_p, y_p, cos_p, sin_p, x_c, y_c, angle_c):
+        """Return the signed distance from the centre (x_c, y_c) of a surface with orientation angle_c to where the
+        line of a photon at (x_p, y_p) with direction (cos_p, sin_p) crosses it
+        """
+        cos_c = np.cos(angle_c)
+        sin_c = np.sin(angle_c)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return ((x_p - x_c) * sin_p - (y_p - y_c) * cos_p) / (cos_c * sin_p - sin_c * cos_p)
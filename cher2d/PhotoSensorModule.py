@@ -21,9 +21,14 @@ class PhotoSensorModule(Device):
         for i_sensor in range(self.true_properties['n_sensor'].get_value()):
             self.photo_sensors.append(PhotoSensor(i_sensor, photo_sensor_design_properties, exact))
 
+    def get_children(self) -> list:
+        return self.photo_sensors
+
     @classmethod
-    def flat_mpmt_properties(cls):
+    def flat_mpmt_properties(cls, n_sensor: int = 5, pitch: float = 115.):
         """ Return a dictionary with the flat mPMT design properties
+            - n_sensor: number of photosensors in module
+            - pitch: separation between centres of photosensors (mm)
         """
 
         def add_prop(name: str, description: str, property_type: str, distribution: str, mean, sigma):
@@ -34,9 +39,7 @@ class PhotoSensorModule(Device):
         design_properties = {}
 
         # photosensors
-        n_sensor = 5
         add_prop('n_sensor', 'number of photosensors in module', 'int', 'exact', n_sensor, 0)
-        pitch = 115.
         add_prop('pitch', 'separation between centres of photosensors (mm)', 'float', 'exact', pitch, 0.)
         add_prop('width', ' width of module in the active surface plane (mm)', 'float', 'norm', n_sensor * pitch, 1.)
 
@@ -56,8 +59,11 @@ class PhotoSensorModule(Device):
         return design_properties
 
     @classmethod
-    def dome_mpmt_properties(cls):
+    def dome_mpmt_properties(cls, n_sensor: int = 5, pitch: float = 115., rot_ang: float = 0.3):
         """ Return a dictionary with the dome mpmt design properties
+            - n_sensor: number of photosensors in module
+            - pitch: separation between centres of photosensors (mm)
+            - rot_ang: rotation angle between neighbouring photosensors (rad)
         """
 
         def add_prop(name: str, description: str, property_type: str, distribution: str, mean, sigma):
@@ -68,14 +74,11 @@ class PhotoSensorModule(Device):
         design_properties = {}
 
         # photosensors
-        n_sensor = 5
         add_prop('n_sensor', 'number of photosensors in module', 'int', 'exact', n_sensor, 0)
-        pitch = 115.
         add_prop('pitch', 'separation between centres of photosensors (mm)', 'float', 'exact', pitch, 0.)
         add_prop('width', 'width of module in the active surface plane (mm)', 'float', 'norm', n_sensor * pitch, 1.)
 
         x = -1. * (n_sensor - 1) / 2. * pitch
-        rot_ang = 0.3
         r = pitch / np.sin(rot_ang)
         y0 = r * (1. - np.sin(np.pi / 2. - 2. * rot_ang))
         mid_sensor = int(n_sensor / 2 + 1)
@@ -1,4 +1,4 @@
-from scipy import stats
+import numpy as np
 
 
 class Photon:
@@ -9,8 +9,9 @@ class Photon:
 
     VELOCITY = 299.79 / 1.333
 
-    def __init__(self, t, x, y, angle):
+    def __init__(self, t, x, y, angle, random_numbers_uniform=None, random_numbers_norm=None):
         """Constructor
+            - random_numbers_uniform, random_numbers_norm: drawn here unless given (eg. from a PhotonBundle)
         """
         self.t = t
         self.x = x
@@ -19,5 +20,9 @@ class Photon:
         # the following uniform random numbers (0,1) are used to produce event information for this photon
         # this is done to reduce unnecessary variance when comparing the performance of two detectors
         # analyzing the same event
-        self.random_numbers_uniform = stats.uniform.rvs(size=2)
-        self.random_numbers_norm = stats.norm.rvs(size=2)
+        if random_numbers_uniform is None:
+            random_numbers_uniform = np.random.uniform(size=2)
+        if random_numbers_norm is None:
+            random_numbers_norm = np.random.standard_normal(size=2)
+        self.random_numbers_uniform = random_numbers_uniform
+        self.random_numbers_norm = random_numbers_norm
@@ -0,0 +1,72 @@
+import numpy as np
+from cher2d.Photon import Photon
+
+
+class PhotonBundle:
+    """
+    A PhotonBundle object holds many photons as arrays, for vectorized transport through a detector
+     - t, x, y, angle: as for Photon
+     - random_uniform, random_norm: the random numbers used to produce event information for each photon
+     - dtype: storage type of the arrays (np.float32 halves the memory, see Event for the accuracy check)
+
+    Iterating over a bundle gives Photon objects, as for the list of photons it replaces.
+
+    """
+
+    COLUMNS = ['t', 'x', 'y', 'angle', 'random_uniform', 'random_norm']
+
+    def __init__(self, t, x, y, angle, random_uniform, random_norm, dtype=np.float64):
+        """Constructor
+        """
+        self.t = np.asarray(t, dtype=dtype)
+        self.x = np.asarray(x, dtype=dtype)
+        self.y = np.asarray(y, dtype=dtype)
+        self.angle = np.asarray(angle, dtype=dtype)
+        self.random_uniform = np.asarray(random_uniform, dtype=dtype)
+        self.random_norm = np.asarray(random_norm, dtype=dtype)
+
+    def __len__(self):
+        return len(self.t)
+
+    def __getitem__(self, index):
+        """A slice (or index array) gives a PhotonBundle, an integer gives a Photon
+        """
+        if isinstance(index, (int, np.integer)):
+            return Photon(self.t[index].item(), self.x[index].item(), self.y[index].item(),
+                          self.angle[index].item(), random_numbers_uniform=self.random_uniform[[index]],
+                          random_numbers_norm=self.random_norm[[index]])
+        return PhotonBundle(*[getattr(self, name)[index] for name in self.COLUMNS], dtype=self.t.dtype)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the photon arrays (bytes)
+        """
+        return sum(getattr(self, name).nbytes for name in self.COLUMNS)
+
+    @classmethod
+    def concatenate(cls, bundles: list):
+        """Make one bundle from a list of bundles
+        """
+        if len(bundles) == 1:
+            return bundles[0]
+        return cls(*[np.concatenate([getattr(bundle, name) for bundle in bundles]) for name in cls.COLUMNS],
+                   dtype=np.result_type(*[bundle.t.dtype for bundle in bundles]))
+
+    @classmethod
+    def from_photons(cls, photons):
+        """Make a bundle from a list of Photon objects (or return it, if already a bundle)
+        """
+        if isinstance(photons, PhotonBundle):
+            return photons
+        n = len(photons)
+        t = np.fromiter((photon.t for photon in photons), float, n)
+        x = np.fromiter((photon.x for photon in photons), float, n)
+        y = np.fromiter((photon.y for photon in photons), float, n)
+        angle = np.fromiter((photon.angle for photon in photons), float, n)
+        random_uniform = np.fromiter((photon.random_numbers_uniform[0] for photon in photons), float, n)
+        random_norm = np.fromiter((photon.random_numbers_norm[0] for photon in photons), float, n)
+        return cls(t, x, y, angle, random_uniform, random_norm)
@@ -0,0 +1,156 @@
+import numpy as np
+
+
+class ResponseMap:
+    """
+    A ResponseMap object tabulates the photosensor response, so that it is evaluated by table lookup
+
+    The response of a photosensor is factorized into its nominal values qe_0 and td_0 (design properties 'qe'
+    and 'td', not part of the map) and shapes, tabulated on uniform grids:
+     - angular(theta): the qe angular factor, for the angle of the photon wrt the sensor normal, |theta| in [0, pi]
+     - radial(r): the qe radial factor, for r = |distance from sensor centre| / half-width in [0, 1]
+     - delay(r): the time delay radial factor
+
+     qe = qe_0 * angular(theta) * radial(r)
+     delay = td_0 * delay(r)
+
+    Maps are built from the sensor design properties using the analytic forms described in the Detector docstring,
+    or can be loaded from a file (eg. measured PMT responses). A map has one row per sensor (ordered as in the
+    Geometry tables) or a single row for all sensors of one type.
+
+    The expectation values over the sensor surface (uniform illumination), used for Asimov events, are stored with
+    the map:
+     - expected_radial = E[radial] = (1 + 1/2 c_q) / (1 + abs(c_q))
+     - expected_delay = E[delay] = (1 +  1/2 c_t + 1/2 c_q + 1/3 c_t c_q) / (1 + 1/2 c_q)
+    For maps that are not analytic, these are found by numerical integration of the tables.
+
+    With the default grid sizes, linear interpolation of the analytic maps is accurate to better than 1.E-5
+    (the radial factors are linear in r and are exact), except in the grid cell just behind the sensor plane,
+    pi/2 < |theta| < pi/2 + pi/(N_THETA - 1): with the angular effect on, the factor drops there from 1 to 0
+    (at the node pi/2), and the interpolated value goes linearly from one to the other.
+    """
+
+    N_THETA = 2049
+    N_R = 33
+
+    def __init__(self, angular, radial, delay, expected_radial=None, expected_delay=None):
+        """Constructor
+        """
+        self.angular = np.atleast_2d(angular)
+        self.radial = np.atleast_2d(radial)
+        self.delay = np.atleast_2d(delay)
+
+        if expected_radial is None or expected_delay is None:
+            expected_radial = self.__integrate(self.radial)
+            expected_delay = self.__integrate(self.radial * self.delay) / expected_radial
+        self.expected_radial = np.atleast_1d(expected_radial)
+        self.expected_delay = np.atleast_1d(expected_delay)
+
+        self.version = 0
+
+    @classmethod
+    def from_geometry(cls, geometry, n_theta: int = N_THETA, n_r: int = N_R, rows=None):
+        """Build analytic response maps for the sensors in the geometry tables
+            - rows: optional array of sensor rows, to build the maps for a subset of the sensors
+        """
+        values = geometry.sensor_values
+        if rows is not None:
+            values = {name: values[name][rows] for name in values}
+        theta = np.linspace(0., np.pi, n_theta)
+        r = np.linspace(0., 1., n_r)
+
+        # angular effect, photons arriving from behind the photocathode (cos(theta) <= 0) are not detected
+        c_a = np.where(values['qe_angle'], values['qe_angle_coeff'], 0.)[:, np.newaxis]
+        cos_theta = np.cos(theta)
+        front = cos_theta > 1.E-12
+        with np.errstate(divide='ignore', over='ignore'):
+            factor = np.exp(-1. / np.where(front, c_a * cos_theta, 1.))
+        angular = np.where(front, 1. - factor, np.where(theta <= np.pi / 2., 1., 0.))
+        angular = np.where(c_a > 0., angular, 1.)
+
+        c_q = np.where(values['qe_radial'], values['qe_radial_coeff'], 0.)[:, np.newaxis]
+        c_t = np.where(values['td_radial'], values['td_radial_coeff'], 0.)[:, np.newaxis]
+        radial = (1. + c_q * r) / (1. + np.abs(c_q))
+        delay = 1. + c_t * r
+
+        c_q = c_q[:, 0]
+        c_t = c_t[:, 0]
+        expected_radial = (1. + c_q/2.) / (1. + np.abs(c_q))
+        expected_delay = (1. + c_t/2. + c_q/2. + c_t*c_q/3.) / (1. + c_q/2.)
+
+        return cls(angular, radial, delay, expected_radial, expected_delay)
+
+    def update(self, geometry, rows):
+        """Return analytic maps with the rows for sensors rows rebuilt from the geometry tables (the other rows
+        are kept)
+        """
+        part = self.from_geometry(geometry, self.angular.shape[1], self.radial.shape[1], rows)
+        arrays = []
+        for name in ['angular', 'radial', 'delay', 'expected_radial', 'expected_delay']:
+            array = getattr(self, name).copy()
+            array[rows] = getattr(part, name)
+            arrays.append(array)
+        return ResponseMap(*arrays)
+
+    def save(self, filename):
+        """Save the maps to a numpy .npz file
+        """
+        np.savez(filename, angular=self.angular, radial=self.radial, delay=self.delay,
+                 expected_radial=self.expected_radial, expected_delay=self.expected_delay)
+
+    @classmethod
+    def load(cls, filename):
+        """Load maps from a numpy .npz file, with arrays angular, radial, delay (and optionally
+        expected_radial and expected_delay)
+        """
+        with np.load(filename) as arrays:
+            expected_radial = arrays['expected_radial'] if 'expected_radial' in arrays.files else None
+            expected_delay = arrays['expected_delay'] if 'expected_delay' in arrays.files else None
+            return cls(arrays['angular'], arrays['radial'], arrays['delay'], expected_radial, expected_delay)
+
+    def get_angular(self, index, theta):
+        """Return the qe angular factor for sensors index (array) and photon angles theta wrt sensor normal
+        """
+        # fold theta into [0, pi]
+        theta = np.abs(np.mod(theta + np.pi, 2. * np.pi) - np.pi)
+        return self.__interpolate(self.angular, index, theta / np.pi)
+
+    def get_radial(self, index, r):
+        """Return the qe radial factor for sensors index (array) at relative distances r from their centres
+        """
+        return self.__interpolate(self.radial, index, r)
+
+    def get_delay(self, index, r):
+        """Return the time delay factor for sensors index (array) at relative distances r from their centres
+        """
+        return self.__interpolate(self.delay, index, r)
+
+    def get_expected_radial(self, index):
+        return self.expected_radial[self.__row(self.expected_radial, index)]
+
+    def get_expected_delay(self, index):
+        return self.expected_delay[self.__row(self.expected_delay, index)]
+
+    @staticmethod
+    def __row(table, index):
+        # maps with a single row apply to all sensors
+        if len(table) == 1:
+            return np.zeros_like(index)
+        return index
+
+    @staticmethod
+    def __integrate(table):
+        """Trapezoidal integral of table rows over a uniform grid in [0, 1]
+        """
+        return (table[:, 1:] + table[:, :-1]).sum(axis=1) / 2. / (table.shape[1] - 1)
+
+    @classmethod
+    def __interpolate(cls, table, index, u):
+        """Linear interpolation in table rows, on a uniform grid over u in [0, 1]
+        """
+        n = table.shape[1]
+        u = np.clip(u, 0., 1.) * (n - 1)
+        i = np.minimum(u.astype(int), n - 2)
+        f = u - i
+        row = cls.__row(table, index)
+        return table[row, i] * (1. - f) + table[row, i + 1] * f
@@ -0,0 +1,351 @@
+import inspect
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from cher2d.Analyzer import Analyzer
+from cher2d.Cache import Cache
+from cher2d.Detector import Detector
+from cher2d.Emitter import Emitter
+from cher2d.FitSummary import FitSummary
+from cher2d.PhotoSensor import PhotoSensor
+from cher2d.PhotoSensorModule import PhotoSensorModule
+from cher2d.ToySimulator import ToySimulator
+from cher2d.Trigger import Trigger
+
+
+class Sweep:
+    """
+    A Sweep object runs a study over a list of design points, each as an independent job on a local process pool
+
+    A design point is a dictionary of overrides, with keys:
+     - 'group.name': group is one of detector/module/sensor/emitter. If name is a design property of the group, its
+       mean is set to the value, otherwise the value is passed as a keyword argument to the factory of the group
+       design properties (eg. 'module.rot_ang' for dome modules, 'detector.pitch' for the module pitch)
+     - 'group.name.offset': the offset of the design property is set to the value
+     - 'group.design': selects the factory for the group (eg. 'module.design': 'flat' or 'dome')
+
+    Each completed job is saved in the checkpoint directory, so that an interrupted sweep resumes with the jobs
+    that were not completed. The results of all jobs are collected in one columnar table (dictionary of arrays),
+    with a column for each override, the job index and the columns returned by the job.
+
+    A job is a function job(detector, emitter, seed, settings) that returns a dictionary of equal length columns;
+    it must be picklable (eg. a module level function or a static method). The default job, Sweep.fit_events,
+    generates and fits settings['n_event'] events. If settings['cache_dir'] is given, the events and fit results
+    are kept in a Cache there, so that repeated sweeps only redo the stages whose inputs changed.
+    With settings['dtype'] = 'float32', photons, events and the stored results are kept in single precision.
+    If settings['trigger'] is given (keyword arguments of Trigger, eg. {'n_pe_min': 50}), only the events that pass
+    the trigger are fitted: the rows of rejected events have 'triggered' False, n_pe 0 and NaN fit values.
+    With settings['toy'] = True, the events are drawn from the Asimov expectations (see ToySimulator) instead of
+    being simulated photon by photon, for fast fit bias and coverage studies. Each job of the default job
+    accumulates its fits in a FitSummary as it goes, saved every SUMMARY_INTERVAL events, and get_summary()
+    merges those of the running jobs with those of the completed jobs (bias, spread, pulls, failure rate), so
+    that a study can be followed while it runs.
+
+    """
+
+    GROUPS = ['detector', 'module', 'sensor', 'emitter']
+    FACTORIES = {'detector': {'default': Detector.default_properties},
+                 'module': {'flat': PhotoSensorModule.flat_mpmt_properties,
+                            'dome': PhotoSensorModule.dome_mpmt_properties},
+                 'sensor': {'default': PhotoSensor.default_properties},
+                 'emitter': {'default': Emitter.default_properties}}
+    DEFAULT_DESIGNS = {'detector': 'default', 'module': 'flat', 'sensor': 'default', 'emitter': 'default'}
+    DEFAULT_SETTINGS = {'n_event': 10, 't0': 2., 'exact': True, 'seed': 1, 'cache_dir': None,
+                        'dtype': 'float64', 'trigger': None, 'toy': False}
+    SUMMARY_INTERVAL = 10
+
+    def __init__(self, points: list, checkpoint_dir: str, job=None, settings: dict = None, base_point: dict = None):
+        """Constructor
+            - points: list of design points (dictionaries of overrides), see eg. Sweep.grid
+            - checkpoint_dir: directory for saving completed jobs
+            - job: function run for each point (default: Sweep.fit_events)
+            - settings: dictionary passed to the job (see DEFAULT_SETTINGS)
+            - base_point: overrides applied to every point (eg. emitter position)
+        """
+        self.base_point = {} if base_point is None else dict(base_point)
+        self.points = [dict(self.base_point, **point) for point in points]
+        self.checkpoint_dir = checkpoint_dir
+        self.job = Sweep.fit_events if job is None else job
+        self.settings = dict(self.DEFAULT_SETTINGS)
+        if settings is not None:
+            self.settings.update(settings)
+
+        for point in self.points:
+            for key in point:
+                group = key.split('.')[0]
+                if group not in self.GROUPS:
+                    raise ValueError('Error in constructing Sweep: override (' + key + ') group must be one of:',
+                                     '/'.join(self.GROUPS))
+
+    @staticmethod
+    def grid(values: dict) -> list:
+        """Return the list of design points for all combinations of the override values
+            - values: dictionary of {key: list of values}
+        """
+        keys = list(values)
+        return [dict(zip(keys, combination)) for combination in itertools.product(*[values[key] for key in keys])]
+
+    @classmethod
+    def build(cls, point: dict, exact: bool = True):
+        """Build the detector and emitter for a design point
+        """
+        design_property_sets = {}
+        for group in cls.GROUPS:
+            prefix = group + '.'
+            overrides = {key[len(prefix):]: point[key] for key in point if key.startswith(prefix)}
+            factory = cls.FACTORIES[group][overrides.pop('design', cls.DEFAULT_DESIGNS[group])]
+            arguments = inspect.signature(factory).parameters
+            design_properties = factory(**{name: overrides[name] for name in overrides if name in arguments})
+
+            for name in overrides:
+                if name in arguments:
+                    continue
+                property_name, _, attribute = name.partition('.')
+                if property_name not in design_properties or attribute not in ['', 'offset']:
+                    raise ValueError('Sweep: unknown override (' + prefix + name + ')')
+                if attribute == 'offset':
+                    design_properties[property_name].set_offset(overrides[name])
+                else:
+                    design_properties[property_name].mean = overrides[name]
+            design_property_sets[group] = design_properties
+
+        detector = Detector(0, design_property_sets['detector'], design_property_sets['module'],
+                            design_property_sets['sensor'], exact=exact)
+        emitter = Emitter(0, design_property_sets['emitter'], exact=exact)
+        return detector, emitter
+
+    @staticmethod
+    def fit_events(detector, emitter, seed: int, settings: dict) -> dict:
+        """Default job: generate and fit settings['n_event'] events, starting the fit at the design means
+            - each event has its own random seed [seed, i_event], so that it can be found in the cache
+            - toy events are drawn all at once (random seed [seed, n_event])
+            - the fits are accumulated in a FitSummary, saved to settings['summary_file'] (if given, as by run)
+              every settings['summary_interval'] events (default SUMMARY_INTERVAL)
+        """
+        t0 = settings['t0']
+        analyzer = Analyzer(detector, emitter)
+        guess = {name: emitter.design_properties[name].mean for name in ['x', 'y', 'angle', 'length']}
+        guess['t0'] = t0
+        truth = {name: emitter.get_value(name, True) for name in ['x', 'y', 'angle', 'length']}
+        truth['t0'] = t0
+
+        dtype = np.dtype(settings.get('dtype', 'float64'))
+        cache = None
+        if settings.get('cache_dir') is not None:
+            cache = Cache(settings['cache_dir'])
+
+        trigger = None
+        if settings.get('trigger') is not None:
+            trigger = Trigger(**settings['trigger'])
+            rejected = {'valid': False, 'accurate': False, 'nfcn': 0}
+            for name in analyzer.get_parameter_names():
+                rejected[name] = np.nan
+                rejected[name + '_err'] = np.nan
+
+        toy_events = None
+        if settings.get('toy'):
+            if trigger is not None:
+                raise ValueError('Sweep: the trigger cannot be applied to toy events')
+            np.random.seed([seed, settings['n_event']])
+            toy_events = ToySimulator(detector, emitter).get_events(t0, settings['n_event'], dtype)
+
+        summary = FitSummary(analyzer.get_parameter_names())
+        summary_file = settings.get('summary_file')
+        summary_interval = settings.get('summary_interval', Sweep.SUMMARY_INTERVAL)
+
+        columns = {}
+        for i_event in range(settings['n_event']):
+            if toy_events is not None:
+                event = toy_events[i_event]
+                fit_result = analyzer.fit(event, guess) if cache is None else cache.get_fit(analyzer, event, guess)
+            elif trigger is not None:
+                np.random.seed([seed, i_event])
+                event = trigger.get_event(detector, emitter.emit_chunks(t0, dtype), dtype)
+                if event is None:
+                    fit_result = rejected
+                elif cache is None:
+                    fit_result = analyzer.fit(event, guess)
+                else:
+                    fit_result = cache.get_fit(analyzer, event, guess)
+            elif cache is None:
+                np.random.seed([seed, i_event])
+                event = detector.stream_event(emitter.emit_chunks(t0, dtype), dtype)
+                fit_result = analyzer.fit(event, guess)
+            else:
+                event = cache.get_event(detector, emitter, [seed, i_event], t0, dtype)
+                fit_result = cache.get_fit(analyzer, event, guess)
+            if event is not None:
+                summary.add(fit_result, truth)
+                if summary_file is not None and (i_event + 1) % summary_interval == 0:
+                    summary.save(summary_file)
+            row = {'event': i_event, 'n_pe': 0 if event is None else np.sum(event.n_pe)}
+            if trigger is not None:
+                row['triggered'] = event is not None
+            row.update(fit_result)
+            for name in truth:
+                row[name + '_true'] = truth[name]
+            for name in row:
+                columns.setdefault(name, []).append(row[name])
+        return columns
+
+    @classmethod
+    def run_job(cls, job, point: dict, seed: int, settings: dict) -> dict:
+        np.random.seed(seed)
+        detector, emitter = cls.build(point, settings['exact'])
+        return job(detector, emitter, seed, settings)
+
+    def get_checkpoint(self, i_job: int) -> str:
+        return os.path.join(self.checkpoint_dir, 'job_' + str(i_job) + '.npz')
+
+    def get_summary_file(self, i_job: int) -> str:
+        """Return the file of the FitSummary saved by a running job (see fit_events)
+        """
+        return os.path.join(self.checkpoint_dir, 'job_' + str(i_job) + '.summary.npz')
+
+    def is_completed(self, i_job: int) -> bool:
+        """Return True if the job has a checkpoint for the same design point and settings
+        """
+        filename = self.get_checkpoint(i_job)
+        if not os.path.exists(filename):
+            return False
+        with np.load(filename) as contents:
+            return str(contents['job']) == self.__describe(i_job)
+
+    def run(self, n_workers: int = None) -> dict:
+        """Run the jobs that are not yet completed and return the collected results
+            - n_workers: number of processes (default: number of cpus), 0 to run in this process
+            - a job that raises does not stop the others: every job that succeeds is saved, and the failed jobs
+              are reported at the end (RuntimeError), so that a new run retries only those
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        pending = [i_job for i_job in range(len(self.points)) if not self.is_completed(i_job)]
+        # summaries left by earlier runs of the pending jobs are not for this run
+        for i_job in pending:
+            if os.path.exists(self.get_summary_file(i_job)):
+                os.remove(self.get_summary_file(i_job))
+
+        failed = {}
+        if n_workers == 0:
+            for i_job in pending:
+                try:
+                    columns = self.run_job(self.job, self.points[i_job], self.__seed(i_job),
+                                           self.__get_job_settings(i_job))
+                except Exception as error:
+                    failed[i_job] = error
+                    continue
+                self.__save(i_job, columns)
+        elif len(pending) > 0:
+            with ProcessPoolExecutor(n_workers) as executor:
+                futures = {executor.submit(Sweep.run_job, self.job, self.points[i_job], self.__seed(i_job),
+                                           self.__get_job_settings(i_job)): i_job for i_job in pending}
+                for future in as_completed(futures):
+                    try:
+                        columns = future.result()
+                    except Exception as error:
+                        failed[futures[future]] = error
+                        continue
+                    self.__save(futures[future], columns)
+
+        if len(failed) > 0:
+            first = min(failed)
+            raise RuntimeError('Sweep: ' + str(len(failed)) + ' job(s) failed (' +
+                               ', '.join(str(i_job) for i_job in sorted(failed)) + '), first error (job ' +
+                               str(first) + '): ' + repr(failed[first])) from failed[first]
+        return self.collect()
+
+    def collect(self) -> dict:
+        """Return the results of the completed jobs as one columnar table (dictionary of arrays)
+        """
+        tables = []
+        for i_job in range(len(self.points)):
+            if not self.is_completed(i_job):
+                continue
+            with np.load(self.get_checkpoint(i_job)) as contents:
+                table = {key[len('column:'):]: contents[key] for key in contents.files if key.startswith('column:')}
+            n_row = len(next(iter(table.values()))) if len(table) > 0 else 0
+            table['job'] = np.full(n_row, i_job)
+            for key in self.points[i_job]:
+                table[key] = np.full(n_row, self.points[i_job][key])
+            tables.append(table)
+
+        # columns missing for some jobs (eg. overrides not given for every point) are filled with NaN or ''
+        names = []
+        for table in tables:
+            names += [name for name in table if name not in names]
+        results = {}
+        for name in names:
+            kind = next(table[name].dtype.kind for table in tables if name in table)
+            fill = '' if kind in 'USO' else np.nan
+            results[name] = np.concatenate([table[name] if name in table else np.full(len(table['job']), fill)
+                                            for table in tables])
+        return results
+
+    def get_summary(self, jobs: list = None) -> FitSummary:
+        """Return the FitSummary of the fits of the default job (Sweep.fit_events), merged from the summary of
+        each job: built from the checkpoint of a completed job, or as last saved by a running job, so that a
+        running sweep can be followed
+            - jobs: list of job indices (default: all), eg. the jobs of one design point
+            - events rejected by the trigger are not included
+            - jobs whose results are not fits (eg. of a custom job) are skipped
+        """
+        names = list(Analyzer.PARAMETER_NAMES)
+        required = ['event'] + names + [name + '_err' for name in names] + [name + '_true' for name in names]
+        summary = FitSummary(names)
+        for i_job in range(len(self.points)) if jobs is None else jobs:
+            if self.is_completed(i_job):
+                with np.load(self.get_checkpoint(i_job)) as contents:
+                    table = {key[len('column:'):]: contents[key] for key in contents.files
+                             if key.startswith('column:')}
+                if not all(name in table for name in required):
+                    continue
+                job_summary = FitSummary(names)
+                for i_row in range(len(table['event'])):
+                    if 'triggered' in table and not table['triggered'][i_row]:
+                        continue
+                    result = {name: table[name][i_row] for name in table}
+                    job_summary.add(result, {name: table[name + '_true'][i_row] for name in names})
+            elif os.path.exists(self.get_summary_file(i_job)):
+                try:
+                    job_summary = FitSummary.load(self.get_summary_file(i_job))
+                except (FileNotFoundError, OSError, ValueError, KeyError):
+                    # the job has just completed (and removed it)
+                    continue
+                if job_summary.parameter_names != names:
+                    continue
+            else:
+                continue
+            summary.merge(job_summary)
+        return summary
+
+    def __get_job_settings(self, i_job: int) -> dict:
+        return dict(self.settings, summary_file=self.get_summary_file(i_job))
+
+    def __seed(self, i_job: int) -> int:
+        return self.settings['seed'] + i_job
+
+    def __describe(self, i_job: int) -> str:
+        job_name = getattr(self.job, '__qualname__', str(self.job))
+        return json.dumps({'point': self.points[i_job], 'settings': self.settings, 'job': job_name,
+                           'seed': self.__seed(i_job)}, sort_keys=True, default=str)
+
+    def __save(self, i_job: int, columns: dict):
+        """Save the results of a job: written to a temporary file that is then renamed, so that a checkpoint
+        is either complete or absent
+        """
+        filename = self.get_checkpoint(i_job)
+        temporary = filename + '.tmp.npz'
+        dtype = np.dtype(self.settings.get('dtype', 'float64'))
+        arrays = {}
+        for name in columns:
+            array = np.asarray(columns[name])
+            if array.dtype.kind == 'f':
+                array = array.astype(dtype)
+            elif array.dtype.kind in 'iu' and dtype.itemsize < 8:
+                array = array.astype(np.int32)
+            arrays['column:' + name] = array
+        np.savez(temporary, job=np.array(self.__describe(i_job)), **arrays)
+        os.replace(temporary, filename)
+        if os.path.exists(self.get_summary_file(i_job)):
+            os.remove(self.get_summary_file(i_job))
@@ -0,0 +1,114 @@
+import numpy as np
+from cher2d.Event import Event
+
+
+class ToySimulator:
+    """
+    A ToySimulator object produces toy events directly from the Asimov expectations of a detector, for fit bias
+    and coverage studies that do not need photon transport
+
+    For each photosensor, the number of pe is drawn from a Poisson distribution with the expected mean, and the
+    mean time of the pe from a normal distribution centred at the expected time with standard deviation
+    t_sig / sqrt(n_pe). These are the distributions assumed by Analyzer.ln_likelihood, so that fits to toy
+    events follow the likelihood model. Dark noise is not included (as in the likelihood).
+
+    Limitation: where the emission interval seen by a sensor is cut by the start or end of the track (the
+    partially illuminated sensors at the edge of the light cone), the expected time is only approximate, and the
+    mean times of the full simulation differ from it by about 0.1 ns (7 standard errors for 400 events of the
+    default track). The n_pe distributions agree, and so do the mean times of the fully illuminated sensors.
+
+    Events are drawn for many events at once (arrays of shape (n_event, n_module, n_sensor)). Use validate() to
+    compare the n_pe and mean time distributions with those of the full simulation (Emitter.emit and
+    Detector.get_event).
+
+    """
+
+    PARAMETER_NAMES = ['x', 'y', 'angle', 'length']
+
+    def __init__(self, detector, emitter):
+        """Constructor
+            - emitter can be a list of emitters (the expectations of the tracks are summed, as for pile-up)
+        """
+        self.detector = detector
+        self.emitter = emitter
+
+    def get_expectations(self, t0: float):
+        """Return the expected n_pe and mean time of each photosensor (arrays indexed by [i_module][i_sensor]) for
+        the true emitter parameters and starting time t0 (ns)
+        """
+        emitters = self.emitter if isinstance(self.emitter, list) else [self.emitter]
+        parameters = []
+        for emitter in emitters:
+            parameters.append({name: emitter.get_value(name, True) for name in self.PARAMETER_NAMES})
+            parameters[-1]['t0'] = t0
+        asimov = self.detector.get_asimov(self.emitter, parameters if isinstance(self.emitter, list) else
+                                          parameters[0], True)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t_expected = np.where(asimov.n_pe > 0., asimov.sum_t / asimov.n_pe, 0.)
+        return asimov.n_pe, t_expected
+
+    def get_events(self, t0: float, n_event: int, dtype=np.float64) -> list:
+        """Produce n_event toy events for the emitter starting at time t0 (ns)
+            - dtype: storage type of the event arrays (see Event)
+        """
+        n_expected, t_expected = self.get_expectations(t0)
+        geometry = self.detector.get_geometry(True)
+        t_sig = np.zeros_like(t_expected)
+        t_sig[geometry.sensor_table['module'], geometry.sensor_table['sensor']] = geometry.sensor_values['t_sig']
+
+        shape = (n_event,) + n_expected.shape
+        n_pe = np.random.poisson(n_expected, size=shape).astype(dtype)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_t = t_expected + t_sig / np.sqrt(n_pe) * np.random.standard_normal(size=shape)
+            sum_t = np.where(n_pe > 0, mean_t * n_pe, 0.).astype(dtype)
+
+        return [Event.from_arrays(self.detector, n_pe[i_event], sum_t[i_event]) for i_event in range(n_event)]
+
+    def validate(self, t0: float, n_event: int) -> dict:
+        """Compare toy events with events from the full simulation (n_event of each), and return a dictionary
+        of arrays indexed by [i_module][i_sensor]:
+            - 'n_pe': (toy, full) mean n_pe, 'n_pe_pull': their difference divided by its standard error
+            - 'n_pe_var': (toy, full) variance of n_pe
+            - 'mean_t': (toy, full) average of the mean times of events with pe, 'mean_t_pull': their difference
+              divided by its standard error
+            - 'mean_t_std': (toy, full) standard deviation of the mean times, scaled by sqrt(n_pe) (compare
+              with t_sig)
+        and 'chi2': the sums of squared pulls for n_pe and mean_t, with 'ndf' the numbers of sensors compared
+        """
+        emitters = self.emitter if isinstance(self.emitter, list) else [self.emitter]
+        samples = {'toy': self.get_events(t0, n_event), 'full': []}
+        for i_event in range(n_event):
+            for emitter in emitters:
+                emitter.emit(t0)
+            samples['full'].append(self.detector.get_event(self.emitter))
+
+        moments = {}
+        for name, events in samples.items():
+            n_pe = np.array([event.n_pe for event in events], dtype=float)
+            sum_t = np.array([event.sum_t for event in events], dtype=float)
+            hit = n_pe > 0
+            n_hit = np.sum(hit, axis=0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean_t = np.where(hit, sum_t / n_pe, 0.)
+                average_t = np.sum(mean_t, axis=0) / n_hit
+                scaled = np.where(hit, (mean_t - average_t) * np.sqrt(n_pe), 0.)
+                std_t = np.sqrt(np.sum(scaled ** 2, axis=0) / (n_hit - 1))
+                deviations = np.where(hit, (mean_t - average_t) ** 2, 0.)
+                error_t = np.sqrt(np.sum(deviations, axis=0) / (n_hit - 1) / n_hit)
+            moments[name] = {'n_pe': np.mean(n_pe, axis=0), 'n_pe_var': np.var(n_pe, axis=0, ddof=1),
+                             'mean_t': average_t, 'mean_t_std': std_t, 'mean_t_error': error_t, 'n_hit': n_hit}
+
+        toy = moments['toy']
+        full = moments['full']
+        results = {name: (toy[name], full[name]) for name in ['n_pe', 'n_pe_var', 'mean_t', 'mean_t_std']}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            results['n_pe_pull'] = (toy['n_pe'] - full['n_pe']) / np.sqrt((toy['n_pe_var'] + full['n_pe_var']) /
+                                                                          n_event)
+            results['mean_t_pull'] = (toy['mean_t'] - full['mean_t']) / np.hypot(toy['mean_t_error'],
+                                                                                 full['mean_t_error'])
+        # compare the sensors with enough events for the errors to be meaningful
+        compared = {'n_pe': np.isfinite(results['n_pe_pull']),
+                    'mean_t': (np.minimum(toy['n_hit'], full['n_hit']) >= 10) & np.isfinite(results['mean_t_pull'])}
+        results['chi2'] = {name: float(np.sum(results[name + '_pull'][compared[name]] ** 2)) for name in compared}
+        results['ndf'] = {name: int(np.sum(compared[name])) for name in compared}
+        return results
@@ -0,0 +1,168 @@
+import numpy as np
+from cher2d.Event import Event
+from cher2d.PhotonBundle import PhotonBundle
+
+
+class Trigger:
+    """
+    A Trigger object decides which events are kept for fitting, and produces events only as far as needed
+
+    Conditions (0: not applied):
+     - n_pe_min: minimum total number of pe
+     - n_module_min: minimum number of modules with at least one pe
+     - n_coincidence: minimum number of pe within a time window of width readout_window (detector property)
+
+    Rejection is made as early as it is certain:
+     - acceptance: only photons whose lines cross a module can produce a pe, so the numbers of those photons
+       and of the modules they reach are upper bounds for n_pe and the module multiplicity. Events that cannot
+       pass are rejected before the sensors are considered (not applied if the sensors have dark noise, as
+       dark noise pulses could make up the difference).
+     - transport: the photons that reach modules are transported in chunks (chunk_size photons), and transport
+       stops once the pe found plus the photons remaining cannot satisfy the conditions.
+     - the conditions are applied to the pe of the complete event.
+
+    Photons given in chunks (eg. Emitter.emit_chunks) are transported one chunk at a time and not kept, so that
+    the memory needed does not depend on the length or brightness of the track. As the photons still to come are
+    not known, such events are only rejected at the last stage (complete event).
+
+    The statistics (get_statistics) count the events seen and accepted, the rejections for each condition and
+    stage, and the photons that were not transported. They can be combined for a study with merge().
+
+    """
+
+    CONDITIONS = ['n_pe', 'n_module', 'coincidence']
+    STAGES = ['acceptance', 'transport', 'event']
+
+    def __init__(self, n_pe_min: int = 0, n_module_min: int = 0, n_coincidence: int = 0, chunk_size: int = 2000):
+        """Constructor
+        """
+        self.n_pe_min = n_pe_min
+        self.n_module_min = n_module_min
+        self.n_coincidence = n_coincidence
+        self.chunk_size = chunk_size
+
+        self.n_event = 0
+        self.n_accepted = 0
+        self.rejected = {stage + ':' + condition: 0 for stage in self.STAGES for condition in self.CONDITIONS}
+        self.n_photon = 0
+        self.n_photon_skipped = 0
+
+    def get_event(self, detector, emitter, dtype=np.float64):
+        """Produce the event from the emitter photons (as Detector.get_event) and return it if it passes the
+        trigger conditions, otherwise None
+            - emitter can be a list of emitters (pile-up), or an iterable of PhotonBundles (eg. Emitter.emit_chunks)
+        """
+        emitters = emitter if isinstance(emitter, list) else [emitter]
+        if not all(hasattr(item, 'emit_chunks') for item in emitters):
+            return self.__get_streamed_event(detector, emitter, dtype)
+        photons = PhotonBundle.concatenate([PhotonBundle.from_photons(item.photons) for item in emitters])
+        self.n_event += 1
+        self.n_photon += len(photons)
+
+        # acceptance: photons whose lines cross a module
+        geometry = detector.get_geometry(True)
+        cos_p = np.cos(photons.angle)
+        sin_p = np.sin(photons.angle)
+        first_m, crossed, _ = geometry.get_module_crossings(photons.x, photons.y, cos_p, sin_p)
+        candidates = np.flatnonzero(crossed)
+        certain = not np.any(geometry.sensor_values['dark_noise_rate'] > 0.)
+        if certain:
+            failed = self.__get_failed(len(candidates), len(np.unique(first_m[candidates])))
+            if failed is not None:
+                return self.__reject('acceptance', failed, len(photons))
+
+        # transport in chunks, stopping once the pe found plus the photons remaining (counted at the modules
+        # they reach) cannot satisfy the conditions
+        hits = []
+        n_pe = 0
+        modules = np.zeros(geometry.n_module, dtype=bool)
+        remaining = np.bincount(first_m[candidates], minlength=geometry.n_module)
+        for start in range(0, len(candidates), self.chunk_size):
+            chunk = candidates[start:start + self.chunk_size]
+            i_module, i_sensor, t_obs = detector.transport(photons[chunk])
+            hits.append((i_module, i_sensor, t_obs))
+            n_pe += len(t_obs)
+            modules[i_module] = True
+            remaining -= np.bincount(first_m[chunk], minlength=geometry.n_module)
+            if certain and start + self.chunk_size < len(candidates):
+                failed = self.__get_failed(n_pe + np.sum(remaining), np.sum(modules | (remaining > 0)))
+                if failed is not None:
+                    return self.__reject('transport', failed, len(candidates) - start - len(chunk))
+
+        return self.__get_complete_event(detector, hits, dtype)
+
+    def __get_streamed_event(self, detector, chunks, dtype):
+        """Transport the photons one chunk at a time and apply the conditions to the complete event
+        """
+        self.n_event += 1
+        hits = []
+        for photons in chunks:
+            self.n_photon += len(photons)
+            hits.append(detector.transport(photons))
+        return self.__get_complete_event(detector, hits, dtype)
+
+    def __get_complete_event(self, detector, hits: list, dtype):
+        """Add the dark noise to the pe found (list of arrays of module index, sensor index and time), and return
+        the event if it passes the conditions, otherwise None
+        """
+        if len(hits) == 0:
+            hits.append((np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0)))
+        i_module, i_sensor, t_obs = [np.concatenate(columns) for columns in zip(*hits)]
+        dark = detector.get_dark_noise(np.sum(t_obs) / len(t_obs) if len(t_obs) > 0 else np.nan)
+        i_module, i_sensor, t_obs = [np.concatenate(columns) for columns in zip((i_module, i_sensor, t_obs), dark)]
+
+        # the conditions for the complete event
+        window = detector.true_properties['readout_window'].get_value()
+        failed = self.__get_failed(len(t_obs), len(np.unique(i_module)), self.get_coincidence(t_obs, window))
+        if failed is not None:
+            return self.__reject('event', failed, 0)
+
+        event = Event(detector, dtype)
+        event.add_pes(i_module, i_sensor, t_obs)
+        self.n_accepted += 1
+        return event
+
+    @staticmethod
+    def get_coincidence(t, window: float) -> int:
+        """Return the largest number of times t (array) within any time window of the given width
+        """
+        if len(t) == 0:
+            return 0
+        t = np.sort(t)
+        return int(np.max(np.searchsorted(t, t + window, side='right') - np.arange(len(t))))
+
+    def __get_failed(self, n_pe: int, n_module: int, n_coincidence: int = None):
+        """Return the first condition that fails (None if all pass); n_pe is also the bound for coincidence
+        """
+        if n_pe < self.n_pe_min:
+            return 'n_pe'
+        if n_module < self.n_module_min:
+            return 'n_module'
+        if (n_pe if n_coincidence is None else n_coincidence) < self.n_coincidence:
+            return 'coincidence'
+        return None
+
+    def __reject(self, stage: str, condition: str, n_skipped: int):
+        self.rejected[stage + ':' + condition] += 1
+        self.n_photon_skipped += n_skipped
+        return None
+
+    def get_statistics(self) -> dict:
+        """Return the trigger statistics: events seen, accepted, rejected (in total and for each
+        stage:condition), and the fraction of photons that were not transported
+        """
+        statistics = {'n_event': self.n_event, 'n_accepted': self.n_accepted,
+                      'n_rejected': self.n_event - self.n_accepted,
+                      'photons_skipped': self.n_photon_skipped / self.n_photon if self.n_photon > 0 else 0.}
+        statistics.update(self.rejected)
+        return statistics
+
+    def merge(self, other):
+        """Add the statistics of another Trigger object (eg. from another job of a study)
+        """
+        self.n_event += other.n_event
+        self.n_accepted += other.n_accepted
+        self.n_photon += other.n_photon
+        self.n_photon_skipped += other.n_photon_skipped
+        for key in self.rejected:
+            self.rejected[key] += other.rejected[key]
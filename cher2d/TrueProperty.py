@@ -13,13 +13,26 @@ class TrueProperty(Property):
         super().__init__(name, description, property_type)
 
         self.__value = None
+        self.__store = None
+        self.__index = None
         self.set_value(value)
 
+    def bind(self, store, index: int):
+        """
+        Hold the value in the true value array of a DesignProperty (store) at position index
+
+        """
+        store.set_true_value(index, self.__value)
+        self.__store = store
+        self.__index = index
+
     def get_value(self):
         """
         Return the true value of the property
 
         """
+        if self.__store is not None:
+            return self.__store.get_true_value(self.__index)
         return self.__value
 
     def set_value(self, new_value):
@@ -34,4 +47,7 @@ class TrueProperty(Property):
                             ') value type (' + type(new_value).__name__ +
                             ') does not match property_type (' +
                             self.property_type + ')')
-        self.__value = new_value
+        if self.__store is not None:
+            self.__store.set_true_value(self.__index, new_value)
+        else:
+            self.__value = new_value
@@ -1,122 +1,149 @@
-import matplotlib.pyplot as plt
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+from cher2d.PhotonBundle import PhotonBundle
 
 
 class Visualizer:
     """
-    A Device object is a group of PhotoSensorModules
+    A Visualizer object draws the detector, events, emitters and photons
+
+    matplotlib is imported when a Visualizer is first constructed (not when the module is imported).
+
+    Each kind of object is drawn with a single batched artist (LineCollection) built from the flat geometry
+    tables, so that drawing bright events is fast.
+     - headless: True - draw on a figure not managed by pyplot (no display needed, for saving image files)
 
     """
     NUM_COLORS = 100
 
-    def __init__(self, detector):
+    def __init__(self, detector, headless: bool = False):
         """Constructor
         """
         self.plot = None
+        self.axes = None
         self.detector = detector
-        self.cm = plt.get_cmap('gist_rainbow')
+        # geometry tables drawn when there is no detector (see from_geometry)
+        self.geometry = None
+        self.headless = headless
+        from matplotlib import colormaps
+        self.cm = colormaps['gist_rainbow']
+
+    @classmethod
+    def from_geometry(cls, geometry, headless: bool = True):
+        """Make a Visualizer from geometry tables alone (no Detector object needed)
+        """
+        visualizer = cls(None, headless)
+        visualizer.geometry = geometry
+        return visualizer
+
+    def get_geometry(self):
+        """Return the geometry tables to draw: those of the detector as it is now, or those given to from_geometry
+        """
+        if self.detector is not None:
+            return self.detector.get_geometry(True)
+        return self.geometry
 
     def savefig(self, filename):
         self.plot.savefig(filename)
 
     def show(self):
+        if self.headless:
+            raise RuntimeError('Visualizer: show() is not available in headless mode, use savefig()')
         self.plot.show()
 
+    def close(self):
+        if self.plot is not None and not self.headless:
+            import matplotlib.pyplot as plt
+            plt.close(self.plot)
+        self.plot = None
+        self.axes = None
+
+    def new_figure(self, figsize=(8, 8)):
+        if self.headless:
+            from matplotlib.figure import Figure
+            self.plot = Figure(figsize=figsize)
+        else:
+            import matplotlib.pyplot as plt
+            self.plot = plt.figure(figsize=figsize)
+        self.axes = self.plot.add_subplot()
+
+    def get_axes(self):
+        if self.axes is None:
+            self.new_figure()
+        return self.axes
+
     @staticmethod
-    def draw_line(x, y, angle, width, **kwargs):
-        vector = [width / 2. * np.cos(angle), width / 2. * np.sin(angle)]
-        ends = np.array([np.add([x, y], vector), np.subtract([x, y], vector)]).T
-        plt.plot(ends[0], ends[1], **kwargs)
+    def get_segments(x, y, angle, width):
+        """Return an array of line segments (n, 2, 2) centred on x, y (arrays) with orientation angle and length width
+        """
+        dx = width / 2. * np.cos(angle)
+        dy = width / 2. * np.sin(angle)
+        return np.stack([np.stack([x + dx, y + dy], axis=-1), np.stack([x - dx, y - dy], axis=-1)], axis=1)
+
+    def draw_line(self, x, y, angle, width, **kwargs):
+        from matplotlib.collections import LineCollection
+        self.get_axes().add_collection(LineCollection(self.get_segments(np.atleast_1d(x), np.atleast_1d(y),
+                                                                        np.atleast_1d(angle), np.atleast_1d(width)),
+                                                      **kwargs))
 
     def draw_detector(self, xlim=(-5500, 500), ylim=(-500, 5500)):
         """Show the layout of the photosensor and modules
         """
-        plt.figure(figsize=(8, 8))
-        plt.xlim(xlim)
-        plt.ylim(ylim)
-
-        # draw each module
-        n_module = self.detector.true_properties['n_module'].get_value()
-        for i_module in range(n_module):
-            i_str = str(i_module)
-            x = self.detector.true_properties['x_' + i_str].get_value()
-            y = self.detector.true_properties['y_' + i_str].get_value()
-            angle = self.detector.true_properties['angle_' + i_str].get_value()
-            module = self.detector.photo_sensor_modules[i_module]
-            width = module.true_properties['width'].get_value()
-            self.draw_line(x, y, angle, width, lw=4, alpha=0.3, zorder=1)
-
-            n_sensor = module.true_properties['n_sensor'].get_value()
-            for i_sensor in range(n_sensor):
-                i_str = str(i_sensor)
-                x_s = module.true_properties['x_' + i_str].get_value()
-                y_s = module.true_properties['y_' + i_str].get_value()
-                angle_s = module.true_properties['angle_' + i_str].get_value()
-                sensor = module.photo_sensors[i_sensor]
-                width_s = sensor.true_properties['width'].get_value()
-                x_d, y_d, angle_d = sensor.get_global_orientation([x_s, y_s, angle_s], [x, y, angle])
-                self.draw_line(x_d, y_d, angle_d, width_s, lw=1, color='black', zorder=2)
-
-        self.plot = plt.gcf()
+        self.new_figure()
+        self.axes.set_xlim(xlim)
+        self.axes.set_ylim(ylim)
+
+        geometry = self.get_geometry()
+        modules = geometry.module_table
+        sensors = geometry.sensor_table
+        self.draw_line(modules['x'], modules['y'], modules['angle'], modules['width'], lw=4, alpha=0.3, zorder=1)
+        self.draw_line(sensors['x'], sensors['y'], sensors['angle'], sensors['width'], lw=1, color='black',
+                       zorder=2)
 
     def draw_event(self, event):
-        n_module = self.detector.true_properties['n_module'].get_value()
-        for i_module in range(n_module):
-            i_str = str(i_module)
-            x = self.detector.true_properties['x_' + i_str].get_value()
-            y = self.detector.true_properties['y_' + i_str].get_value()
-            angle = self.detector.true_properties['angle_' + i_str].get_value()
-            module = self.detector.photo_sensor_modules[i_module]
-
-            n_sensor = module.true_properties['n_sensor'].get_value()
-            for i_sensor in range(n_sensor):
-                n_photons = event.n_pe[i_module][i_sensor]
-                if n_photons > 0:
-                    i_str = str(i_sensor)
-                    x_s = module.true_properties['x_' + i_str].get_value()
-                    y_s = module.true_properties['y_' + i_str].get_value()
-                    angle_s = module.true_properties['angle_' + i_str].get_value()
-                    sensor = module.photo_sensors[i_sensor]
-                    width_s = sensor.true_properties['width'].get_value()
-                    x_d, y_d, angle_d = sensor.get_global_orientation([x_s, y_s, angle_s], [x, y, angle])
-                    color = self.cm(1. * n_photons / self.NUM_COLORS)
-
-                    self.draw_line(x_d, y_d, angle_d, width_s, lw=2, color=color, zorder=3)
-
-        self.plot = plt.gcf()
+        sensors = self.get_geometry().sensor_table
+        n_pe = np.asarray(event.n_pe)[sensors['module'], sensors['sensor']]
+        self.draw_hits(n_pe)
+
+    def draw_hits(self, n_pe):
+        """Colour the sensors according to n_pe (array ordered as in the geometry tables)
+        """
+        sensors = self.get_geometry().sensor_table
+        hit = n_pe > 0
+        if np.any(hit):
+            colors = self.cm(1. * n_pe[hit] / self.NUM_COLORS)
+            self.draw_line(sensors['x'][hit], sensors['y'][hit], sensors['angle'][hit], sensors['width'][hit],
+                           lw=2, colors=colors, zorder=3)
 
     def draw_photons(self, emitter, mod_n=1):
         """Show photons produced by an emitter
         mod_n: draw every mod_n photons (to show all, set mod_n = 1)
+        The photons kept by Emitter.emit are used, so all photons of the track are held in memory.
+        """
+        photons = PhotonBundle.from_photons(emitter.photons)[::mod_n]
+        self.draw_rays(photons.x.astype(float), photons.y.astype(float), photons.angle.astype(float))
+
+    def draw_rays(self, x0, y0, angle):
+        """Draw photons (arrays of starting points and angles) up to the module they cross
         """
         max_distance = 100000
-        n_module = self.detector.true_properties['n_module'].get_value()
-        for i, photon in enumerate(emitter.photons):
-            if i % mod_n == 0:
-                x0 = photon.x
-                y0 = photon.y
-
-                # see if photon crosses a module:
-                distance = max_distance
-                for i_module in range(n_module):
-                    i_str = str(i_module)
-                    x_m = self.detector.true_properties['x_' + i_str].get_value()
-                    y_m = self.detector.true_properties['y_' + i_str].get_value()
-                    angle_m = self.detector.true_properties['angle_' + i_str].get_value()
-                    module = self.detector.photo_sensor_modules[i_module]
-                    width = module.true_properties['width'].get_value()
-
-                    x, y = module.find_intersection(photon, [x_m, y_m, angle_m])
-                    dist_m = np.sqrt((x - x_m) ** 2 + (y - y_m) ** 2)
-                    if dist_m < width / 2.:
-                        distance = np.sqrt((x0 - x) ** 2 + (y0 - y) ** 2)
-                        break
-
-                x1 = x0 + distance * np.cos(photon.angle)
-                y1 = y0 + distance * np.sin(photon.angle)
-                plt.plot([x0, x1], [y0, y1], ls='--', color='grey', zorder=1)
-
-        self.plot = plt.gcf()
+        cos_p = np.cos(angle)
+        sin_p = np.sin(angle)
+
+        # see if photon crosses a module:
+        geometry = self.get_geometry()
+        modules = geometry.module_table
+        first, crossed, crossing = geometry.get_module_crossings(x0, y0, cos_p, sin_p)
+        x = modules['x'][first] + crossing * np.cos(modules['angle'][first])
+        y = modules['y'][first] + crossing * np.sin(modules['angle'][first])
+        distance = np.where(crossed, np.sqrt((x0 - x) ** 2 + (y0 - y) ** 2), max_distance)
+
+        x1 = x0 + distance * cos_p
+        y1 = y0 + distance * sin_p
+        from matplotlib.collections import LineCollection
+        segments = np.stack([np.stack([x0, y0], axis=-1), np.stack([x1, y1], axis=-1)], axis=1)
+        self.get_axes().add_collection(LineCollection(segments, linestyles='--', colors='grey', zorder=1))
 
     def draw_emitter(self, emitter):
         """Show photons produced by an emitter
@@ -125,9 +152,47 @@ class Visualizer:
         y0 = emitter.true_properties['y'].get_value()
         angle = emitter.true_properties['angle'].get_value()
         length = emitter.true_properties['length'].get_value()
+        self.draw_track(x0, y0, angle, length)
 
+    def draw_track(self, x0, y0, angle, length):
         x1 = x0 + length * np.cos(angle)
         y1 = y0 + length * np.sin(angle)
-        plt.plot([x0, x1], [y0, y1], lw=3, color='red', zorder=4)
-
-        self.plot = plt.gcf()
+        self.get_axes().plot([x0, x1], [y0, y1], lw=3, color='red', zorder=4)
+
+    @classmethod
+    def render_events(cls, detector, events: list, filenames: list, tracks: list = None, n_workers: int = None,
+                      xlim=(-5500, 500), ylim=(-500, 5500)):
+        """Render many event displays to image files, in parallel worker processes
+            - tracks: optional list of emitter tracks (x, y, angle, length) to draw with each event
+            - n_workers: number of processes (default: number of cpus)
+        """
+        geometry = detector.get_geometry(True)
+        sensors = geometry.sensor_table
+        if tracks is None:
+            tracks = [None] * len(events)
+        jobs = [(np.asarray(event.n_pe)[sensors['module'], sensors['sensor']], filename, track, xlim, ylim)
+                for event, filename, track in zip(events, filenames, tracks)]
+
+        if n_workers is None:
+            n_workers = os.cpu_count()
+        chunksize = max(1, len(jobs) // (4 * n_workers))
+        with ProcessPoolExecutor(n_workers, initializer=cls._start_worker, initargs=(geometry,)) as executor:
+            return list(executor.map(cls._render_event, jobs, chunksize=chunksize))
+
+    _worker_visualizer = None
+
+    @classmethod
+    def _start_worker(cls, geometry):
+        cls._worker_visualizer = cls.from_geometry(geometry, headless=True)
+
+    @classmethod
+    def _render_event(cls, job):
+        n_pe, filename, track, xlim, ylim = job
+        visualizer = cls._worker_visualizer
+        visualizer.draw_detector(xlim, ylim)
+        visualizer.draw_hits(n_pe)
+        if track is not None:
+            visualizer.draw_track(*track)
+        visualizer.savefig(filename)
+        visualizer.close()
+        return filename
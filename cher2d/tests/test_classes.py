@@ -5,9 +5,132 @@ from cher2d.Detector import Detector
 from cher2d.Emitter import Emitter
 from cher2d.Analyzer import Analyzer
 from cher2d.Visualizer import Visualizer
+from cher2d.DesignProperty import DesignProperty
+from cher2d.Configuration import Configuration
+from cher2d.Geometry import Geometry
+from cher2d.Cache import Cache
+from cher2d.EnsembleSampler import EnsembleSampler
+from cher2d.FitSummary import FitSummary
+from cher2d.Event import Event
+from cher2d.Sweep import Sweep
+from cher2d.PhotonBundle import PhotonBundle
+from cher2d.Trigger import Trigger
+from cher2d.ResponseMap import ResponseMap
+from cher2d.ToySimulator import ToySimulator
+import os
+import subprocess
+import sys
+import tempfile
 import numpy as np
 
 
+def expectations_reference(detector, emitter, parameters: dict, truth: bool) -> Event:
+    """Asimov event computed one sensor at a time, as done before the expectations were vectorized
+    """
+    from cher2d.Photon import Photon
+
+    asimov = Event(detector)
+    x_e, y_e, angle_e, length_e, t0_e = [parameters[name] for name in ['x', 'y', 'angle', 'length', 't0']]
+    ch_density = emitter.get_value('ch_density', truth)
+    velocity_e = emitter.get_value('velocity', truth)
+    for i_module in range(detector.get_value('n_module', True)):
+        x_m, y_m, angle_m = [detector.get_value(name + '_' + str(i_module), truth) for name in ['x', 'y', 'angle']]
+        module = detector.photo_sensor_modules[i_module]
+        for i_sensor in range(module.get_value('n_sensor', True)):
+            x_s, y_s, angle_s = [module.get_value(name + '_' + str(i_sensor), truth) for name in ['x', 'y', 'angle']]
+            sensor = module.photo_sensors[i_sensor]
+            properties = {name: sensor.get_value(name, truth) for name in sensor.design_properties}
+            edges = []
+            for side in [-1., 1.]:
+                x_d, y_d, angle_d = sensor.get_global_orientation([x_s + side * properties['width'] / 2. *
+                                                                   np.cos(angle_s),
+                                                                   y_s + side * properties['width'] / 2. *
+                                                                   np.sin(angle_s), angle_s],
+                                                                  [x_m, y_m, angle_m])
+                edges.append((x_d, y_d))
+
+            for sign in [-1., 1.]:
+                # a virtual photon starts at each edge of the sensor and points back towards the emitter
+                angle = angle_e + sign * emitter.get_value('ch_angle', truth) + np.pi
+                travel = []
+                dist = []
+                for x_d, y_d in edges:
+                    x, y = module.find_intersection(Photon(0., x_d, y_d, angle, [0.], [0.]), [x_e, y_e, angle_e])
+                    travel.append(np.sqrt((x - x_d) ** 2 + (y - y_d) ** 2))
+                    dist.append(min(length_e, max(0., (x - x_e) * np.cos(angle_e) + (y - y_e) * np.sin(angle_e))))
+                path_length = np.abs(dist[1] - dist[0])
+                if path_length == 0.:
+                    continue
+
+                qe = properties['qe']
+                cos_theta = np.cos(angle - angle_d - np.pi / 2.)
+                if properties['qe_angle'] and properties['qe_angle_coeff'] > 0.:
+                    qe *= 1. - np.exp(-1. / properties['qe_angle_coeff'] / cos_theta) if cos_theta > 0. else 0.
+                c_q = properties['qe_radial_coeff'] if properties['qe_radial'] else 0.
+                c_t = properties['td_radial_coeff'] if properties['td_radial'] else 0.
+                n_expected = path_length * ch_density / 2. * qe * (1. + c_q / 2.) / (1. + abs(c_q))
+                t_expected = 0.5 * (travel[0] + travel[1]) / Photon.VELOCITY + 0.5 * (dist[0] + dist[1]) / velocity_e
+                delay = properties['td'] * (1. + c_t / 2. + c_q / 2. + c_t * c_q / 3.) / (1. + c_q / 2.)
+                asimov.add_pe(i_module, i_sensor, t_expected + t0_e + delay, n_pe=n_expected)
+    return asimov
+
+
+def transport_reference(detector, photons) -> Event:
+    """Event of the photons (without dark noise), following one photon at a time through the modules and sensors
+    as done before the transport was vectorized
+    """
+    event = Event(detector)
+    n_module = detector.true_properties['n_module'].get_value()
+    for photon in photons:
+        for i_module in range(n_module):
+            x_m, y_m, angle_m = [detector.true_properties[name + '_' + str(i_module)].get_value()
+                                 for name in ['x', 'y', 'angle']]
+            module = detector.photo_sensor_modules[i_module]
+            x, y = module.find_intersection(photon, [x_m, y_m, angle_m])
+            if np.sqrt((x - x_m) ** 2 + (y - y_m) ** 2) >= module.true_properties['width'].get_value() / 2.:
+                continue
+            for i_sensor in range(module.true_properties['n_sensor'].get_value()):
+                x_s, y_s, angle_s = [module.true_properties[name + '_' + str(i_sensor)].get_value()
+                                     for name in ['x', 'y', 'angle']]
+                sensor = module.photo_sensors[i_sensor]
+                properties = {name: sensor.true_properties[name].get_value() for name in sensor.true_properties}
+                x_d, y_d, angle_d = sensor.get_global_orientation([x_s, y_s, angle_s], [x_m, y_m, angle_m])
+                x, y = sensor.find_intersection(photon, [x_d, y_d, angle_d])
+                r = np.sqrt((x - x_d) ** 2 + (y - y_d) ** 2) / (properties['width'] / 2.)
+                if r >= 1.:
+                    continue
+                qe = properties['qe']
+                if properties['qe_angle'] and properties['qe_angle_coeff'] > 0.:
+                    qe *= 1. - np.exp(-1. / properties['qe_angle_coeff'] / np.cos(photon.angle - angle_d + np.pi / 2.))
+                if properties['qe_radial']:
+                    qe *= (1. + properties['qe_radial_coeff'] * r) / (1. + abs(properties['qe_radial_coeff']))
+                if qe > photon.random_numbers_uniform[0]:
+                    t = photon.t + np.sqrt((photon.x - x) ** 2 + (photon.y - y) ** 2) / photon.VELOCITY
+                    delay = properties['td']
+                    if properties['td_radial']:
+                        delay *= 1. + properties['td_radial_coeff'] * r
+                    event.add_pe(i_module, i_sensor, t + delay + properties['t_sig'] * photon.random_numbers_norm[0])
+                break
+            break
+    return event
+
+
+def count_pe_job(detector, emitter, seed: int, settings: dict) -> dict:
+    """Sweep job for the tests: the number of pe of settings['n_event'] events (fails for emitter x in
+    settings['fail_x'])
+    """
+    if emitter.design_properties['x'].mean in settings.get('fail_x', []):
+        raise ValueError('count_pe_job: failing as requested')
+    n_pe = []
+    for i_event in range(settings['n_event']):
+        emitter.emit(settings['t0'])
+        n_pe.append(np.sum(detector.get_event(emitter).n_pe))
+    columns = {'event': np.arange(settings['n_event']), 'n_pe': np.array(n_pe)}
+    if emitter.design_properties['x'].mean == -2000.:
+        columns['label'] = np.full(settings['n_event'], 'left')
+    return columns
+
+
 class MyTestCase(unittest.TestCase):
     def test_detector(self):
         np.random.seed(seed=2334231)
@@ -120,6 +243,814 @@ class MyTestCase(unittest.TestCase):
         i = 1
         assert i == 1
 
+    def test_offsets(self):
+        np.random.seed(seed=2334231)
+
+        photosensor_design = PhotoSensor.default_properties()
+        photosensor_module_design = PhotoSensorModule.flat_mpmt_properties()
+        detector_design = Detector.default_properties()
+        my_detector = Detector(0, detector_design, photosensor_module_design, photosensor_design)
+
+        qe = photosensor_design['qe']
+        n_sensor = len(my_detector.photo_sensor_modules) * 5
+        assert len(qe.devices) == n_sensor
+        true_qe = qe.get_values().copy()
+
+        # a single offset is applied to all devices built with the property
+        qe.set_offset(-0.1)
+        sensor = my_detector.photo_sensor_modules[3].photo_sensors[2]
+        assert np.isclose(sensor.true_properties['qe'].get_value(), true_qe[3 * 5 + 2] - 0.1)
+
+        # a batch of offsets is applied with a single version stamp
+        offsets = {detector_design['x_3']: 5.5, detector_design['y_3']: -2., qe: 0.}
+        DesignProperty.set_offsets(offsets)
+        assert len(set(design_property.version for design_property in offsets)) == 1
+        assert np.allclose(qe.get_values(), true_qe)
+        assert np.isclose(my_detector.true_properties['x_3'].get_value(),
+                          detector_design['x_3'].get_values()[0])
+
+        # the batch is rejected as a whole if any offset has the wrong type
+        with self.assertRaises(TypeError):
+            DesignProperty.set_offsets({detector_design['x_4']: 1., detector_design['n_module']: 1.})
+        assert detector_design['x_4'].get_offset() == 0.
+
+    def test_configuration(self):
+        np.random.seed(seed=2334231)
+
+        detector_design = Detector.default_properties()
+        my_detector = Detector(0, detector_design, PhotoSensorModule.dome_mpmt_properties(),
+                               PhotoSensor.default_properties())
+        detector_design['x_3'].set_offset(5.5)
+        configuration = Configuration.from_device(my_detector)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'detector.npz')
+            configuration.save(filename)
+            loaded = Configuration.load(filename)
+        assert loaded.get_hash() == configuration.get_hash()
+
+        # the rebuilt detector has the same true values, offsets and geometry
+        rebuilt = loaded.build()
+        assert Configuration.from_device(rebuilt).get_hash() == configuration.get_hash()
+        assert rebuilt.design_properties['x_3'].get_offset() == 5.5
+        for truth in [True, False]:
+            geometry = my_detector.get_geometry(truth)
+            rebuilt_geometry = Geometry.from_detector(rebuilt, truth)
+            for name in geometry.sensor_table:
+                assert np.allclose(geometry.sensor_table[name], rebuilt_geometry.sensor_table[name])
+
+        # any change to the configuration changes the hash
+        detector_design['x_3'].set_offset(5.)
+        assert Configuration.from_device(my_detector).get_hash() != configuration.get_hash()
+
+    def test_cache(self):
+        np.random.seed(seed=2334231)
+
+        my_detector = Detector(0, Detector.default_properties(), PhotoSensorModule.flat_mpmt_properties(),
+                               PhotoSensor.default_properties())
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = -2000.
+        emitter_design['y'].mean = 2000.
+        my_emitter = Emitter(0, emitter_design)
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = Cache(directory)
+            event = cache.get_event(my_detector, my_emitter, [1, 0], 2.)
+            cached_event = cache.get_event(my_detector, my_emitter, [1, 0], 2.)
+            assert np.array_equal(event.n_pe, cached_event.n_pe)
+            assert np.array_equal(event.sum_t, cached_event.sum_t)
+            assert cache.hits == 1 and cache.misses == 1
+
+            # a different seed or configuration is a new entry
+            cache.get_event(my_detector, my_emitter, [1, 1], 2.)
+            emitter_design['angle'].set_offset(0.01)
+            cache.get_event(my_detector, my_emitter, [1, 0], 2.)
+            assert cache.hits == 1 and cache.misses == 3
+            assert cache.get_configuration_hash(my_emitter) == Configuration.from_device(my_emitter).get_hash()
+
+            # the least recently used entries are evicted, and so are stale temporary files
+            stale = os.path.join(directory, 'stale.tmp')
+            fresh = os.path.join(directory, 'fresh.tmp')
+            for filename in [stale, fresh]:
+                open(filename, 'wb').close()
+            os.utime(stale, (0., 0.))
+            cache.max_bytes = 1
+            cache.evict()
+            assert cache.evictions == 3
+            assert not os.path.exists(stale) and os.path.exists(fresh)
+
+    def test_compact(self):
+        # accuracy check and memory benchmark of float32 storage against float64
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = -2000.
+        emitter_design['y'].mean = 2000.
+        for module_design in [PhotoSensorModule.flat_mpmt_properties(), PhotoSensorModule.dome_mpmt_properties()]:
+            np.random.seed(seed=2334231)
+            my_detector = Detector(0, Detector.default_properties(), module_design, PhotoSensor.default_properties(),
+                                   exact=True)
+            my_emitter = Emitter(0, emitter_design, exact=True)
+            my_analyzer = Analyzer(my_detector, my_emitter)
+            parameters = {name: my_emitter.get_value(name, True) for name in ['x', 'y', 'angle', 'length']}
+            parameters['t0'] = 2.
+
+            events = {}
+            photon_bytes = {}
+            for dtype in [np.float64, np.float32]:
+                np.random.seed(seed=1)
+                my_emitter.emit(2., dtype)
+                photon_bytes[dtype] = my_emitter.photons.nbytes
+                events[dtype] = my_detector.get_event(my_emitter, dtype)
+            assert np.array_equal(events[np.float64].n_pe, events[np.float32].n_pe)
+            assert photon_bytes[np.float32] == photon_bytes[np.float64] // 2
+            assert events[np.float32].nbytes == events[np.float64].nbytes // 2
+
+            for shift in [0., 5.]:
+                parameters['x'] += shift
+                ln_l = [my_analyzer.ln_likelihood(events[dtype], parameters) for dtype in [np.float64, np.float32]]
+                assert abs(ln_l[0] - ln_l[1]) < 1.E-3
+
+            # compact list of hit sensors
+            hits = events[np.float32].get_hits()
+            assert hits['module'].dtype == np.int16
+            assert sum(hits[name].nbytes for name in hits) < events[np.float32].nbytes
+            event = Event.from_hits(my_detector, hits)
+            assert np.array_equal(event.sum_t, events[np.float32].sum_t)
+
+    def test_incremental(self):
+        np.random.seed(seed=2334231)
+
+        detector_design = Detector.default_properties()
+        photosensor_design = PhotoSensor.default_properties()
+        my_detector = Detector(0, detector_design, PhotoSensorModule.flat_mpmt_properties(), photosensor_design)
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = -2000.
+        emitter_design['y'].mean = 2000.
+        my_emitter = Emitter(0, emitter_design)
+        parameters = {'x': -2000., 'y': 2000., 'angle': -0.6, 'length': 1000., 't0': 2.}
+        my_detector.get_asimov(my_emitter, parameters, True)
+        response = my_detector.get_response(True)
+
+        # an offset of one module position invalidates that module and its sensors only
+        detector_design['y_9'].set_offset(3.)
+        asimov = my_detector.get_asimov(my_emitter, parameters, True)
+        report = my_detector.invalidated[True]
+        assert list(report['modules']) == [9]
+        assert list(report['sensors']) == [45, 46, 47, 48, 49]
+        assert my_detector.get_response(True) is response
+        assert len(my_detector.get_invalidated_sensors(False, response.version)) == 0
+
+        # a sensor property invalidates all sensors; the results agree with a full recomputation
+        photosensor_design['qe_radial_coeff'].set_offset(0.1)
+        asimov = my_detector.get_asimov(my_emitter, parameters, True)
+        geometry = Geometry.from_detector(my_detector, True)
+        n_pe, sum_t = my_detector.get_expectations(my_emitter, [list(parameters.values())], True)
+        assert np.allclose(asimov.n_pe[geometry.sensor_table['module'], geometry.sensor_table['sensor']], n_pe[0])
+        for name in geometry.sensor_table:
+            assert np.array_equal(geometry.sensor_table[name], my_detector.get_geometry(True).sensor_table[name])
+
+        # the expectations are kept for a few emitters only, the most recently used
+        emitters = [Emitter(0, emitter_design) for i_emitter in range(Detector.ASIMOV_CACHE_LENGTH + 2)]
+        for emitter in emitters + [my_emitter]:
+            my_detector.get_asimov(emitter, parameters, True)
+        assert len(my_detector.asimov_expectations) == Detector.ASIMOV_CACHE_LENGTH
+        assert list(my_detector.asimov_expectations)[-1] == (my_emitter, True)
+        assert (emitters[0], True) not in my_detector.asimov_expectations
+
+    def test_multiple_detectors(self):
+        np.random.seed(seed=2334231)
+
+        detector_design = Detector.default_properties()
+        photosensor_design = PhotoSensor.default_properties()
+        photosensor_design['qe_angle'].mean = True
+        detectors = [Detector(0, detector_design, PhotoSensorModule.flat_mpmt_properties(), photosensor_design),
+                     Detector(1, detector_design, PhotoSensorModule.dome_mpmt_properties(), photosensor_design)]
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = -2000.
+        emitter_design['y'].mean = 2000.
+        my_emitter = Emitter(0, emitter_design)
+        my_emitter.emit(2.)
+
+        # one pass through both designs gives the same events as separate passes
+        events = Detector.get_events(detectors, my_emitter)
+        for detector, event in zip(detectors, events):
+            single = detector.get_event(my_emitter)
+            assert np.array_equal(event.n_pe, single.n_pe)
+            assert np.allclose(event.sum_t, single.sum_t)
+        assert not np.array_equal(events[0].n_pe, events[1].n_pe)
+
+        # each detector of the shared pass sees the photons as in the photon by photon reference (no dark noise)
+        for detector, hits in zip(detectors, Detector.transport_detectors(detectors, my_emitter.photons)):
+            event = Event(detector)
+            event.add_pes(*hits)
+            reference = transport_reference(detector, my_emitter.photons)
+            assert np.sum(reference.n_pe) > 100
+            assert np.array_equal(event.n_pe, reference.n_pe)
+            assert np.allclose(event.sum_t, reference.sum_t)
+
+    def test_property_records(self):
+        np.random.seed(seed=2334231)
+
+        detector_design = Detector.default_properties()
+        my_detector = Detector(0, detector_design, PhotoSensorModule.dome_mpmt_properties(),
+                               PhotoSensor.default_properties())
+        detector_design['x_3'].set_offset(5.5)
+        records = my_detector.export_properties()
+        n_row = sum(len(device.design_properties) for _, device in my_detector.get_devices())
+        assert len(records) == n_row
+        row = records[(records['path'] == 'Detector_0') & (records['name'] == 'x_3')][0]
+        assert row['offset'] == 5.5 and row['value'] == my_detector.get_value('x_3', True)
+
+        # import into a detector with the same structure
+        other = Detector(0, Detector.default_properties(), PhotoSensorModule.dome_mpmt_properties(),
+                         PhotoSensor.default_properties(), exact=True)
+        other.import_properties(records)
+        assert other.design_properties['x_3'].get_offset() == 5.5
+        other_records = other.export_properties()
+        for name in records.dtype.names:
+            assert np.array_equal(records[name], other_records[name])
+
+    def test_trigger(self):
+        np.random.seed(seed=2334231)
+
+        my_detector = Detector(0, Detector.default_properties(), PhotoSensorModule.flat_mpmt_properties(),
+                               PhotoSensor.default_properties())
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = -2000.
+        emitter_design['y'].mean = 2000.
+        my_emitter = Emitter(0, emitter_design)
+        my_emitter.emit(2.)
+
+        # an accepted event is the same as without the trigger
+        event = Trigger(n_pe_min=10, n_module_min=2, n_coincidence=10, chunk_size=100).get_event(my_detector,
+                                                                                              my_emitter)
+        single = my_detector.get_event(my_emitter)
+        assert np.array_equal(event.n_pe, single.n_pe)
+        assert np.allclose(event.sum_t, single.sum_t)
+
+        # rejected before transport, during transport, and for the complete event
+        n_pe = int(np.sum(single.n_pe))
+        triggers = [Trigger(n_pe_min=len(my_emitter.photons) + 1), Trigger(n_pe_min=n_pe + 300, chunk_size=100),
+                    Trigger(n_coincidence=n_pe + 1, chunk_size=len(my_emitter.photons))]
+        for trigger in triggers:
+            assert trigger.get_event(my_detector, my_emitter) is None
+        assert triggers[0].rejected['acceptance:n_pe'] == 1
+        assert triggers[1].rejected['transport:n_pe'] == 1 and triggers[1].n_photon_skipped > 0
+        assert triggers[2].rejected['event:coincidence'] == 1
+        triggers[0].merge(triggers[1])
+        statistics = triggers[0].get_statistics()
+        assert statistics['n_event'] == 2 and statistics['n_rejected'] == 2
+
+        # photons given in chunks give the same event, and are only rejected on the complete event
+        chunks = [my_emitter.photons[start:start + 1000] for start in range(0, len(my_emitter.photons), 1000)]
+        assert len(chunks) > 1
+        np.random.seed(3)
+        event = Trigger(n_pe_min=10).get_event(my_detector, iter(chunks))
+        np.random.seed(3)
+        single = my_detector.get_event(my_emitter)
+        assert np.array_equal(event.n_pe, single.n_pe)
+        assert np.allclose(event.sum_t, single.sum_t)
+        assert np.array_equal(my_detector.stream_event(iter(chunks)).n_pe, single.n_pe)
+        trigger = Trigger(n_pe_min=n_pe + 300)
+        assert trigger.get_event(my_detector, iter(chunks)) is None
+        assert trigger.rejected['event:n_pe'] == 1 and trigger.get_statistics()['n_event'] == 1
+
+    def test_biased_emission(self):
+        np.random.seed(seed=2334231)
+
+        my_detector = Detector(0, Detector.default_properties(), PhotoSensorModule.flat_mpmt_properties(),
+                               PhotoSensor.default_properties(), exact=True)
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = 0.
+        emitter_design['y'].mean = 0.
+        emitter_design['angle'].mean = 0.3
+        my_emitter = Emitter(0, emitter_design, exact=True)
+
+        # photons of a full emission from outside the accepted intervals never cross a module
+        my_emitter.emit(2.)
+        photons = my_emitter.photons
+        dist = np.hypot(photons.x, photons.y)
+        accepted = np.zeros(len(photons), dtype=bool)
+        for sign in [-1., 1.]:
+            intervals = my_detector.get_geometry(True).get_emission_intervals(0., 0., 0.3, 0.733, sign, 1000.)
+            side = np.sign(photons.angle - 0.3) == sign
+            accepted[side] = np.any((dist[side, np.newaxis] >= intervals[:, 0]) &
+                                    (dist[side, np.newaxis] <= intervals[:, 1]), axis=1)
+        assert len(my_detector.transport(photons[np.flatnonzero(~accepted)])[0]) == 0
+
+        # the pe are those expected (Asimov), in total and for each sensor, with fewer photons
+        parameters = {name: my_emitter.get_value(name, True) for name in ['x', 'y', 'angle', 'length']}
+        parameters['t0'] = 2.
+        geometry = my_detector.get_geometry(True)
+        index = (geometry.sensor_table['module'], geometry.sensor_table['sensor'])
+        expected = my_detector.get_asimov(my_emitter, parameters, True).n_pe[index]
+        photons_per_pe = {}
+        for detector, n_event in [(None, 100), (my_detector, 300)]:
+            n_photon = 0
+            n_pe = []
+            for i_event in range(n_event):
+                my_emitter.emit(2., detector=detector)
+                n_photon += len(my_emitter.photons)
+                n_pe.append(my_detector.get_event(my_emitter).n_pe[index])
+            n_pe = np.array(n_pe)
+            photons_per_pe[detector] = n_photon / np.sum(n_pe)
+            total = np.sum(n_pe, axis=1)
+            assert abs(np.mean(total) - np.sum(expected)) < 3. * np.std(total) / np.sqrt(n_event)
+            lit = expected > 1.
+            chi2 = np.sum((np.mean(n_pe, axis=0)[lit] - expected[lit]) ** 2 / (expected[lit] / n_event))
+            assert np.sum(lit) >= 5 and chi2 < np.sum(lit) + 5. * np.sqrt(2. * np.sum(lit))
+
+        # benchmark: photons generated per detected pe (about 4.9 for full emission and 1.9 biased)
+        assert my_emitter.emission_fraction < 0.5
+        assert photons_per_pe[my_detector] < 0.5 * photons_per_pe[None]
+
+    def test_toy_events(self):
+        np.random.seed(seed=2334231)
+
+        my_detector = Detector(0, Detector.default_properties(), PhotoSensorModule.flat_mpmt_properties(),
+                               PhotoSensor.default_properties(), exact=True)
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = -2000.
+        emitter_design['y'].mean = 2000.
+        my_emitter = Emitter(0, emitter_design, exact=True)
+        simulator = ToySimulator(my_detector, my_emitter)
+
+        events = simulator.get_events(2., 1000, np.float32)
+        n_expected, t_expected = simulator.get_expectations(2.)
+        assert len(events) == 1000 and events[0].n_pe.dtype == np.float32
+        n_pe = np.array([event.n_pe for event in events])
+        assert np.all(np.abs(np.mean(n_pe, axis=0) - n_expected) < 5. * np.sqrt(n_expected / 1000.) + 1.E-9)
+
+        # the n_pe distributions agree with the full simulation, and so do the mean times of the fully
+        # illuminated sensors (not those at the edge of the light cone, see ToySimulator)
+        results = simulator.validate(2., 100)
+        assert results['ndf']['n_pe'] > 0 and results['chi2']['n_pe'] < 3. * results['ndf']['n_pe']
+        well_lit = n_expected > 0.75 * np.max(n_expected)
+        assert np.sum(well_lit) >= 5
+        assert np.all(np.abs(results['mean_t_pull'][well_lit]) < 4.)
+        assert np.all(np.abs(results['mean_t'][0] - results['mean_t'][1])[well_lit] < 0.1)
+
+    def test_ensemble_sampler(self):
+        np.random.seed(seed=2334231)
+
+        # a correlated gaussian
+        covariance = np.array([[4., 1.8], [1.8, 1.]])
+        inverse = np.linalg.inv(covariance)
+        sampler = EnsembleSampler(lambda points: -0.5 * np.einsum('ma,ab,mb->m', points, inverse, points), 2)
+        result = sampler.run(np.random.standard_normal(size=(20, 2)), 2000)
+        samples = result['chain'][200:].reshape(-1, 2)
+        tau = sampler.get_autocorrelation_time(result['chain'][200:])
+        assert np.all(tau > 1.) and np.all(tau < 100.)
+        assert np.allclose(np.cov(samples.T), covariance, atol=0.3, rtol=0.15)
+        assert 0.2 < np.mean(result['acceptance']) < 0.9
+
+        # the ln likelihood of an event for many track hypotheses at once
+        my_detector = Detector(0, Detector.default_properties(), PhotoSensorModule.flat_mpmt_properties(),
+                               PhotoSensor.default_properties(), exact=True)
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = -2000.
+        emitter_design['y'].mean = 2000.
+        my_emitter = Emitter(0, emitter_design, exact=True)
+        my_emitter.emit(2.)
+        event = my_detector.get_event(my_emitter)
+        my_analyzer = Analyzer(my_detector, my_emitter)
+        points = np.array([-2000., 2000., -0.6, 1000., 2.]) + np.random.standard_normal(size=(10, 5)) * 5.E-3
+        ln_l = my_analyzer.ln_likelihood_points(event, points)
+        for point, value in zip(points, ln_l):
+            assert np.isclose(value, my_analyzer.ln_likelihood(event, dict(zip(Analyzer.PARAMETER_NAMES, point))))
+
+        result = my_analyzer.sample(event, dict(zip(Analyzer.PARAMETER_NAMES, points[0])), n_step=60, n_burn=10,
+                                    n_walker=12)
+        assert result['samples'].shape == (12 * 50, 5) and result['tau'].shape == (5,)
+
+        # walkers starting beyond a limit are put back inside at different values, so that they can move
+        start = dict(zip(Analyzer.PARAMETER_NAMES, points[0]))
+        start['length'] = 3000.
+        result = my_analyzer.sample(event, start, n_step=5, n_burn=0, n_walker=12)
+        first = result['chain'][0, :, 3]
+        assert np.all(first <= 3000.) and len(np.unique(first)) == 12
+        assert np.all(np.isfinite(result['ln_prob'][0]))
+
+        # enough walkers by default for several tracks (2 * 20 parameters for 4 tracks)
+        emitters = [Emitter(0, emitter_design) for i_track in range(4)]
+        result = Analyzer(my_detector, emitters).sample(event, [start] * 4, n_step=10, n_burn=0)
+        assert result['chain'].shape == (10, 40, 20)
+
+    def test_streaming(self):
+        np.random.seed(seed=2334231)
+
+        my_detector = Detector(0, Detector.default_properties(), PhotoSensorModule.flat_mpmt_properties(),
+                               PhotoSensor.default_properties(), exact=True)
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = -2000.
+        emitter_design['y'].mean = 2000.
+        emitter_design['ch_density'].mean = 150.
+        my_emitter = Emitter(0, emitter_design, exact=True)
+
+        # all photons of a bright track are produced (no truncation), in chunks of at most chunk_size
+        np.random.seed(1)
+        chunks = list(my_emitter.emit_chunks(2., chunk_size=20000))
+        assert max(len(chunk) for chunk in chunks) <= 20000
+        assert sum(len(chunk) for chunk in chunks) > 140000
+
+        # the event accumulated chunk by chunk is the event of all photons
+        streamed = Detector.stream_events([my_detector], chunks)[0]
+        my_emitter.photons = PhotonBundle.concatenate(chunks)
+        event = my_detector.get_event(my_emitter)
+        assert np.array_equal(streamed.n_pe, event.n_pe)
+        assert np.allclose(streamed.sum_t, event.sum_t)
+
+        # emit gives the photons of emit_chunks with the default chunk size
+        np.random.seed(2)
+        my_emitter.emit(2.)
+        np.random.seed(2)
+        assert np.array_equal(my_emitter.photons.t, np.concatenate([chunk.t for chunk in my_emitter.emit_chunks(2.)]))
+
+    def test_fit_summary(self):
+        np.random.seed(seed=2334231)
+
+        # summaries accumulated in parts and merged are the summary of all fits
+        names = ['a', 'b']
+        values = np.random.multivariate_normal([0.1, -0.2], [[1., 0.5], [0.5, 2.]], size=3000)
+        summary = FitSummary(names)
+        parts = [FitSummary(names) for i_part in range(3)]
+        for i_fit, (a, b) in enumerate(values):
+            result = {'a': a, 'b': b, 'a_err': 1., 'b_err': np.sqrt(2.), 'valid': i_fit % 50 != 0}
+            summary.add(result, {'a': 0., 'b': 0.})
+            parts[i_fit % 3].add(result, {'a': 0., 'b': 0.})
+        parts[0].merge(parts[1])
+        parts[0].merge(parts[2])
+        whole = summary.get_summary()
+        merged = parts[0].get_summary()
+        valid = values[np.arange(len(values)) % 50 != 0]
+        assert whole['failure_rate'] == merged['failure_rate'] == 0.02
+        assert np.isclose(whole['a']['bias'], np.mean(valid[:, 0]))
+        assert np.isclose(merged['a']['bias'], whole['a']['bias'])
+        assert np.isclose(merged['b']['pull_std'], np.std(valid[:, 1], ddof=1) / np.sqrt(2.))
+        assert np.allclose(merged['covariance'], np.cov(valid.T))
+        ranks = np.searchsorted(np.sort(valid[:, 0]), merged['a']['residual_quantiles']) / len(valid)
+        assert np.all(np.abs(ranks - FitSummary.QUANTILES) < 0.02)
+
+        # a summary saved and loaded is the same
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'summary.npz')
+            parts[0].save(filename)
+            loaded = FitSummary.load(filename)
+        assert loaded.parameter_names == names and loaded.n_failed == parts[0].n_failed
+        restored = loaded.get_summary()
+        assert np.allclose(restored['covariance'], merged['covariance'])
+        assert np.array_equal(restored['a']['residual_quantiles'], merged['a']['residual_quantiles'])
+        loaded.merge(summary)
+        parts[0].merge(summary)
+        assert np.array_equal(loaded.get_summary()['b']['pull_quantiles'],
+                              parts[0].get_summary()['b']['pull_quantiles'])
+
+        # a fit without a positive error is a failure
+        summary.add({'a': 0., 'b': 0., 'a_err': 0., 'b_err': 1., 'valid': True}, {'a': 0., 'b': 0.})
+        assert summary.n_failed == 61 and summary.n == 2940
+
+    def test_visualizer(self):
+        np.random.seed(seed=2334231)
+
+        detector_design = Detector.default_properties()
+        my_detector = Detector(0, detector_design, PhotoSensorModule.flat_mpmt_properties(),
+                               PhotoSensor.default_properties())
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = -2000.
+        emitter_design['y'].mean = 2000.
+        my_emitter = Emitter(0, emitter_design)
+        my_emitter.emit(2.)
+        events = [my_detector.get_event(my_emitter) for i_event in range(3)]
+
+        import matplotlib.pyplot as plt
+        n_figure = len(plt.get_fignums())
+        with tempfile.TemporaryDirectory() as directory:
+            # headless: drawn on a figure not managed by pyplot, saved without a display
+            my_vis = Visualizer(my_detector, headless=True)
+            my_vis.draw_detector()
+            my_vis.draw_event(events[0])
+            my_vis.draw_photons(my_emitter, 50)
+            my_vis.draw_emitter(my_emitter)
+            filename = os.path.join(directory, 'event.png')
+            my_vis.savefig(filename)
+            assert os.path.getsize(filename) > 0
+            assert len(plt.get_fignums()) == n_figure
+            with self.assertRaises(RuntimeError):
+                my_vis.show()
+            my_vis.close()
+
+            # the detector is drawn as it is now
+            detector_design['y_0'].set_offset(100.)
+            my_vis.draw_detector()
+            segments = my_vis.axes.collections[0].get_segments()
+            assert np.isclose(np.mean(segments[0][:, 1]), my_detector.get_value('y_0', True))
+            my_vis.close()
+
+            # event displays rendered in worker processes
+            filenames = [os.path.join(directory, 'event_' + str(i_event) + '.png') for i_event in range(3)]
+            track = tuple(my_emitter.get_value(name, True) for name in ['x', 'y', 'angle', 'length'])
+            rendered = Visualizer.render_events(my_detector, events, filenames, tracks=[track] * 3, n_workers=2)
+            assert rendered == filenames
+            assert all(os.path.getsize(filename) > 0 for filename in filenames)
+
+    def test_geometry(self):
+        np.random.seed(seed=2334231)
+
+        detector_design = Detector.default_properties()
+        photosensor_design = PhotoSensor.default_properties()
+        for name in ['qe_angle', 'qe_radial', 'td_radial']:
+            photosensor_design[name].mean = True
+        my_detector = Detector(0, detector_design, PhotoSensorModule.dome_mpmt_properties(), photosensor_design)
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = -2000.
+        emitter_design['y'].mean = 2000.
+        my_emitter = Emitter(0, emitter_design)
+
+        # tables saved and loaded are the same
+        geometry = my_detector.get_geometry(True)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'geometry.npz')
+            geometry.save(filename)
+            loaded = Geometry.load(filename)
+        assert loaded.truth and loaded.n_module == geometry.n_module and loaded.n_sensor == geometry.n_sensor
+        for table, loaded_table in [(geometry.module_table, loaded.module_table),
+                                    (geometry.sensor_table, loaded.sensor_table),
+                                    (geometry.sensor_values, loaded.sensor_values)]:
+            assert sorted(table) == sorted(loaded_table)
+            for name in table:
+                assert np.array_equal(table[name], loaded_table[name])
+
+        # the expectations for many points agree with the sensor by sensor calculation, also after the design
+        # means have changed
+        points = np.array([-2000., 2000., -0.6, 1000., 2.]) + np.random.normal(size=(4, 5)) * [50., 50., 0.1, 50., 1.]
+        geometry_rows = (geometry.sensor_table['module'], geometry.sensor_table['sensor'])
+        for change in [False, True]:
+            if change:
+                detector_design['x_3'].mean += 20.
+                photosensor_design['qe_radial_coeff'].mean = 0.3
+            for truth in [True, False]:
+                n_pe, sum_t = my_detector.get_expectations(my_emitter, points, truth)
+                for i_point, point in enumerate(points):
+                    reference = expectations_reference(my_detector, my_emitter,
+                                                       dict(zip(Analyzer.PARAMETER_NAMES, point)), truth)
+                    assert np.allclose(n_pe[i_point], reference.n_pe[geometry_rows], rtol=1.E-5, atol=1.E-9)
+                    assert np.allclose(sum_t[i_point], reference.sum_t[geometry_rows], rtol=1.E-5, atol=1.E-9)
+                    assert np.sum(reference.n_pe) > 10.
+
+    def test_response_map(self):
+        np.random.seed(seed=2334231)
+
+        photosensor_design = PhotoSensor.default_properties()
+        for name in ['qe_angle', 'qe_radial', 'td_radial']:
+            photosensor_design[name].mean = True
+        my_detector = Detector(0, Detector.default_properties(), PhotoSensorModule.dome_mpmt_properties(),
+                               photosensor_design)
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = -2000.
+        emitter_design['y'].mean = 2000.
+        my_emitter = Emitter(0, emitter_design)
+        my_emitter.emit(2.)
+
+        # the vectorized transport reproduces the photon by photon loop
+        reference = transport_reference(my_detector, my_emitter.photons)
+        event = Event(my_detector)
+        event.add_pes(*my_detector.transport(my_emitter.photons))
+        assert np.sum(event.n_pe) > 100
+        assert np.array_equal(event.n_pe, reference.n_pe)
+        assert np.allclose(event.sum_t, reference.sum_t)
+
+        # expectations over the sensor surface are the integrals of the analytic factors
+        response = my_detector.get_response(True)
+        fine = ResponseMap.from_geometry(my_detector.get_geometry(True), n_r=2001)
+        integrated = ResponseMap(fine.angular, fine.radial, fine.delay)
+        assert np.allclose(integrated.expected_radial, response.expected_radial, rtol=1.E-6)
+        assert np.allclose(integrated.expected_delay, response.expected_delay, rtol=1.E-6)
+        assert not np.allclose(response.expected_delay, 1.)
+
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'response.npz')
+            response.save(filename)
+            loaded = ResponseMap.load(filename)
+        for name in ['angular', 'radial', 'delay', 'expected_radial', 'expected_delay']:
+            assert np.array_equal(getattr(loaded, name), getattr(response, name))
+
+        # a single row applies to all sensors
+        single = ResponseMap(response.angular[0], response.radial[0], response.delay[0])
+        index = np.arange(len(response.radial))
+        r = np.full(len(index), 0.3)
+        assert np.all(single.get_radial(index, r) == response.get_radial(index[:1], r[:1])[0])
+        assert np.allclose(single.get_expected_delay(index), response.expected_delay[0], rtol=1.E-4)
+
+        # setting maps invalidates the cached expectations
+        parameters = {name: my_emitter.get_value(name, True) for name in ['x', 'y', 'angle', 'length']}
+        parameters['t0'] = 2.
+        asimov = my_detector.get_asimov(my_emitter, parameters, False)
+        asimov_true = my_detector.get_asimov(my_emitter, parameters, True)
+        my_analyzer = Analyzer(my_detector, my_emitter)
+        n_expected, sum_t = my_analyzer.get_track_expectations(parameters)
+        half = ResponseMap(my_detector.get_response(False).angular / 2., my_detector.get_response(False).radial,
+                           my_detector.get_response(False).delay)
+        my_detector.set_response(half, False)
+        assert np.allclose(my_detector.get_asimov(my_emitter, parameters, False).n_pe, asimov.n_pe / 2.)
+        assert np.allclose(my_analyzer.get_track_expectations(parameters)[0], n_expected / 2.)
+        assert np.array_equal(my_detector.get_asimov(my_emitter, parameters, True).n_pe, asimov_true.n_pe)
+
+    def test_several_tracks(self):
+        np.random.seed(seed=2334231)
+
+        my_detector = Detector(0, Detector.default_properties(), PhotoSensorModule.flat_mpmt_properties(),
+                               PhotoSensor.default_properties())
+        emitters = []
+        parameters = []
+        for x, y, angle in [(-2000., 2000., 0.), (-2500., 1500., 0.3)]:
+            emitter_design = Emitter.default_properties()
+            emitter_design['x'].mean = x
+            emitter_design['y'].mean = y
+            emitter_design['angle'].mean = angle
+            emitters.append(Emitter(0, emitter_design))
+            emitters[-1].emit(2.)
+            parameters.append({name: emitters[-1].get_value(name, True) for name in ['x', 'y', 'angle', 'length']})
+            parameters[-1]['t0'] = 2.
+
+        # the overlaid event is the sum of the single track events of the same photons (and the dark noise)
+        np.random.seed(5)
+        overlay = my_detector.get_event(emitters)
+        singles = [Event(my_detector) for emitter in emitters]
+        for single, emitter in zip(singles, emitters):
+            single.add_pes(*my_detector.transport(PhotonBundle.from_photons(emitter.photons)))
+        np.random.seed(5)
+        dark = Event(my_detector)
+        dark.add_pes(*my_detector.get_dark_noise(0.))
+        assert np.array_equal(overlay.n_pe, singles[0].n_pe + singles[1].n_pe + dark.n_pe)
+        assert np.sum(singles[0].n_pe) > 0 and np.sum(singles[1].n_pe) > 0
+
+        # the Asimov expectations add up the same way
+        asimov = my_detector.get_asimov(emitters, parameters, True)
+        asimov_singles = [my_detector.get_asimov(emitter, pars, True) for emitter, pars in zip(emitters, parameters)]
+        assert np.allclose(asimov.n_pe, asimov_singles[0].n_pe + asimov_singles[1].n_pe)
+        assert np.allclose(asimov.sum_t, asimov_singles[0].sum_t + asimov_singles[1].sum_t)
+
+        # the likelihood and the Minuit object have 5 parameters per track
+        my_analyzer = Analyzer(my_detector, emitters)
+        names = my_analyzer.get_parameter_names()
+        assert len(names) == 10 and names[:2] == ['x_0', 'y_0'] and names[5] == 'x_1'
+        points = np.array([[pars[name] for pars in parameters for name in Analyzer.PARAMETER_NAMES]])
+        points = np.concatenate([points, points + 20.])
+        ln_l = my_analyzer.ln_likelihood_points(overlay, points)
+        assert np.isclose(ln_l[0], my_analyzer.ln_likelihood(overlay, parameters))
+        assert ln_l[0] > ln_l[1]
+        m = my_analyzer.get_minuit(overlay, parameters)
+        assert list(m.parameters) == names and len(m.limits) == 10
+        assert np.isclose(m.fcn(points[0]), -ln_l[0])
+
+    def test_sweep_build(self):
+        points = Sweep.grid({'emitter.x': [-2000., -2100.], 'module.design': ['flat', 'dome']})
+        assert len(points) == 4 and points[1] == {'emitter.x': -2000., 'module.design': 'dome'}
+
+        point = {'emitter.x': -2100., 'detector.x_3.offset': 5., 'detector.pitch': 650., 'module.design': 'dome',
+                 'module.rot_ang': 0.2}
+        my_detector, my_emitter = Sweep.build(point)
+        assert my_emitter.get_value('x', True) == -2100.
+        assert my_detector.design_properties['x_3'].get_offset() == 5.
+        assert my_detector.get_value('x_3', True) == my_detector.design_properties['x_3'].mean + 5.
+        assert my_detector.design_properties['pitch'].mean == 650.
+        assert my_detector.photo_sensor_modules[0].design_properties['angle_0'].mean == 2 * 0.2
+        with self.assertRaises(ValueError):
+            Sweep.build({'emitter.unknown': 1.})
+        with self.assertRaises(ValueError):
+            Sweep([{'analyzer.x': 1.}], 'unused')
+
+    def test_sweep_run(self):
+        points = [{'emitter.x': -2000.}, {'emitter.x': -2100.}, {'emitter.x': -2200.}]
+        settings = {'n_event': 2, 'fail_x': [-2200.]}
+        with tempfile.TemporaryDirectory() as directory:
+            # a failing job does not stop the others, which are saved
+            sweep = Sweep(points, os.path.join(directory, 'failing'), job=count_pe_job, settings=settings)
+            with self.assertRaises(RuntimeError):
+                sweep.run(n_workers=2)
+            assert sweep.is_completed(0) and sweep.is_completed(1) and not sweep.is_completed(2)
+            assert np.array_equal(sweep.collect()['job'], [0, 0, 1, 1])
+
+            # resume: completed jobs are not run again
+            settings = {'n_event': 2}
+            sweep = Sweep(points[:2], directory, job=count_pe_job, settings=settings)
+            sweep.run(n_workers=0)
+            mtimes = [os.path.getmtime(sweep.get_checkpoint(i_job)) for i_job in range(2)]
+            sweep = Sweep(points, directory, job=count_pe_job, settings=settings)
+            assert sweep.is_completed(1) and not sweep.is_completed(2)
+            results = sweep.run(n_workers=0)
+            assert [os.path.getmtime(sweep.get_checkpoint(i_job)) for i_job in range(2)] == mtimes
+            assert np.array_equal(results['job'], [0, 0, 1, 1, 2, 2])
+            assert np.array_equal(results['emitter.x'], [-2000., -2000., -2100., -2100., -2200., -2200.])
+            assert np.all(results['n_pe'] > 0)
+
+            # columns missing for some jobs are filled
+            assert list(results['label']) == ['left', 'left', '', '', '', '']
+            sweep = Sweep(points + [{'emitter.y': 2100.}], directory, job=count_pe_job, settings=settings)
+            results = sweep.run(n_workers=0)
+            assert np.all(np.isnan(results['emitter.y'][:6])) and np.all(results['emitter.y'][6:] == 2100.)
+            assert np.all(np.isnan(results['emitter.x'][6:]))
+
+            # a changed point is not completed
+            sweep = Sweep([{'emitter.x': -2050.}], directory, job=count_pe_job, settings=settings)
+            assert not sweep.is_completed(0)
+
+    def test_sweep_summary(self):
+        np.random.seed(seed=2334231)
+
+        # the second track is too short to pass the trigger
+        points = [{'emitter.length': 1000.}, {'emitter.length': 300.}]
+        base_point = {'emitter.x': -2000., 'emitter.y': 2000.}
+        with tempfile.TemporaryDirectory() as directory:
+            sweep = Sweep(points, directory, settings={'n_event': 3, 'trigger': {'n_pe_min': 700}},
+                          base_point=base_point)
+            results = sweep.run(n_workers=0)
+            summary = sweep.get_summary()
+            assert np.array_equal(results['triggered'], [True] * 3 + [False] * 3)
+
+            # the same as accumulating the fits of the triggered events directly
+            direct = FitSummary(Analyzer.PARAMETER_NAMES)
+            for i_row in np.flatnonzero(results['triggered']):
+                direct.add({name: results[name][i_row] for name in results},
+                           {name: results[name + '_true'][i_row] for name in Analyzer.PARAMETER_NAMES})
+            assert summary.n_fit == direct.n_fit == 3 and summary.n_failed == direct.n_failed
+            whole = summary.get_summary()
+            expected = direct.get_summary()
+            for name in Analyzer.PARAMETER_NAMES:
+                for statistic in ['bias', 'rms', 'pull_mean', 'mean_error']:
+                    assert np.allclose(whole[name][statistic], expected[name][statistic], equal_nan=True)
+            assert sweep.get_summary(jobs=[1]).n_fit == 0
+
+            # a running job saves its summary as it goes, and it is merged with those of the completed jobs
+            running = Sweep(points + [{'emitter.length': 900.}], directory,
+                            settings={'n_event': 3, 'trigger': {'n_pe_min': 700}}, base_point=base_point)
+            assert running.get_summary().n_fit == 3
+            my_detector, my_emitter = Sweep.build(running.points[2])
+            settings = dict(running.settings, summary_file=running.get_summary_file(2), summary_interval=2)
+            columns = Sweep.fit_events(my_detector, my_emitter, 3, settings)
+            partial = FitSummary.load(running.get_summary_file(2))
+            direct = FitSummary(Analyzer.PARAMETER_NAMES)
+            for i_row in range(2):
+                direct.add({name: columns[name][i_row] for name in columns},
+                           {name: columns[name + '_true'][i_row] for name in Analyzer.PARAMETER_NAMES})
+            assert partial.n_fit == 2 and partial.n_failed == direct.n_failed
+            assert np.allclose(partial.get_summary()['x']['bias'], direct.get_summary()['x']['bias'], equal_nan=True)
+            assert running.get_summary().n_fit == 5
+
+            # the results of other jobs are not summarized
+            other = Sweep(points, os.path.join(directory, 'other'), job=count_pe_job, settings={'n_event': 2})
+            other.run(n_workers=0)
+            assert other.get_summary().n_fit == 0
+
+    def test_import_time(self):
+        # benchmark of the cold start: the simulation and likelihood core must import with only numpy (the heavy
+        # libraries are imported when first used), timed in a new process after numpy itself is imported
+        code = ('import sys, time; import numpy; start = time.perf_counter(); '
+                'import cher2d.Detector, cher2d.Analyzer; print(time.perf_counter() - start); '
+                'print(" ".join(name for name in ["scipy", "iminuit", "texttable", "matplotlib"] '
+                'if name in sys.modules))')
+        package_directory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        output = subprocess.run([sys.executable, '-c', code], cwd=package_directory, capture_output=True,
+                                text=True, check=True).stdout.split('\n')
+        assert output[1] == ''
+        # generous bound for slow or busy machines: the import takes about 0.01 s (0.5 s more with iminuit and pyplot)
+        assert float(output[0]) < 2.
+
+    def test_expected_resolution(self):
+        photosensor_design = PhotoSensor.default_properties()
+        my_detector = Detector(0, Detector.default_properties(), PhotoSensorModule.dome_mpmt_properties(),
+                               photosensor_design, exact=True)
+        emitter_design = Emitter.default_properties()
+        emitter_design['x'].mean = -3000.
+        emitter_design['y'].mean = 3300.
+        emitter_design['length'].mean = 1500.
+        my_emitter = Emitter(0, emitter_design, exact=True)
+        my_analyzer = Analyzer(my_detector, my_emitter)
+
+        parameters = {'x': -3000., 'y': 3300., 'angle': -0.6, 'length': 1500., 't0': 2.}
+        resolution = my_analyzer.get_expected_resolution(parameters)
+
+        # for an Asimov event, the Hessian of -ln L at the true parameters is the Fisher information
+        asimov = my_detector.get_asimov(my_emitter, parameters, False)
+        point = np.array([parameters[name] for name in Analyzer.PARAMETER_NAMES])
+        steps = Analyzer.FISHER_STEPS / 5.
+        hessian = np.zeros((5, 5))
+        for a in range(5):
+            for b in range(5):
+                terms = []
+                for sign_a, sign_b in [(1, 1), (1, -1), (-1, 1), (-1, -1)]:
+                    shifted = point + sign_a * steps[a] * np.eye(5)[a] + sign_b * steps[b] * np.eye(5)[b]
+                    pars = dict(zip(Analyzer.PARAMETER_NAMES, shifted))
+                    terms.append(-sign_a * sign_b * my_analyzer.ln_likelihood(asimov, pars))
+                hessian[a, b] = np.sum(terms) / 4. / steps[a] / steps[b]
+        errors = np.sqrt(np.diag(np.linalg.inv(hessian)))
+        assert np.allclose(errors, resolution['errors'], rtol=0.02)
+
+        # many track hypotheses at once
+        points = np.array([point, point + [100., 0., 0., 0., 0.]])
+        resolutions = my_analyzer.get_expected_resolution(points)
+        assert resolutions['covariance'].shape == (2, 5, 5)
+        assert np.allclose(resolutions['errors'][0], resolution['errors'])
+
 
 if __name__ == '__main__':
     unittest.main()